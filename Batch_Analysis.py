@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script runs the analysis scripts on every .abf file present in a data folder without asking the user anything.
+
+How the script works:
+1. Reads the metadata sheet of the experiment. The sheet must have the same layout as Sample_data/Sample_data_info.xlsx
+   (columns Trace_ID, Python_Script, Rig ID, Opsin, Wavelength, Irradiance_Range) and can be an .xlsx or a .csv file
+2. Finds all .abf files in the data folder and matches each of them to the metadata row(s) with the same Trace_ID
+3. Transforms the metadata of each trace into the answers the analysis script would otherwise ask for
+4. Runs the analysis script named in Python_Script for the trace. Traces are analysed in parallel, one per CPU core (--workers)
+   Single trace data and figures are saved in Analysis_output exactly as when running the script by hand
+   A trace listed with several scripts (e.g. the excitatory and inhibitory current clamp analyses of a cell) is analysed
+   by all of them one after the other in the same worker: the trace is opened, and its pulses, spikes and epochs are
+   found, once and shared by the scripts (see traceIndex). --no-shared-index runs each script on its own
+5. Once all traces are analysed, adds their rows to the master .csv files in the order of the sorted file names, so that
+   the masters do not depend on which trace finished first. Rows of a trace already present in a master are replaced:
+   running the same batch twice gives the same master files
+6. Figures of each trace are drawn by separate render processes (--render-workers) as soon as the trace is analysed and
+   saved in Analysis_output/Figures, so that plotting does not slow down the analysis. --no-figures skips them and
+   --fit-plots adds the monoexponential fits of every pulse (one multipage .pdf per trace), see plotRendering
+7. Prints and saves (Analysis_output/Batch_log.csv) a summary of which traces were analysed, skipped or failed
+8. Saves the time and peak memory of each stage of each trace (see stageTiming) in Analysis_output/Stage_timing_traces.csv
+   and their total / mean / max per analysis script and stage in Analysis_output/Stage_timing_summary.csv
+
+Two optional columns can be added to the metadata sheet for traces that need extra information:
+LED_frequency_Hz: LED frequency tested, needed by Excitatory_Opsin_Current_Clamp_Frequency
+LED_steps_V: LED steps in V separated by commas (e.g. 1.2, 1.8), used instead of the scale found by the scripts when
+the LED analog input was recorded with the wrong scale (see ledPower.get_LED_steps)
+Python_Script can be auto: the analysis script is then recognised from the protocol and stimulus of the trace (see
+protocolClassifier) by the worker analysing it, at the start of its analysis, and traces recognised with a confidence below protocolClassifier.min_confidence fail. A trace
+recognised as Excitatory_Opsin_Current_Clamp_Frequency without LED_frequency_Hz gets the frequency of its LED train
+
+Usage from a terminal:
+python Batch_Analysis.py Sample_data --metadata Sample_data/Sample_data_info.xlsx --workers 4
+Without any argument the Sample_data folder and Sample_data_info.xlsx sheet are used with one worker per CPU core.
+Use --workers 1 to analyse the traces one after the other in the same process (easier to debug).
+Use --no-figures to only extract the data, or --fit-plots to check the monoexponential fits.
+Use --no-shared-index to compare the analyses of a trace run on their own with the shared run.
+"""
+
+import argparse
+import contextlib
+import glob
+import os
+import runpy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use('Agg') ## figures are drawn without opening a window so that the batch never waits on the user
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import analysisSession
+import ledPower
+import plotRendering
+import protocolClassifier
+import resultsStore
+import stageTiming
+import traceCache
+import traceIndex
+
+wdir = os.path.dirname(os.path.abspath(__file__)) ## analysis scripts, LED power tables and Analysis_output all live here
+
+
+"""
+Dictionaries used to transform the metadata into the numbers typed by the user when running the scripts by hand
+"""
+rig_answer_dict = {
+        'Rig 1' : 1 ,
+        'Rig 2' : 2
+        }
+
+cell_type_answer_dict = {
+        'WT' : 0 ,
+        'ChR2' : 1 ,
+        'CoChR' : 2 ,
+        'Chrimson' : 3 ,
+        'ReaChR' : 4 ,
+        'Chronos' : 5 ,
+        'Cheriff' : 6 ,
+        'GtACR1' : 7 ,
+        'GtACR2' : 8 ,
+        'NpHR3.0' : 9 ,
+        'NpHR' : 9 ,
+        'Arch3.0' : 10 ,
+        'Arch' : 10
+        }
+
+LED_wavelength_answer_dict = {
+        '475' : 1 ,
+        '520' : 2 ,
+        '543' : 3 ,
+        '575' : 4 ,
+        '630' : 5
+        }
+
+LED_stim_type_answer_dict = {
+        'LED_475_2%' : 1 ,
+        'LED_475_20%' : 2 ,
+        'LED_475_50%' : 3 ,
+        'LED_475_100%' : 4 ,
+        'LED_520_50%' : 5 ,
+        'LED_520_100%' : 6 ,
+        'LED_543_50%' : 7 ,
+        'LED_543_100%' : 8 ,
+        'LED_575_50%' : 9 ,
+        'LED_575_100%' : 10 ,
+        'LED_630_50%' : 11 ,
+        'LED_630_100%' : 12
+        }
+
+auto_script_name = 'auto' ## Python_Script of the traces whose analysis script is recognised by protocolClassifier
+
+script_name_alias_dict = {
+        'Excitatory_Opsin_Frequency_Current_Clamp' : 'Excitatory_Opsin_Current_Clamp_Frequency' ## name used in Sample_data_info.xlsx
+        }
+
+
+def clean_metadata_value(value):
+    """
+    Returns the metadata value as a clean string, or None when the cell is empty or na.
+    Excel cells can contain invisible characters (byte order mark) and numbers are read as floats (630.0)
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).replace('\ufeff', '').strip()
+    if value == '' or value.lower() == 'na':
+        return None
+    return value
+
+
+def load_metadata(metadata_path):
+    """
+    Opens the metadata sheet (.xlsx or .csv) and returns it as a dataframe with clean string values.
+    """
+    if metadata_path.lower().endswith('.csv'):
+        metadata = pd.read_csv(metadata_path, dtype = object)
+    else:
+        metadata = pd.read_excel(metadata_path, dtype = object)
+    metadata.columns = [str(column).replace('\ufeff', '').strip() for column in metadata.columns]
+
+    for column in ['Trace_ID', 'Python_Script']:
+        if column not in metadata.columns:
+            raise ValueError ('Metadata sheet ' + str(metadata_path) + ' has no ' + column + ' column')
+
+    metadata = metadata.apply(lambda column: column.map(clean_metadata_value))
+    metadata = metadata.dropna(subset = ['Trace_ID', 'Python_Script'])
+    return metadata
+
+
+def lookup_answer(answer_dict, value, metadata_name):
+    if value is None:
+        return None
+    for key, answer in answer_dict.items():
+        if key.lower() == value.lower():
+            return answer
+    raise ValueError ('Unknown ' + metadata_name + ' in metadata: ' + value)
+
+
+def metadata_to_answers(metadata_row):
+    """
+    Transforms one row of the metadata sheet into the answers expected by analysisSession.ask().
+    """
+    rig = metadata_row.get('Rig ID')
+    if rig is not None and not rig.startswith('Rig'):
+        rig = 'Rig ' + rig
+
+    trace_answers = {
+            'rig' : lookup_answer(rig_answer_dict, rig, 'Rig ID'),
+            'cell_type' : lookup_answer(cell_type_answer_dict, metadata_row.get('Opsin'), 'Opsin'),
+            'LED_wavelength' : lookup_answer(LED_wavelength_answer_dict, metadata_row.get('Wavelength'), 'Wavelength'),
+            'LED_stim_type' : lookup_answer(LED_stim_type_answer_dict, metadata_row.get('Irradiance_Range'), 'Irradiance_Range'),
+            'LED_frequency' : metadata_row.get('LED_frequency_Hz'),
+            'LED_steps_V' : metadata_row.get('LED_steps_V')
+            }
+    return trace_answers
+
+
+def get_script_path(script_name):
+    script_name = script_name_alias_dict.get(script_name, script_name)
+    script_path = os.path.join(wdir, script_name + '.py')
+    if not os.path.isfile(script_path):
+        raise ValueError ('Analysis script ' + script_name + '.py not found in ' + wdir)
+    return script_path
+
+
+def classify_trace(file_path, trace_answers):
+    """
+    Recognises the analysis script of a trace listed with Python_Script = auto (see protocolClassifier).
+    Returns the script name and the answers, with the frequency of the LED train added for
+    Excitatory_Opsin_Current_Clamp_Frequency when the metadata gives none.
+    """
+    abf = traceCache.load_trace(file_path)
+    classification = protocolClassifier.classify(abf)
+    script_name, confidence = classification['Python_Script'], classification['confidence']
+    if confidence < protocolClassifier.min_confidence:
+        raise ValueError ('Protocol ' + repr(abf.protocol) + ' not recognised: ' + script_name + ' or ' + classification['runner_up']
+                          + ' (confidence ' + str(round(confidence, 2)) + ' below ' + str(protocolClassifier.min_confidence) + ')')
+    print ('Trace ' + str(abf.abfID) + ' recognised as ' + script_name + ' (confidence ' + str(round(confidence, 2)) + ')')
+    if script_name == 'Excitatory_Opsin_Current_Clamp_Frequency' and trace_answers['LED_frequency'] is None:
+        trace_answers = dict(trace_answers, LED_frequency = str(round(classification['LED_train_Hz'], 1)))
+    return script_name, trace_answers
+
+
+def run_trace(file_path, script_name, trace_answers, figures = True, fit_plots = False, track_memory = True):
+    """
+    Runs one analysis script on one .abf file using pre-registered answers instead of user prompts.
+    Returns the list of (master name, dataframe) rows the script produced for the master .csv files,
+    the list of figure jobs to be drawn by a render process and the stage times of the script (see stageTiming).
+    If the script fails the stage times measured until the error are attached to the error (stage_times attribute).
+    """
+    script_path = get_script_path(script_name)
+    analysisSession.start(dict(trace_answers, file_path = file_path), collect_master_rows = True)
+    plotRendering.start(collect_figures = True, draw = figures, draw_fit_plots = fit_plots)
+    stageTiming.start(memory = track_memory, batch = True)
+    try:
+        runpy.run_path(script_path, run_name = '__main__')
+    except Exception as error:
+        error.stage_times = stageTiming.stop()
+        raise
+    finally:
+        master_rows = analysisSession.stop()
+        figure_jobs = plotRendering.stop()
+        stage_times = stageTiming.stop()
+        plt.close('all') ## in case a script still draws a figure itself, free its memory
+    return master_rows, figure_jobs, stage_times
+
+
+def analyse_trace(trace_job, figures = True, fit_plots = False, track_memory = True):
+    """
+    Runs one trace of the batch, in a worker process or in the main process when --workers 1.
+    1st term = (trace ID, .abf file path, script name, answers), script name auto = recognised here (see classify_trace)
+    Returns (status, message, master rows, figure jobs, stage times, script name). Errors are caught so that one bad trace never stops the batch.
+    """
+    trace_id, file_path, script_name, trace_answers = trace_job
+    try:
+        if script_name.lower() == auto_script_name:
+            script_name, trace_answers = classify_trace(file_path, trace_answers)
+        print ('Analysing trace ' + trace_id + ' with ' + script_name)
+        master_rows, figure_jobs, stage_times = run_trace(file_path, script_name, trace_answers, figures, fit_plots, track_memory)
+    except Exception as error: ## keep going with the rest of the folder, the error is reported in the log
+        print ('Trace ' + trace_id + ' failed: ' + repr(error) + '\n')
+        return 'failed', repr(error), [], [], getattr(error, 'stage_times', {'stages': []}), script_name
+    return 'analysed', '', master_rows, figure_jobs, stage_times, script_name
+
+
+def analyse_recording(recording_jobs, figures = True, fit_plots = False, track_memory = True, shared_index = True):
+    """
+    Runs all analyses of one .abf file one after the other in the same process.
+    1st term = list of trace jobs (see analyse_trace) of the same .abf file
+    shared_index = True to open the trace and find its pulses, spikes and epochs only once for all analyses (see traceIndex)
+    Returns the result of analyse_trace() for each trace job, in order.
+    """
+    if shared_index:
+        traceIndex.start()
+    try:
+        return [analyse_trace(trace_job, figures, fit_plots, track_memory) for trace_job in recording_jobs]
+    finally:
+        traceIndex.stop()
+
+
+def start_render_pool(render_workers, figures):
+    """
+    Returns the processes drawing the figures (to use in a with statement), no process is started when figures are not drawn (render pool = None).
+    """
+    if not figures:
+        return contextlib.nullcontext()
+    return ProcessPoolExecutor(max_workers = max(render_workers, 1))
+
+
+def render_trace_figures(render_pool, job_no, figure_jobs):
+    """
+    Hands the figure jobs of one trace to the render processes and returns (trace job number, figure path, future) for each of them.
+    """
+    return [(job_no, figure_job[0], render_pool.submit(plotRendering.render_figure_job, figure_job)) for figure_job in figure_jobs]
+
+
+def wait_for_figures(render_futures):
+    """
+    Waits until all figures are saved. A figure that cannot be drawn is reported but does not fail its trace.
+    Returns the number of figures saved and a dictionary trace job number -> time spent drawing its figures (s).
+    """
+    figure_no = 0
+    render_times = {}
+    for job_no, figure_path, render_future in render_futures:
+        try:
+            render_times[job_no] = render_times.get(job_no, 0.0) + render_future.result()
+            figure_no += 1
+        except Exception as error:
+            print ('Figure ' + figure_path + ' could not be drawn: ' + repr(error))
+    return figure_no, render_times
+
+
+def summarise_stage_times(trace_jobs, trace_results, render_times):
+    """
+    Puts the stage times of all traces of the batch together.
+    Returns a dataframe with one row per trace and stage (render = time spent drawing the figures in the render processes,
+    not included in the total time of the trace) and a dataframe with the total / mean / max time and the max peak memory
+    of each stage for each analysis script.
+    """
+    stage_rows = []
+    for job_no, (trace_job, trace_result) in enumerate(zip(trace_jobs, trace_results)):
+        trace_record = trace_result[4]
+        stages = list(trace_record['stages'])
+        stages.append({'stage': 'total', 'time_s': trace_record.get('total_time_s', 0.0), 'peak_memory_MB': max([stage['peak_memory_MB'] for stage in stages] or [0.0]), 'calls': 1})
+        if job_no in render_times:
+            stages.append({'stage': 'render', 'time_s': render_times[job_no], 'peak_memory_MB': np.nan, 'calls': 1})
+        for stage in stages:
+            stage_rows.append({'trace_number': trace_job[0], 'script': trace_result[5], 'protocol': trace_record.get('protocol'),
+                               'status': trace_result[0], 'stage': stage['stage'], 'time_s': stage['time_s'],
+                               'peak_memory_MB': stage['peak_memory_MB'], 'calls': stage['calls']})
+
+    trace_stage_times = pd.DataFrame(stage_rows, columns = ['trace_number', 'script', 'protocol', 'status', 'stage', 'time_s', 'peak_memory_MB', 'calls'])
+    stage_summary = trace_stage_times.groupby(['script', 'stage'], sort = False).agg(
+            traces = ('trace_number', 'count'),
+            total_time_s = ('time_s', 'sum'),
+            mean_time_s = ('time_s', 'mean'),
+            max_time_s = ('time_s', 'max'),
+            slowest_trace = ('time_s', lambda stage_time: trace_stage_times.loc[stage_time.idxmax(), 'trace_number']),
+            max_peak_memory_MB = ('peak_memory_MB', 'max')).reset_index()
+    return trace_stage_times, stage_summary
+
+
+def run_batch(data_folder, metadata_path, workers = None, render_workers = 2, figures = True, fit_plots = False, track_memory = True, shared_index = True):
+    """
+    Analyses all .abf files of data_folder and returns a dataframe summarising what happened to each of them,
+    and the stage times of the traces (see summarise_stage_times).
+    workers = number of worker processes (None = one per CPU core, 1 = no worker process)
+    render_workers = number of processes drawing the figures while the traces are analysed
+    figures = False to skip all figures, fit_plots = True to also draw the monoexponential fits
+    track_memory = False to only measure the time of each stage and not its peak memory
+    shared_index = False to run each analysis of a trace on its own, without sharing the trace between them (see analyse_recording)
+    """
+    metadata = load_metadata(metadata_path)
+    abf_files = sorted(glob.glob(os.path.join(data_folder, '*.abf')))
+    print ('Found ' + str(len(abf_files)) + ' .abf files in ' + str(data_folder) + '\n')
+
+    batch_log = []
+    trace_jobs = []
+    for file_path in abf_files:
+        trace_id = os.path.splitext(os.path.basename(file_path))[0]
+        trace_metadata = metadata[metadata['Trace_ID'] == trace_id]
+
+        if trace_metadata.empty:
+            print ('Trace ' + trace_id + ' skipped: no metadata found\n')
+            batch_log.append({'trace_number': trace_id, 'script': np.nan, 'status': 'skipped', 'message': 'no metadata found'})
+            continue
+
+        for _, metadata_row in trace_metadata.iterrows(): ## one trace can be listed several times to be analysed with different scripts
+            script_name = metadata_row['Python_Script']
+            try:
+                trace_answers = metadata_to_answers(metadata_row) ## Python_Script = auto is recognised by the worker (see analyse_trace)
+            except Exception as error: ## wrong metadata, keep going with the rest of the folder
+                print ('Trace ' + trace_id + ' failed: ' + repr(error) + '\n')
+                batch_log.append({'trace_number': trace_id, 'script': script_name, 'status': 'failed', 'message': repr(error)})
+                continue
+            trace_jobs.append((trace_id, file_path, script_name, trace_answers))
+
+    for rig, rig_answer in rig_answer_dict.items():
+        if any(trace_job[3]['rig'] == rig_answer for trace_job in trace_jobs):
+            for calibration in ledPower.get_calibrations(rig)[1]: ## LED power tables read once here, the workers load the compiled tables
+                ledPower.compile_power_table(calibration, rig)
+
+    recordings = {} ## .abf file -> job numbers of its analyses, each recording is analysed by one worker
+    for job_no, trace_job in enumerate(trace_jobs):
+        recordings.setdefault(trace_job[1] if shared_index else job_no, []).append(job_no)
+
+    workers = workers or os.cpu_count() or 1
+    trace_results = [None] * len(trace_jobs) ## kept in the order of trace_jobs, whatever finishes first
+    render_futures = []
+    with start_render_pool(render_workers, figures) as render_pool:
+        if workers == 1 or len(recordings) < 2:
+            for recording_job_nos in recordings.values():
+                recording_results = analyse_recording([trace_jobs[job_no] for job_no in recording_job_nos], figures, fit_plots, track_memory, shared_index)
+                for job_no, trace_result in zip(recording_job_nos, recording_results):
+                    trace_results[job_no] = trace_result
+                    render_futures.extend(render_trace_figures(render_pool, job_no, trace_result[3]))
+        else:
+            with ProcessPoolExecutor(max_workers = min(workers, len(recordings))) as executor:
+                recording_futures = {executor.submit(analyse_recording, [trace_jobs[job_no] for job_no in recording_job_nos], figures, fit_plots, track_memory, shared_index):
+                                     recording_job_nos for recording_job_nos in recordings.values()}
+                for recording_future in as_completed(recording_futures): ## figures of a recording are drawn as soon as it is analysed
+                    for job_no, trace_result in zip(recording_futures[recording_future], recording_future.result()):
+                        trace_results[job_no] = trace_result
+                        render_futures.extend(render_trace_figures(render_pool, job_no, trace_result[3]))
+        figure_no, render_times = wait_for_figures(render_futures)
+    if figure_no:
+        print ('Saved ' + str(figure_no) + ' figures in ' + plotRendering.figure_folder)
+
+    master_rows = []
+    for trace_job, (status, message, trace_master_rows, trace_figure_jobs, trace_stage_times, script_name) in zip(trace_jobs, trace_results):
+        batch_log.append({'trace_number': trace_job[0], 'script': script_name, 'status': status, 'message': message})
+        master_rows.extend(trace_master_rows)
+
+    if master_rows:
+        resultsStore.merge_into_masters(master_rows)
+
+    batch_log = pd.DataFrame(batch_log, columns = ['trace_number', 'script', 'status', 'message'])
+    batch_log = batch_log.sort_values('trace_number', kind = 'mergesort').reset_index(drop = True) ## same order as the sorted file names
+    return batch_log, summarise_stage_times(trace_jobs, trace_results, render_times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Analyse all .abf files of a folder using the metadata sheet instead of user prompts')
+    parser.add_argument('data_folder', nargs = '?', default = os.path.join(wdir, 'Sample_data'), help = 'folder containing the .abf files')
+    parser.add_argument('--metadata', default = None, help = 'metadata sheet (.xlsx or .csv), default = Sample_data_info.xlsx inside the data folder')
+    parser.add_argument('--workers', type = int, default = None, help = 'number of traces analysed in parallel, default = number of CPU cores')
+    parser.add_argument('--render-workers', type = int, default = 2, help = 'number of processes drawing the figures in the background, default = 2')
+    parser.add_argument('--no-figures', action = 'store_true', help = 'do not draw any figure')
+    parser.add_argument('--fit-plots', action = 'store_true', help = 'also draw the monoexponential fit of every pulse (one .pdf per trace)')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'only measure the time of each stage, not its peak memory')
+    parser.add_argument('--no-shared-index', action = 'store_true', help = 'run each analysis of a trace on its own instead of sharing the trace between them')
+    args = parser.parse_args()
+
+    data_folder = os.path.abspath(args.data_folder)
+    metadata_path = os.path.abspath(args.metadata) if args.metadata else os.path.join(data_folder, 'Sample_data_info.xlsx')
+
+    os.chdir(wdir) ## analysis scripts save their output relative to their own folder
+    batch_log, (trace_stage_times, stage_summary) = run_batch(data_folder, metadata_path, workers = args.workers, render_workers = args.render_workers,
+                                                             figures = not args.no_figures, fit_plots = args.fit_plots, track_memory = not args.no_memory,
+                                                             shared_index = not args.no_shared_index)
+    batch_log.to_csv(os.path.join('Analysis_output', 'Batch_log.csv'), header = True)
+    trace_stage_times.to_csv(os.path.join('Analysis_output', 'Stage_timing_traces.csv'), index = False)
+    stage_summary.to_csv(os.path.join('Analysis_output', 'Stage_timing_summary.csv'), index = False)
+
+    print ('\nTime per stage (s), all traces:')
+    print (stage_summary.pivot(index = 'stage', columns = 'script', values = 'total_time_s').round(3).to_string())
+
+    print ('\nBatch finished: ' + str((batch_log['status'] == 'analysed').sum()) + ' analysed, '
+           + str((batch_log['status'] == 'skipped').sum()) + ' skipped, '
+           + str((batch_log['status'] == 'failed').sum()) + ' failed')
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script times every analysis script on synthetic recordings of increasing size and keeps the results of every run,
+so that a change making the analysis slower (or faster) is visible from one version of the scripts to the next.
+
+How the script works:
+1. Writes one synthetic .abf file per analysis script and scale in Benchmark_data/<scale>/ (see syntheticTraces and
+   benchmark_scales). Each file is only written again when its parameters change (or with --regenerate)
+2. Runs the analysis script on each file in a new process, exactly as Batch_Analysis does, using the metadata of the
+   synthetic protocol as answers. The scripts save their output in Benchmark_data/work/Analysis_output so that the real
+   Analysis_output folder is never touched
+   The decoded traces are removed from the trace cache before each run (see traceCache), so that the load stage always
+   reads the .abf file. With --warm-cache each trace is opened once before it is timed, to measure runs starting from the cache
+3. Records the time and peak memory of each stage of the script (see stageTiming), the total time of the trace and
+   whether the trace was analysed or failed (the stages run until the error are still recorded)
+4. Appends the results to Benchmark_results/benchmark_history.csv together with the git revision of the scripts,
+   the date, the computer and the versions of python, numpy, pandas and pyabf
+5. Prints the total time of each analysis and scale next to the last run of another revision on the same computer,
+   and flags the traces that got slower or faster by more than --tolerance
+
+Scales (sizes of the recordings made on our rigs):
+sweep  = a single sweep of each protocol (1 to 8.5 s)
+sample = same size as the traces of Sample_data (default protocols of syntheticTraces)
+long   = 10 times more sweeps, 1 min of 10Hz LED train at 50kHz, 10 min gap-free recording
+hour   = hour-long gap-free recording at 20kHz (Gapfree_AP_stim only, 576MB file). Not run by default
+
+Usage from a terminal:
+python Benchmark_Analysis.py                                          (sweep, sample and long scales, all scripts)
+python Benchmark_Analysis.py --scales hour --analyses Gapfree_AP_stim
+python Benchmark_Analysis.py --repeat 3                               (every trace is run 3 times, the median is compared)
+python Benchmark_Analysis.py --warm-cache                             (traces are loaded from the trace cache)
+python Benchmark_Analysis.py --compare 3150d04                        (compare the last run with revision 3150d04, nothing is run)
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import matplotlib
+matplotlib.use('Agg') ## figures are drawn without opening a window
+import numpy as np
+import pandas as pd
+import pyabf
+
+import Batch_Analysis
+import plotRendering
+import syntheticTraces
+import traceCache
+
+wdir = os.path.dirname(os.path.abspath(__file__))
+data_folder = os.path.join(wdir, 'Benchmark_data') ## synthetic .abf files and output of the analysis scripts (can be deleted)
+results_folder = os.path.join(wdir, 'Benchmark_results')
+history_name = 'benchmark_history.csv'
+
+"""
+Parameters changed from the default protocols of syntheticTraces for each scale
+"""
+benchmark_scales = {
+        'sweep' : {
+                'Excitatory_Opsin_Voltage_Clamp' : {'sweep_count' : 1} ,
+                'Inhibitory_Opsin_Voltage_Clamp' : {'sweep_count' : 1} ,
+                'Excitatory_Opsin_Current_Clamp' : {'sweep_count' : 1} ,
+                'Inhibitory_Opsin_Current_Clamp' : {'sweep_count' : 1} ,
+                'Excitatory_Opsin_Current_Clamp_Frequency' : {'sweep_duration_s' : 1.0} ,
+                'Gapfree_AP_stim' : {'sweep_duration_s' : 1.0, 'current_onsets_s' : [0.5]} ,
+                'Inhibitory_Opsin_CC_Long_AP_Inhibit' : {'sweep_count' : 1} ,
+                'Inhibitory_Opsin_CC_Short_AP_Inhibit' : {'sweep_count' : 1}
+                } ,
+        'sample' : {analysis_name : {} for analysis_name in syntheticTraces.protocols} ,
+        'long' : {
+                'Excitatory_Opsin_Voltage_Clamp' : {'sweep_count' : 70} ,
+                'Inhibitory_Opsin_Voltage_Clamp' : {'sweep_count' : 70} ,
+                'Excitatory_Opsin_Current_Clamp' : {'sweep_count' : 70} ,
+                'Inhibitory_Opsin_Current_Clamp' : {'sweep_count' : 70} ,
+                'Excitatory_Opsin_Current_Clamp_Frequency' : {'sweep_duration_s' : 60.0, 'LED_frequency_Hz' : 10.0, 'protocol' : '7B CC 10 Hz light step 5ms',
+                                                              'metadata' : dict(syntheticTraces.protocols['Excitatory_Opsin_Current_Clamp_Frequency']['metadata'], LED_frequency_Hz = '10.0')} ,
+                'Gapfree_AP_stim' : {'sweep_duration_s' : 600.0} ,
+                'Inhibitory_Opsin_CC_Long_AP_Inhibit' : {'sweep_count' : 30} ,
+                'Inhibitory_Opsin_CC_Short_AP_Inhibit' : {'sweep_count' : 100}
+                } ,
+        'hour' : {
+                'Gapfree_AP_stim' : {'sweep_duration_s' : 3600.0}
+                }
+        }
+
+default_scales = ['sweep', 'sample', 'long']
+
+history_columns = ['run_id', 'date', 'revision', 'host', 'python', 'numpy', 'pandas', 'pyabf', 'scale', 'analysis', 'trace_number',
+                   'trace_cache', 'duration_s', 'sampling_rate', 'channels', 'file_MB', 'repeat', 'status', 'message', 'stage', 'time_s', 'peak_memory_MB', 'calls']
+
+
+def get_revision():
+    """
+    Returns the git revision of the scripts (+ '-dirty' when they have uncommitted changes), 'unknown' outside of git.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd = wdir, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_benchmark_trace(scale, analysis_name, regenerate = False):
+    """
+    Writes the synthetic .abf file of one analysis script and scale, unless it already exists with the same parameters
+    and was written by the same version of syntheticTraces. Returns (file path, recording from syntheticTraces.make_recording, file size in MB).
+    """
+    recording = syntheticTraces.make_recording(analysis_name, **benchmark_scales[scale][analysis_name])
+    file_path = os.path.join(data_folder, scale, analysis_name + '_' + scale + '.abf')
+    parameter_path = os.path.splitext(file_path)[0] + '.json'
+    with open(syntheticTraces.__file__, 'rb') as generator_file:
+        generator_version = hashlib.sha1(generator_file.read()).hexdigest()
+    parameters = json.dumps({'parameters': recording['parameters'], 'syntheticTraces': generator_version}, default = str, sort_keys = True)
+
+    if not regenerate and os.path.isfile(file_path) and os.path.isfile(parameter_path):
+        with open(parameter_path) as parameter_file:
+            if parameter_file.read() == parameters:
+                return file_path, recording, os.path.getsize(file_path) / 1e6
+
+    os.makedirs(os.path.dirname(file_path), exist_ok = True)
+    print ('Writing ' + file_path)
+    file_MB = syntheticTraces.write_abf(recording, file_path)
+    with open(parameter_path, 'w') as parameter_file:
+        parameter_file.write(parameters)
+    return file_path, recording, file_MB
+
+
+def prepare_work_folder():
+    """
+    Makes the folder where the analysis scripts run during the benchmark: same Analysis_output folders and LED power
+    tables as next to the scripts, so that the scripts find everything they need but never write in the real Analysis_output.
+    """
+    work_folder = os.path.join(data_folder, 'work')
+    for folder, _, _ in os.walk(os.path.join(wdir, 'Analysis_output')):
+        os.makedirs(os.path.join(work_folder, os.path.relpath(folder, wdir)), exist_ok = True)
+    for table_name in ['Rig_1_LED_power.xlsx', 'Rig_2_LED_power.xlsx']:
+        shutil.copy2(os.path.join(wdir, table_name), work_folder)
+    return work_folder
+
+
+def time_trace(file_path, analysis_name, trace_answers, work_folder, render = False, track_memory = True, warm_cache = False):
+    """
+    Runs one analysis script on one synthetic trace, in the process of the benchmark worker.
+    Returns (status, message, stage times). With render = True the figures of the trace are also drawn and saved,
+    and the time it took is added as a 'render' stage. With warm_cache = False the trace cache of the work folder is
+    emptied first, with warm_cache = True the trace is put in the cache before the script is timed.
+    """
+    os.chdir(work_folder)
+    if warm_cache:
+        cached_trace = traceCache.load_trace(file_path)
+        for channel in range(cached_trace.channelCount):
+            cached_trace.get_channel_data(channel)
+    else:
+        traceCache.clear_cache()
+    try:
+        master_rows, figure_jobs, stage_times = Batch_Analysis.run_trace(file_path, analysis_name, trace_answers, figures = render, track_memory = track_memory)
+    except Exception as error: ## a failed trace is recorded with the stages run until the error
+        return 'failed', repr(error), getattr(error, 'stage_times', {'stages': []})
+
+    if render:
+        render_time = 0.0
+        for figure_job in figure_jobs:
+            try:
+                render_time += plotRendering.render_figure_job(figure_job)
+            except Exception as error:
+                print ('Figure ' + figure_job[0] + ' could not be drawn: ' + repr(error))
+        stage_times['stages'].append({'stage': 'render', 'time_s': render_time, 'peak_memory_MB': np.nan, 'calls': len(figure_jobs)})
+    return 'analysed', '', stage_times
+
+
+def run_benchmark(scales = None, analysis_names = None, repeat = 1, render = False, track_memory = True, regenerate = False, warm_cache = False):
+    """
+    Times the analysis scripts on the synthetic traces of each scale.
+    1st term = list of scales (keys of benchmark_scales), None = default_scales
+    2nd term = list of analysis scripts, None = all scripts with a synthetic protocol
+    3rd term = number of times each trace is analysed
+    Returns a dataframe with one row per trace, repeat and stage (columns history_columns).
+    """
+    scales = scales or default_scales
+    run_details = {'run_id': datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), 'date': datetime.datetime.now().isoformat(timespec = 'seconds'),
+                   'revision': get_revision(), 'host': platform.node(), 'python': platform.python_version(),
+                   'numpy': np.__version__, 'pandas': pd.__version__, 'pyabf': pyabf.__version__}
+    work_folder = prepare_work_folder()
+    benchmark_rows = []
+
+    for scale in scales:
+        if scale not in benchmark_scales:
+            raise ValueError ('Unknown benchmark scale ' + str(scale) + ', choose from ' + ', '.join(benchmark_scales))
+        for analysis_name, parameters in benchmark_scales[scale].items():
+            if analysis_names and analysis_name not in analysis_names:
+                continue
+            file_path, recording, file_MB = write_benchmark_trace(scale, analysis_name, regenerate)
+            trace_answers = Batch_Analysis.metadata_to_answers({column: Batch_Analysis.clean_metadata_value(value)
+                                                                for column, value in recording['parameters']['metadata'].items()})
+            trace_details = dict(run_details, scale = scale, analysis = analysis_name, trace_number = os.path.splitext(os.path.basename(file_path))[0],
+                                 trace_cache = 'warm' if warm_cache else 'cold',
+                                 duration_s = recording['point_count'] / recording['parameters']['sampling_rate'],
+                                 sampling_rate = recording['parameters']['sampling_rate'], channels = len(recording['channels']), file_MB = file_MB)
+
+            for repeat_no in range(repeat):
+                print ('Timing ' + analysis_name + ' on ' + scale + ' trace (' + str(round(trace_details['duration_s'], 1)) + 's), run ' + str(repeat_no + 1) + '/' + str(repeat))
+                trace_start_time = time.perf_counter()
+                try:
+                    with ProcessPoolExecutor(max_workers = 1) as executor: ## new process for every trace: nothing is cached between traces
+                        status, message, stage_times = executor.submit(time_trace, file_path, analysis_name, trace_answers, work_folder, render, track_memory, warm_cache).result()
+                except BrokenProcessPool as error: ## worker killed, e.g. out of memory
+                    status, message, stage_times = 'failed', repr(error), {'stages': []}
+                print (status + ' in ' + str(round(time.perf_counter() - trace_start_time, 2)) + 's ' + message + '\n')
+
+                stages = list(stage_times['stages'])
+                stages.append({'stage': 'total', 'time_s': stage_times.get('total_time_s', np.nan),
+                               'peak_memory_MB': max([stage['peak_memory_MB'] for stage in stages] or [np.nan]), 'calls': 1})
+                for stage in stages:
+                    benchmark_rows.append(dict(trace_details, repeat = repeat_no, status = status, message = message, **stage))
+
+    return pd.DataFrame(benchmark_rows, columns = history_columns)
+
+
+def save_history(benchmark_results):
+    """
+    Appends the results of a run to Benchmark_results/benchmark_history.csv and returns the whole history.
+    """
+    os.makedirs(results_folder, exist_ok = True)
+    history_path = os.path.join(results_folder, history_name)
+    if os.path.isfile(history_path) and list(pd.read_csv(history_path, nrows = 0).columns) != history_columns: ## history of an older version of the benchmark
+        benchmark_results = pd.concat([load_history(), benchmark_results], ignore_index = True)[history_columns]
+        benchmark_results.to_csv(history_path, index = False)
+    else:
+        benchmark_results.to_csv(history_path, mode = 'a', header = not os.path.isfile(history_path), index = False)
+    print ('Benchmark results added to ' + history_path)
+    return load_history()
+
+
+def load_history():
+    history_path = os.path.join(results_folder, history_name)
+    if not os.path.isfile(history_path):
+        return pd.DataFrame(columns = history_columns)
+    history = pd.read_csv(history_path, dtype = {'run_id': str, 'revision': str})
+    if 'trace_cache' not in history.columns: ## runs made before the trace cache existed always read the .abf file
+        history['trace_cache'] = 'cold'
+    return history
+
+
+def compare_runs(history, run_id = None, reference_revision = None, tolerance = 0.2):
+    """
+    Compares the total time of each analysis and scale of one run with the previous run of the same trace.
+    1st term = benchmark history (load_history)
+    2nd term = run to look at, None = last run
+    3rd term = revision to compare with, None = any other revision (the last one run on the same computer)
+    4th term = fraction of the reference time above which a trace is flagged as slower (or faster)
+    Returns a dataframe with the median time of both runs, their ratio and the change.
+    """
+    if history.empty:
+        raise ValueError ('No benchmark results found in ' + os.path.join(results_folder, history_name))
+    run_id = run_id or history['run_id'].iloc[-1]
+    run = history[history['run_id'] == run_id]
+    revision, host, trace_cache = run['revision'].iloc[0], run['host'].iloc[0], run['trace_cache'].iloc[0]
+
+    reference_runs = history[(history['host'] == host) & (history['trace_cache'] == trace_cache) & (history['run_id'] < run_id) & (history['stage'] == 'total')]
+    if reference_revision is None:
+        reference_runs = reference_runs[reference_runs['revision'] != revision]
+    else:
+        reference_runs = reference_runs[reference_runs['revision'] == reference_revision]
+    if reference_runs.empty:
+        print ('\nNo earlier benchmark run of ' + (reference_revision or 'another revision') + ' on ' + str(host) + ' to compare with')
+        return None
+    last_reference_runs = reference_runs.groupby(['scale', 'analysis'])['run_id'].transform('max') ## each trace is compared with the last run that timed it
+    reference = reference_runs[reference_runs['run_id'] == last_reference_runs]
+
+    def total_times(benchmark_run):
+        totals = benchmark_run[benchmark_run['stage'] == 'total']
+        return totals.groupby(['scale', 'analysis'], sort = False).agg(time_s = ('time_s', 'median'), status = ('status', 'last'), peak_memory_MB = ('peak_memory_MB', 'max'),
+                                                                     revision = ('revision', 'last'))
+
+    comparison = total_times(run).join(total_times(reference), how = 'left', rsuffix = '_reference')
+    comparison['ratio'] = comparison['time_s'] / comparison['time_s_reference']
+    comparison['change'] = np.select([comparison['ratio'] > 1 + tolerance, comparison['ratio'] < 1 / (1 + tolerance)], ['SLOWER', 'faster'], '')
+    status_changed = comparison['status_reference'].notna() & (comparison['status'] != comparison['status_reference'])
+    comparison.loc[status_changed, 'change'] = comparison['status_reference'] + ' -> ' + comparison['status']
+
+    print ('\nRun ' + run_id + ' (' + revision + ') compared with the last run of ' + (reference_revision or 'another revision') + ' on ' + str(host) + ':')
+    print (comparison[['revision_reference', 'time_s_reference', 'time_s', 'ratio', 'peak_memory_MB_reference', 'peak_memory_MB', 'change']].round(3).fillna('').to_string())
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time the analysis scripts on synthetic recordings and keep the results of every run')
+    parser.add_argument('--scales', nargs = '+', default = default_scales, choices = list(benchmark_scales), help = 'sizes of recording to time, default = sweep sample long')
+    parser.add_argument('--analyses', nargs = '+', default = None, choices = list(syntheticTraces.protocols), help = 'analysis scripts to time, default = all')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'number of times each trace is analysed, default = 1')
+    parser.add_argument('--render', action = 'store_true', help = 'also draw the figures of each trace (render stage)')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'only measure the time of each stage, not its peak memory')
+    parser.add_argument('--regenerate', action = 'store_true', help = 'write the synthetic .abf files again even if their parameters did not change')
+    parser.add_argument('--warm-cache', action = 'store_true', help = 'time the scripts starting from the trace cache instead of the .abf file')
+    parser.add_argument('--compare', default = None, metavar = 'REVISION', help = 'only compare the last run with the last run of this revision')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'change in time flagged as slower / faster, default = 0.2 (20%%)')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_runs(load_history(), reference_revision = args.compare, tolerance = args.tolerance)
+    else:
+        benchmark_results = run_benchmark(args.scales, args.analyses, args.repeat, args.render, not args.no_memory, args.regenerate, args.warm_cache)
+        history = save_history(benchmark_results)
+
+        totals = benchmark_results[benchmark_results['stage'] == 'total']
+        print ('\nTotal time per trace (s):')
+        print (totals.pivot_table(index = 'analysis', columns = 'scale', values = 'time_s', aggfunc = 'median', sort = False).round(3).to_string())
+        compare_runs(history, run_id = benchmark_results['run_id'].iloc[0], tolerance = args.tolerance)
@@ -24,46 +24,53 @@ Spike amplitude in mV for all spikes
 Number of spikes per each LED stimulation in a train 
 Time to first spike (in ms) per each LED stimulation in a train 
 Spike jitter which is calculated as the standard deviation of the mean for all times to 1st spike across the stimulation train. 
+Each sweep of the trace is one stimulation train (one row per sweep, e.g. one frequency or LED power per sweep).
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pyabf
+from traceCache import load_trace
+from ledPower import get_calibration, get_LED_steps, get_LED_power
 import pandas as pd
-from scipy.signal import find_peaks
-import statistics
+from analysisSession import ask
+from pulseEpochs import find_pulses, get_pulse_sweeps, get_epoch_bounds, check_epoch_bounds, extract_epochs
+from resultsStore import add_to_master
+from stageTiming import start_stage, save_stage_times
+from plotRendering import add_figure
+from tracePlots import plot_full_trace
+from spikeEpochs import find_spikes, get_epoch_spikes, count_spikes
+from spikeTrains import get_spike_trains, get_spike_train_stats
 
 import os
 
 wdir=os.getcwd() 
 
 
+start_stage('load') ## time and memory of each stage of the script are measured, see stageTiming
 #### open file 
-file_path = input('Please give me the complete file path of the trace you want to analyse below:\n')
-abf = pyabf.ABF(file_path)
+file_path = ask('file_path', 'Please give me the complete file path of the trace you want to analyse below:\n')
+abf = load_trace(file_path) ## decoded data is kept in Trace_cache, see traceCache
 
 ### extract main data
-data = abf.data
-voltage_trace = data[0,:] # extracts primary channel recording in CC which is voltage measurement 
+voltage_trace = abf.get_channel(0) # extracts primary channel recording in CC which is voltage measurement 
 voltage_data_baseline = np.mean(voltage_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
-current_trace = data[1,:] # extracts 2ndary channel recording in CC which is current measurement 
+current_trace = abf.get_channel(1) # extracts 2ndary channel recording in CC which is current measurement 
 current_data_baseline = np.mean(current_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
 current_trace_baseline_substracted = current_trace - current_data_baseline
 
-LED_trace = data[-1,:] # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
-LED_data = data [-1,:]
+LED_trace = abf.get_channel(-1) # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
 date_time = abf.abfDateTime
 protocol = abf.protocol
 time = abf.sweepX
 resting_potential = np.mean(voltage_trace [0:20000]) # takes mean of all values aquired in the 1st second which is used as baseline membrane resting potential 
 sampling_rate = abf.dataPointsPerMs
+sweep_points = abf.sweepPointCount ## points of each sweep, the sweeps of episodic protocols follow each other in each channel (see pulseEpochs)
 file_name = abf.abfID ### extract filename 
 protocol = abf.protocol
 
 
+start_stage('metadata')
 ### select experimenter 
-user_input = int(input('Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
+user_input = int(ask('rig', 'Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
 
 experimenter_dict = { 
        1 : 'Rig 1' , 
@@ -78,7 +85,7 @@ else:
     raise ValueError ('Wrong number entered for Rig used, please run script again. No data was saved') #print this if choice selected in not in the opsin dictionary 
 
 ### select opsin type 
-user_input = int(input('What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
+user_input = int(ask('cell_type', 'What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
 
 cell_type_dict = { 
        0 : 'WT' , 
@@ -105,7 +112,7 @@ else:
 ##### establish LED stimulation: LED wavelenght and power 
 
 ##extract wavelenght used 
-LED_wavelenght_user = int(input('What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
+LED_wavelenght_user = int(ask('LED_wavelength', 'What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
 
 LED_wavelength_dict = { 
        1 : '475' , 
@@ -124,7 +131,7 @@ else:
 
 
 ## extract power range 
-LED_stim_type_user = int(input('What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
+LED_stim_type_user = int(ask('LED_stim_type', 'What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
 
 LED_power_setup_dict = { 
        1 : 'LED_475_2%' , 
@@ -151,73 +158,44 @@ else:
 """
 Add any functions used in the script below here
 """
-## function to find consecutive elements
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) != stepsize)[0]+1)
-
 '''
 Part 1: find frequency of LED pulses and analog input value
 '''
+start_stage('detect')
 ###### find index values where LED is ON use this to extract all other info from current trace
-LED_idx = (np.where(LED_trace > 0.1)) # index of values in LED trace where V values are over 0
-LED_idx_flat = [item for sublist in LED_idx for item in sublist]
-LED_array = np.asarray(LED_idx) #transform into an array for next step
-LED_idx_cons = consecutive(LED_array[0]) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-LED_idx_cons_df = pd.DataFrame(LED_idx_cons) #transform data into dataframe for easier processing below 
-LED_stim_no = len(LED_idx_cons)
+LED_onsets, LED_offsets, LED_lengths = find_pulses(LED_trace > 0.1, sweep_points) #find where each LED pulse starts and ends (LED trace V values over 0.1) --> each pulse would be 1 LED stim
+LED_sweeps = get_pulse_sweeps(LED_onsets, sweep_points) ## sweep of each LED pulse (0 = 1st sweep), each sweep is one train
+train_sweeps, train_first_pulse, LED_stim_no = np.unique(LED_sweeps, return_index = True, return_counts = True) ## sweeps with LED pulses, 1st LED pulse and number of LED pulses of each train
 
 
 ### determine lenght of LED Stim
-LED_time =pd.Series (LED_idx_cons_df.count(axis = 'columns'), name ='LED_time_ON' )#count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+LED_time =pd.Series (LED_lengths, name ='LED_time_ON' )#number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
 LED_time = round(LED_time / sampling_rate) # transform number of elements into actual ms rounded 
 LED_time = LED_time[0]
 
  
+start_stage('extract')
 ###### use selected LED indices to extract current and voltage data
-LED_data = [LED_trace [i] for i in LED_idx_cons] 
+LED_data = extract_epochs(LED_trace, get_epoch_bounds(LED_onsets, LED_offsets)) 
 LED_data_df = pd.DataFrame(LED_data)
 
 
+start_stage('power lookup')
 ####### determine power in mW/mm2 of max LED analog pulse V value
 LED_max_V = list(map(max, LED_data)) ## find max LED pulse points 
-threshold = len([1 for i in LED_max_V if i > 5])## count if there are any values over 5V in LED_max_V, means that scale was set up wrong and pulse values in V need to be introduced manually by user 
+LED_index_value, LED_scale_factor = get_LED_steps(experimenter, LED_stim_type, LED_max_V, date_time, abf) ## LED steps rounded to 0.1V, pulses over 5V (LED analog input recorded with the wrong scale) are rescaled automatically
 
-if threshold == 0: ## pulse values are below 5V
-    LED_max_V_round = [round (i,1) for i in LED_max_V] ## round number to 2 decimals
-    LED_max_V_round_int = [str(i) for i in  LED_max_V_round] ## transform number to int otherwise can't index into LED_stim_power_table
-    LED_index_value = LED_max_V_round_int
-else:
-    print('Wrong scale detected for LED analog input. Please add LED steps in Volts below, and na for no pulse applied:\n')
-    LED_max_V_user = [input('pulse_1:  \n'), input]
-    LED_index_value = LED_max_V_user
-    while 'na' in LED_max_V_user: LED_max_V_user.remove('na')  ## remove any na values since we don't need them 
-
-##### open up excel sheet with all LED power values
-if experimenter == 'Rig 2':
-    xlsx_filename = os.path.join(wdir, 'Rig_2_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_543_50%', 'LED_543_100%', 'LED_630_50%', 'LED_630_100%']
-
-else: 
-    xlsx_filename = os.path.join(wdir, 'Rig_1_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_2%', 'LED_475_20%', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_575_50%', 'LED_575_100%']
-
-### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2
-LED_power_pulse =  LED_stim_power_table.loc[LED_index_value, LED_stim_type] ## index and extract mW/mm2 value of pulse based on V pulse value and type of stimulation 
-LED_power_pulse= round(LED_power_pulse,2 ) ## round up to 2 decimal values, can't do more since I have some 0.xx values 
-LED_power_pulse= pd.Series(LED_power_pulse.astype(str)) # transform to str 
-LED_power_pulse = LED_power_pulse.reset_index( drop = True)
+### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2 (LED power tables compiled once, see ledPower)
+LED_calibration = get_calibration(experimenter, date_time) ## LED power table valid on the day of the recording, saved with the data
+LED_power_pulse = get_LED_power(experimenter, LED_stim_type, LED_index_value, date_time) ## mW/mm2 value of each pulse, interpolated between calibrated V steps
+LED_power_pulse= pd.Series(np.round(LED_power_pulse, 2)).astype(str) ## round up to 2 decimal values, can't do more since I have some 0.xx values; transform to str 
 
 
+start_stage('extract')
 ### calculate frequency 
 
 ##extract frequency tested
-LED_frequency = float(input('What LED frequency did you test? enter number as float 1 = 1.0 \n'))
+LED_frequency = float(ask('LED_frequency', 'What LED frequency did you test? enter number as float 1 = 1.0 \n'))
 
 
 if isinstance(LED_frequency, float):
@@ -231,107 +209,65 @@ LED_spike_target = LED_stim_no
 
 #### extract frequency response data
 
-## function to get spike frequency 
-def get_spike_frequency (data):
-    index_spike_list = np.array(data[0]) ## feed in data output from find peaks function which is a tuple containing at [0] list of  spikes indices and at [1] peak heights. Only [0] level output is used in this script 
-    
-    if index_spike_list.size: ### if size = True (i.e values present) spikes were detected proceed to try and calculate frequency
-        print('Frequency calculation started')
-        index_substract = np.diff(index_spike_list) ## get time between each spike 
-        index_convert_time_ms =  index_substract / sampling_rate ## convert time to ms 
-    
-        if index_convert_time_ms.size == 0: #if index substraction is 0 it means that only 1 spike was present. Not possible to run freq calculation 
-            print('Frequency calculation not possible on a single spike')
-            freq_Hz = np.nan
-            return (freq_Hz)
-        
-        elif index_convert_time_ms.size == 1:  #if index substraction is a single number extract this and transform in ms as freq result
-            print('Frequency calculation done as time between 2 spikes')
-            freq_Hz = np.float(1 / index_convert_time_ms) * 1000
-            return (freq_Hz)
-        
-        else: ## if more then 2 inter spike interval detected get average 
-            print('Frequency calculation done as average of multiple spike interval times')
-            mean_pulse_time_ms = np.mean(index_convert_time_ms)
-            freq_Hz = np.float(1 /mean_pulse_time_ms) * 1000
-            return (freq_Hz)
-
-    else: ### if size = False it means no spiked were detected so set freq values to nan
-        print ('Frequency calculation: no spike detected')
-        freq_Hz = np.nan
-        return (freq_Hz)        
-
-
-#### find all spikes
-spikes = find_peaks(voltage_trace, height=-20) #find peaks with height over -20mV in array 0 from voltage_data 
-
-spikes_total = len(spikes[0])
-spikes_amplitude = spikes [1]
+#### find all spikes of the trace once (peaks over -30mV), the spikes over -20mV are the spikes of the whole train (see spikeEpochs)
+spike_idx, spike_heights = find_spikes(voltage_trace, height = -30)
+train_spikes = spike_heights >= -20
+train_spike_idx, train_spike_heights = spike_idx[train_spikes], spike_heights[train_spikes]
 
-spikes_amplitude_tup = sum(spikes_amplitude.items(), ())
-spikes_amplitude_arr = spikes_amplitude_tup[1]
-spikes_amplitude = spikes_amplitude_arr.tolist() ## extract peak spike value for 1st spike
+train_bounds = (train_sweeps * sweep_points, np.minimum((train_sweeps + 1) * sweep_points, len(voltage_trace))) ## whole sweep of each train
+spikes_total = count_spikes(train_spike_idx, train_bounds)
+train_spike_first, train_spike_last = get_epoch_spikes(train_spike_idx, train_bounds)
+spikes_amplitude = [train_spike_heights[first:last].tolist() for first, last in zip(train_spike_first, train_spike_last)] ## extract peak value of every spike of each train
 
-
-spike_freq = get_spike_frequency (spikes)
+spike_freq = get_spike_train_stats(*get_spike_trains(train_spike_idx, train_bounds), sampling_rate)['mean_freq_Hz'] ## mean frequency of all spikes of each train
 
 ####
 
-LED_expand_idx =[np.concatenate([x, [x[-1]+i+1 for i in range(500)] ]) for x in LED_idx_cons] ## add 10ms after light pulse to count spikes. This is the max time we can add since some traces are done with 100Hz stim. 
-
-
-voltage_data_LED = [voltage_trace [i] for i in LED_expand_idx]
+LED_expand_idx = get_epoch_bounds(LED_onsets, LED_offsets, post_points = 500, sweep_points = sweep_points) ## add 10ms after light pulse to count spikes. This is the max time we can add since some traces are done with 100Hz stim. 
+check_epoch_bounds(voltage_trace, LED_expand_idx)
 LED_pulses = range (len(LED_data))
 
-spike_per_LED = []
-spikes_extracted = []
-spike_time_extracted = []
-for i in range (len(LED_data)):
-    peaks = find_peaks(voltage_data_LED[i], height=-30)
-    spike_per_LED.append(peaks)
-    for j in peaks:
-        spike = len(j)
-        spikes_extracted.append(spike)
-
-spikes_extracted_clean = spikes_extracted 
-del spikes_extracted_clean[1::2]
-
-spike_per_LED_stim = spikes_extracted_clean
-
-spike_time = [item [0] for item in spike_per_LED]
-spike_time2 = []
-for i in spike_time:
-    if len(i)>0:
-        spike_time2.append(i)
-spike_time_fin = [item [0] for item in spike_time2]
-
-spike_time_ms = [i / sampling_rate for i in spike_time_fin ]
-
-try:
-    spike_jitter = statistics.stdev(spike_time_ms)
-except statistics.StatisticsError:
-    spike_jitter = np.nan
+## spike number and time to 1st spike of all LED stims of all trains at once (see spikeTrains), then split by train
+LED_spike_stats = get_spike_train_stats(*get_spike_trains(spike_idx, LED_expand_idx), sampling_rate)
+spike_per_LED_stim = [spike_counts.tolist() for spike_counts in np.split(LED_spike_stats['spike_count'], train_first_pulse[1:])]
+first_spike_latency_ms = np.split(LED_spike_stats['first_spike_latency_ms'], train_first_pulse[1:])
+spike_time_ms = [latencies[~np.isnan(latencies)].tolist() for latencies in first_spike_latency_ms]
+
+## jitter of each train: standard deviation of the times to 1st spike of its LED stims (nan with less than 2 spikes)
+has_spike = LED_spike_stats['spike_count'] > 0
+latency_train = np.searchsorted(train_sweeps, LED_sweeps[has_spike])
+latencies = LED_spike_stats['first_spike_latency_ms'][has_spike]
+latency_counts = np.bincount(latency_train, minlength = len(train_sweeps))
+with np.errstate(invalid = 'ignore', divide = 'ignore'):
+    latency_mean = np.bincount(latency_train, weights = latencies, minlength = len(train_sweeps)) / latency_counts
+    spike_jitter = np.sqrt(np.bincount(latency_train, weights = (latencies - latency_mean[latency_train]) ** 2, minlength = len(train_sweeps)) / (latency_counts - 1))
+spike_jitter[latency_counts < 2] = np.nan
+if np.isnan(spike_jitter).all():
     print("spike jitter calculation not possible since cell responded only to a single stimulation")
  
 
+start_stage('persist')
 ###putting all data together to extract response values per trace 
 
 trace_data_LED = pd.DataFrame({'trace_number':file_name ,
                                'date_time' : date_time, 
                                'experimenter': experimenter, 
                                'protocol' : protocol, 
+                               'sweep': train_sweeps,
                                'cell_type': cell_type_selected, 
                                'V_baseline': voltage_data_baseline, 
                                'LED_wavelenght': LED_wavelength,
                                'LED_time_ms': LED_time, 
-                               'LED_power_mWmm': LED_power_pulse, 
+                               'LED_power_mWmm': LED_power_pulse[train_first_pulse].values, ## power of the 1st LED stim of each train
+                               'LED_calibration': LED_calibration,
+                               'LED_scale_factor': LED_scale_factor,
                                'LED_freq_target': LED_frequency, 
                                'LED_spike_no_target': LED_spike_target, 
                                'LED_freq_response': spike_freq, 
                                'Spike_no_total': spikes_total, 
-                               'Spikes_amplitude': [spikes_amplitude], 
-                               'Spike_per_LED_stim': [spike_per_LED_stim], 
-                               '1st_spike_time_ms': [spike_time_ms], 
+                               'Spikes_amplitude': spikes_amplitude, 
+                               'Spike_per_LED_stim': spike_per_LED_stim, 
+                               '1st_spike_time_ms': spike_time_ms, 
                                'Spike_jitter': spike_jitter  })
 ### save data status 
 
@@ -354,44 +290,19 @@ CC_excitatory_opsin_frequency = pd.DataFrame(columns = column_names) #transform
 CC_excitatory_opsin_frequency.to_csv('Analysis_output/CC_excitatory_opsin_frequency.csv', header = True)
 """
 
-##open master sheet with data 
-CC_excitatory_opsin_frequency = pd.read_csv('Analysis_output/CC_excitatory_opsin_frequency.csv', index_col = 0) 
-
-### add data extracted here as a new row in opened dataframe
-CC_excitatory_opsin_frequency = CC_excitatory_opsin_frequency.append(trace_data_LED, sort = False) #adds row with new values to main dataframe
-
-## save new version of updated dataframe as csv
-CC_excitatory_opsin_frequency.to_csv('Analysis_output/CC_excitatory_opsin_frequency.csv', header = True)
+### add data extracted here as new rows of the master in the results store, the master file is written by python resultsStore.py (when running Batch_Analysis rows are merged and the master written at the end of the batch)
+add_to_master(trace_data_LED, 'CC_excitatory_opsin_frequency')
 
 
     
 
+start_stage('plot')
 #### plot figure of LED stim + response 
 
 ##full trace 
-fig1 = plt.figure(figsize =(15,5))## plot all raw data 
-sub1 = plt.subplot(211, )
-sub1.plot(time, voltage_trace, linewidth=0.5, color = '0.2')
-plt.ylim(-80,50) #for y axis
-plt.xlim(0.5,4) #for x axiss
-plt.ylabel('pA')
-sub1.spines['left'].set_color('0.2')
-sub1.spines['bottom'].set_color('white')
-sub1.tick_params(axis='y', colors='0.2')
-sub1.tick_params(axis='x', colors='white')
-plt.setp(sub1.get_xticklabels(), visible = False)
-sns.despine()
-
-sub2 = plt.subplot(212, sharex=sub1)
-plt.plot(time, LED_trace, linewidth=0.5, color = '0.2')
-plt.ylim(-0.5,5) #for y axis
-plt.xlim(0.5,4) #for x axis
-plt.xlabel('time (s)')
-plt.ylabel('LED_V_input')
-sub2.spines['left'].set_color('0.2')
-sub2.spines['bottom'].set_color('white')
-sub2.tick_params(axis='y', colors='0.2')
-sub2.tick_params(axis='x', colors='0.2')
-sns.despine()
-plt.show()
+add_figure('CC_excitatory_frequency', file_name, 'full_trace', plot_full_trace,
+           time, voltage_trace, LED_trace, (-80,50), (-0.5,5), (0.5,4), 'pA', 'LED_V_input') ## plot all raw data, drawn in the background and saved in Analysis_output/Figures when running Batch_Analysis
+
 
+### save time and memory used by each stage of the script (Analysis_output/Stage_timing)
+save_stage_times('CC_excitatory_frequency', file_name, protocol)
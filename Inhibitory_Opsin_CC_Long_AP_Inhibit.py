@@ -29,39 +29,47 @@ Data was normalised offline to a 50ms time bin.
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pyabf
+from traceCache import load_trace
+from ledPower import get_calibration, get_LED_steps, get_LED_power
 import pandas as pd
-from scipy.signal import find_peaks
+from analysisSession import ask
+from pulseEpochs import find_pulses, get_pulse_sweeps, get_epoch_bounds, extract_epochs
+from pulseIntervals import overlaps_any, subtract_intervals, split_intervals
+from resultsStore import add_to_master
+from stageTiming import start_stage, save_stage_times
+from plotRendering import add_figure
+from tracePlots import plot_pulse_responses
+from spikeEpochs import find_spikes, count_spikes, get_first_spikes
 import os
 wdir=os.getcwd() 
 
 
+start_stage('load') ## time and memory of each stage of the script are measured, see stageTiming
 #### open file 
-file_path = input('Please give me the complete file path of the trace you want to analyse below:\n')
-abf = pyabf.ABF(file_path)
+file_path = ask('file_path', 'Please give me the complete file path of the trace you want to analyse below:\n')
+abf = load_trace(file_path) ## decoded data is kept in Trace_cache, see traceCache
 
 ### extract main data
-data = abf.data
-voltage_trace = data[0,:] # extracts primary channel recording in CC which is voltage measurement 
+voltage_trace = abf.get_channel(0) # extracts primary channel recording in CC which is voltage measurement 
 voltage_data_baseline = np.mean(voltage_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
-current_trace = data[1,:] # extracts 2ndary channel recording in CC which is current measurement 
+current_trace = abf.get_channel(1) # extracts 2ndary channel recording in CC which is current measurement 
 current_data_baseline = np.mean(current_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
 current_trace_baseline_substracted = current_trace - current_data_baseline
 
-LED_trace = data[-1,:] # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
+LED_trace = abf.get_channel(-1) # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
 date_time = abf.abfDateTime
 protocol = abf.protocol
 time = abf.sweepX
 resting_potential = np.mean(voltage_trace [0:20000]) # takes mean of all values aquired in the 1st second which is used as baseline membrane resting potential 
 sampling_rate = abf.dataPointsPerMs
+sweep_points = abf.sweepPointCount ## points of each sweep, the sweeps of episodic protocols follow each other in each channel (see pulseEpochs)
 file_name = abf.abfID ### extract filename 
 protocol = abf.protocol
 
 
+start_stage('metadata')
 ### select experimenter 
-user_input = int(input('Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
+user_input = int(ask('rig', 'Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
 
 experimenter_dict = { 
        1 : 'Rig 1' , 
@@ -76,7 +84,7 @@ else:
     raise ValueError ('Wrong number entered for Rig used, please run script again. No data was saved') #print this if choice selected in not in the opsin dictionary 
 
 ### select opsin type 
-user_input = int(input('What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
+user_input = int(ask('cell_type', 'What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
 
 cell_type_dict = { 
        0 : 'WT' , 
@@ -103,7 +111,7 @@ else:
 ##### establish LED stimulation: LED wavelenght and power 
 
 ##extract wavelenght used 
-LED_wavelenght_user = int(input('What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
+LED_wavelenght_user = int(ask('LED_wavelength', 'What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
 
 LED_wavelength_dict = { 
        1 : '475' , 
@@ -122,7 +130,7 @@ else:
 
 
 ## extract power range 
-LED_stim_type_user = int(input('What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
+LED_stim_type_user = int(ask('LED_stim_type', 'What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
 
 LED_power_setup_dict = { 
        1 : 'LED_475_2%' , 
@@ -149,26 +157,27 @@ else:
 """
 Add any functions used in the script below here
 """
-## function to find consecutive elements
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) != stepsize)[0]+1)
+## current pulses with / without LED are calculated on the (start, end) of each pulse, see pulseIntervals
       
 '''
 Part 1 - find when a current pulse has been applied
 '''
 
+start_stage('detect')
+#### find the spikes of the whole voltage trace once (peaks over -20mV), the spikes of each current / LED pulse are taken from them (see spikeEpochs)
+spike_idx, spike_heights = find_spikes(voltage_trace, height = -20)
+
 #### find if a current pulse was applied: 
 
 ### find indices where current pulse is applied
-current_injection_idx = np.asarray(np.where(current_trace_baseline_substracted > 20)) # index of values in current trace where the current injected in more then 10pA
-current_injection_idx_cons = consecutive(current_injection_idx[0]) #find consecutive indexes where current over 10pa is applied and split into separate arrays --> each array would be 1 pulse 
-current_injection_idx_cons_df = pd.DataFrame(current_injection_idx_cons) #transform data into dataframe for easier processing below 
+current_injection_onsets, current_injection_offsets, current_injection_lengths = find_pulses(current_trace_baseline_substracted > 20, sweep_points) #find where each current pulse starts and ends (current injected over 20pA) --> each onset + offset would be 1 pulse
 
-current_pulse_length = current_injection_idx_cons_df.count(axis = 'columns') #count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+current_pulse_length = pd.Series(current_injection_lengths) #number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
 current_pulse_length_final = round(current_pulse_length / sampling_rate) # transform number of elements into actual ms rounded 
 current_pulse_length_final = current_pulse_length_final.drop_duplicates ()
 
-current_data_I_pulse = [current_trace_baseline_substracted [i] for i in current_injection_idx_cons ] # use index extracted for each individual pulse to extract current values 
+current_injection_bounds = get_epoch_bounds(current_injection_onsets, current_injection_offsets) ## start and end of each current pulse
+current_data_I_pulse = extract_epochs(current_trace_baseline_substracted, current_injection_bounds) # use index extracted for each individual pulse to extract current values 
 current_data_df = pd.DataFrame(current_data_I_pulse) #transform current_data into a data frame
 current_max_I_inj = list(map(max, current_data_I_pulse))
 current_max_I_inj = pd.Series(current_max_I_inj)
@@ -181,33 +190,33 @@ I_pulse_max_df = pd.DataFrame(np.where(I_pulse_max == True))
 I_pulse_start_idx = I_pulse_max_df[0][0]
 stim_type_I_inj = 'I_pulse'
 
+start_stage('extract')
 ### use current pulse indices to extract corresponding voltage response  
-voltage_data_I_injection = [voltage_trace [i] for i in current_injection_idx_cons]
+voltage_data_I_injection = extract_epochs(voltage_trace, current_injection_bounds)
 voltage_data_I_injection_df = pd.DataFrame(voltage_data_I_injection)
-spike_I_stim = find_peaks(voltage_data_I_injection[0], height=0) ##check if there are any spikes present
             
           
 '''
 Part 2: find when LED pulse have been applied
 '''
+start_stage('detect')
 ###### find index values where LED is ON use this to extract all other info from current trace
-LED_idx = (np.where(LED_trace > 0.18)) # index of values in LED trace where V values are over 0
-LED_array = np.asarray(LED_idx) #transform into an array for next step
-
-LED_idx_cons = consecutive(LED_array[0]) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-LED_idx_cons_df = pd.DataFrame(LED_idx_cons) #transform data into dataframe for easier processing below 
+LED_onsets, LED_offsets, LED_lengths = find_pulses(LED_trace > 0.18, sweep_points) #find where each LED pulse starts and ends (LED trace V values over 0.18) --> each pulse would be 1 LED stim
 
 ### determine lenght of LED Stimq1
-LED_time =pd.Series (LED_idx_cons_df.count(axis = 'columns'), name ='LED_time_ON' )#count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+LED_time =pd.Series (LED_lengths, name ='LED_time_ON' )#number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
 LED_time = round(LED_time / sampling_rate) # transform number of elements into actual ms rounded 
+LED_sweeps = get_pulse_sweeps(LED_onsets, sweep_points) ## sweep of each LED pulse (0 = 1st sweep)
 
 
+start_stage('extract')
 ###### use selected LED indices to extract current and voltage data
-voltage_data_LED = [voltage_trace [i] for i in LED_idx_cons]
-current_data_LED =  [current_trace_baseline_substracted [i] for i in LED_idx_cons] # use index extracted for each individual pulse to extract voltage values 
+LED_bounds = get_epoch_bounds(LED_onsets, LED_offsets) ## start and end of each LED pulse
+voltage_data_LED = extract_epochs(voltage_trace, LED_bounds)
+current_data_LED =  extract_epochs(current_trace_baseline_substracted, LED_bounds) # use index extracted for each individual pulse to extract voltage values 
 voltage_data_LED_df = pd.DataFrame (voltage_data_LED)
 
-LED_data = [LED_trace [i] for i in LED_idx_cons] 
+LED_data = extract_epochs(LED_trace, LED_bounds) 
 LED_data_df = pd.DataFrame(LED_data)
 
 ####### determine max current and voltage  response value 
@@ -219,243 +228,54 @@ voltage_deflection_LED = voltage_max_LED - voltage_baseline_LED
 stim_type_LED = 'LED_pulse'
 
 ##### counting spikes 
-if experimenter == 'Rig 1':
-    
-    
-    mask = np.isin(current_injection_idx,LED_array, invert=True) ## create mask of where only I pulse idx are 
-
-    I_pulse_only = current_injection_idx [mask] ## create array using mask of where only I pulses are 
-    I_only_idx_cons = consecutive(I_pulse_only) ## separate them in separate arrays by pulse
-
-    I_only_pre = len(I_only_idx_cons[1])
-    I_only_mid = len (I_only_idx_cons[0]) - I_only_pre 
-    I_only_post = I_only_pre + I_only_mid
-
-    I_only_pre_mid_post = np.split(I_only_idx_cons[0], [I_only_pre, I_only_mid, I_only_post ])
-
-
-    voltage_data_I_pulse_only = [voltage_trace [i] for i in I_only_pre_mid_post]
-
-    spike_per_I_only = []
-    for pulse in voltage_data_I_pulse_only :
-        spike_per_I = find_peaks(pulse, height = -20)
-        spike_per_I_only.append(spike_per_I[0])
-
-    control_I_pre_spike = len(spike_per_I_only [0])
-    control_I_mid_spike = len(spike_per_I_only [1])
-    control_I_post_spike = len(spike_per_I_only [2])
-
-else:
-       
-    mask = np.isin(current_injection_idx,LED_array, invert=True) ## create mask of where only I pulse idx are 
-
-    I_pulse_only_others = current_injection_idx [mask] ## create array using mask of where only I pulses are 
-    I_only_idx_cons_others = consecutive(I_pulse_only_others) ## separate them in separate arrays by pulse
-
-    
-    I_only_pre = len(I_only_idx_cons_others[1])
-    I_only_mid = len (I_only_idx_cons_others[0]) - I_only_pre 
-    I_only_post = I_only_pre + I_only_mid 
-    
-    I_only_idx_cons_others_long = I_only_idx_cons_others[0::3]
-    I_only_pre_mid_post = np.split(I_only_idx_cons_others_long[0], [I_only_pre, I_only_mid, I_only_post ])
-
-    I_only_pre_mid_post = []
-    for array in I_only_idx_cons_others_long:
-        I_only_pre_mid_post1 = np.split(array, [I_only_pre, I_only_mid, I_only_post ])
-        I_only_pre_mid_post.append(I_only_pre_mid_post1)
-    
-    I_only_pre_pulse = []
-    for lst in  I_only_pre_mid_post:
-        pre_pulse = lst[0]
-        I_only_pre_pulse.append(pre_pulse)
-
-    I_only_mid_pulse = []
-    for lst in  I_only_pre_mid_post:
-        mid_pulse = lst[1]
-        I_only_mid_pulse.append(mid_pulse)
-       
-    I_only_post_pulse = []
-    for lst in  I_only_pre_mid_post:
-        post_pulse = lst[2]
-        I_only_post_pulse.append(post_pulse)
-
-    voltage_data_I_pulse_pre = [voltage_trace [i] for i in I_only_pre_pulse]
-    voltage_data_I_pulse_mid = [voltage_trace [i] for i in I_only_mid_pulse]
-    voltage_data_I_pulse_post = [voltage_trace [i] for i in I_only_post_pulse]
-   
-
-    spike_per_I_pulse_pre = []
-    for pulse in voltage_data_I_pulse_pre :
-        spike_per_I = find_peaks(pulse, height = -20)
-        spike_per_I_pulse_pre.append(spike_per_I[0])
-
-    spike_per_I_pulse_mid = []
-    for pulse in voltage_data_I_pulse_mid :
-        spike_per_I = find_peaks(pulse, height = -20)
-        spike_per_I_pulse_mid.append(spike_per_I[0])
-
-    spike_per_I_pulse_post = []
-    for pulse in voltage_data_I_pulse_post :
-        spike_per_I = find_peaks(pulse, height = -20)
-        spike_per_I_pulse_post.append(spike_per_I[0])
-
-
-    control_I_pre_spike = []
-    for lst in spike_per_I_pulse_pre:
-        spike_count = len(lst)
-        control_I_pre_spike.append(spike_count)
-
-    control_I_mid_spike = []
-    for lst in spike_per_I_pulse_mid:
-        spike_count = len(lst)
-        control_I_mid_spike.append(spike_count)
-        
-
-    control_I_post_spike = []
-    for lst in spike_per_I_pulse_post:
-        spike_count = len(lst)
-        control_I_post_spike.append(spike_count)
-        
-        
-#####
-voltage_data_LED_array = np.vstack(voltage_data_LED)
+## current pulses without LED are the control pulses, each current pulse with an LED pulse is cut by it in a part before (pre) and after (post) the LED
+## (Rig 1 traces have 1 control pulse for the whole trace, Rig 2 traces 1 control pulse before each pulse with LED)
+current_injection_intervals = (current_injection_onsets, current_injection_offsets)
+I_plus_LED = overlaps_any(current_injection_intervals, (LED_onsets, LED_offsets))
+if not I_plus_LED.any():
+    raise ValueError ('No LED pulse applied during a current pulse in this trace, please check the protocol. No data was saved')
+control_I_bounds = (current_injection_onsets[~I_plus_LED], current_injection_offsets[~I_plus_LED])
+pre_post_LED_starts, pre_post_LED_ends = subtract_intervals((current_injection_onsets[I_plus_LED], current_injection_offsets[I_plus_LED]), (LED_onsets, LED_offsets))
+
+## pre, mid and post part of each control pulse: pre and post parts have the length of the 1st pre LED part
+I_only_pre = pre_post_LED_ends[0] - pre_post_LED_starts[0]
+control_I_pre_mid_post = split_intervals(control_I_bounds, I_only_pre, I_only_pre)
+control_I_pre_spike, control_I_mid_spike, control_I_post_spike = [np.broadcast_to(count_spikes(spike_idx, part), len(LED_onsets)).tolist() for part in control_I_pre_mid_post]
 
 #### spikes per I pulses paired with coincident opsin activation 
-I_plus_LED_index = np.intersect1d(current_injection_idx, LED_array) ## put together indices where both current and light are on 
-I_plus_LED_index_cons  = consecutive(I_plus_LED_index) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-
-spike_per_I_and_LED_pulse = []
-for pulse in voltage_data_LED_array:
-    spike_per_LED = find_peaks(pulse, height = -20)
-    spike_per_I_and_LED_pulse.append(spike_per_LED[0])
-
-LED_I_spike = []
+LED_I_spike = count_spikes(spike_idx, LED_bounds).tolist() ## spikes of each LED pulse, taken from the spikes of the whole trace
 
-for lst in spike_per_I_and_LED_pulse:
-    spike_per_pulse = len(lst)
-    LED_I_spike.append(spike_per_pulse)
+## spikes of the current pulses before (even) and after (odd) each LED pulse, taken from the spikes of the whole trace
+pre_post_LED_I_spike_no = count_spikes(spike_idx, (pre_post_LED_starts, pre_post_LED_ends))
+pre_LED_I_spike_no = pre_post_LED_I_spike_no[0::2].tolist()
+post_LED_I_spike_no = pre_post_LED_I_spike_no[1::2].tolist()
 
-## pre post LED spikes
-if experimenter == 'Rig 1':
-    pre_post_LED_idx= I_only_idx_cons
-    del pre_post_LED_idx [0]
-
-    voltage_data_pre_post_LED = [voltage_trace [i] for i in pre_post_LED_idx]
-
-    pre_post_LED_I_spike = []
-
-    for pulse in voltage_data_pre_post_LED:
-        spike_per_LED = find_peaks(pulse, height = -20)
-        pre_post_LED_I_spike.append(spike_per_LED[0])
-
-    pre_post_LED_I_spike_no = []
-
-    for lst in pre_post_LED_I_spike:
-        spike_per_LED = len(lst)
-        pre_post_LED_I_spike_no.append(spike_per_LED)
-
-    
-    pre_LED_I_spike_no = pre_post_LED_I_spike_no[::2]
-    post_LED_I_spike_no = pre_post_LED_I_spike_no[1::2]
-   
-    post_LED_spike = pre_post_LED_I_spike[1::2]
-    
-    first_spike_timing = []
-    for array in post_LED_spike:
-        if array.size: 
-            idx_first_spike = array[0]
-            spike_timing = idx_first_spike / sampling_rate
-            first_spike_timing.append(spike_timing)
-        else:
-            spike_timing = np.nan
-            first_spike_timing.append(spike_timing)
-
-
-else:
-    pre_post_LED_idx = I_only_idx_cons_others
-    del pre_post_LED_idx [0::3]
-    
-    voltage_data_pre_post_LED = [voltage_trace [i] for i in pre_post_LED_idx]
-
-    pre_LED_spike_data = voltage_data_pre_post_LED [0::2]
-    post_LED_spike_data = voltage_data_pre_post_LED [1::2]
-    
-    pre_LED_spike = []
-    for array in pre_LED_spike_data:
-        spike_per_pulse = find_peaks(array, height = -20)
-        pre_LED_spike.append(spike_per_pulse[0])
-        
-    post_LED_spike = []
-    for array in post_LED_spike_data:
-        spike_per_LED = find_peaks(array, height = -20)
-        post_LED_spike.append(spike_per_LED[0])
-        
-    pre_LED_I_spike_no = []
-    for array in pre_LED_spike:
-        spike_count = len(array)
-        pre_LED_I_spike_no.append(spike_count)
- 
-    post_LED_I_spike_no = []
-    for array in post_LED_spike:
-        spike_count = len(array)
-        post_LED_I_spike_no.append(spike_count)
-       
-    first_spike_timing = []
-    for array in post_LED_spike:
-        if array.size: 
-            idx_first_spike = array[0]
-            spike_timing = idx_first_spike / sampling_rate
-            first_spike_timing.append(spike_timing)
-        else:
-            spike_timing = np.nan
-            first_spike_timing.append(spike_timing)
+first_spike_idx_post_LED, _ = get_first_spikes(spike_idx, spike_heights, (pre_post_LED_starts[1::2], pre_post_LED_ends[1::2]))
+first_spike_timing = (first_spike_idx_post_LED / sampling_rate).tolist() ## nan if no spike after the LED pulse
 
+start_stage('power lookup')
 ####### determine power in mW/mm2 of max LED analog pulse V value
 LED_max_V = list(map(max, LED_data)) ## find max LED pulse points 
-threshold = len([1 for i in LED_max_V if i > 5])## count if there are any values over 5V in LED_max_V, means that scale was set up wrong and pulse values in V need to be introduced manually by user 
+LED_index_value, LED_scale_factor = get_LED_steps(experimenter, LED_stim_type, LED_max_V, date_time, abf) ## LED steps rounded to 0.1V, pulses over 5V (LED analog input recorded with the wrong scale) are rescaled automatically
 
-if threshold == 0: ## pulse values are below 5V
-    LED_max_V_round = [round (i,1) for i in LED_max_V] ## round number to 2 decimals
-    LED_max_V_round_int = [str(i) for i in  LED_max_V_round] ## transform number to int otherwise can't index into LED_stim_power_table
-    LED_index_value = LED_max_V_round_int
-else:
-    print('Wrong scale detected for LED analog input. Please add LED steps in Volts below, and na for no pulse applied:\n')
-    LED_max_V_user = [input('pulse_1:  \n'), input('pulse2:  \n'), input('pulse3:  \n'), input('pulse4:  \n'), input('pulse5:  \n'), input('pulse6:  \n'), input('pulse7:  \n')]
-    LED_index_value = LED_max_V_user
-    while 'na' in LED_max_V_user: LED_max_V_user.remove('na')  ## remove any na values since we don't need them 
-
-##### open up excel sheet with all LED power values
-if experimenter == 'Rig 2':
-    xlsx_filename = os.path.join(wdir, 'Rig_2_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_543_50%', 'LED_543_100%', 'LED_630_50%', 'LED_630_100%']
-
-else: 
-    xlsx_filename = os.path.join(wdir, 'Rig_1_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_2%', 'LED_475_20%', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_575_50%', 'LED_575_100%']
-
-### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2
-LED_power_pulse =  LED_stim_power_table.loc[LED_index_value, LED_stim_type] ## index and extract mW/mm2 value of pulse based on V pulse value and type of stimulation 
-LED_power_pulse= round(LED_power_pulse,2 ) ## round up to 2 decimal values, can't do more since I have some 0.xx values 
-LED_power_pulse= pd.Series(LED_power_pulse.astype(str)) # transform to str 
-LED_power_pulse = LED_power_pulse.reset_index( drop = True)
+### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2 (LED power tables compiled once, see ledPower)
+LED_calibration = get_calibration(experimenter, date_time) ## LED power table valid on the day of the recording, saved with the data
+LED_power_pulse = get_LED_power(experimenter, LED_stim_type, LED_index_value, date_time) ## mW/mm2 value of each pulse, interpolated between calibrated V steps
+LED_power_pulse= pd.Series(np.round(LED_power_pulse, 2)).astype(str) ## round up to 2 decimal values, can't do more since I have some 0.xx values; transform to str 
 
 
+start_stage('extract')
 ## create time based on points extracted data 
 time_points_plot = (np.arange(len(voltage_data_LED[0]))*abf.dataSecPerPoint) * 1000
 
+start_stage('persist')
 ###putting all data together to extract response values per trace 
 
 trace_data_LED = pd.DataFrame({'trace_number':file_name ,
                                'date_time' : date_time, 
                                'experimenter': experimenter, 
                                'protocol' : protocol,  
+                               'sweep': LED_sweeps,
                                'cell_type': cell_type_selected,
                                'V_baseline': voltage_data_baseline, 
                                'LED_wavelenght': LED_wavelength, 
@@ -463,6 +283,8 @@ trace_data_LED = pd.DataFrame({'trace_number':file_name ,
                                'current_pulse_duration_total': current_pulse_length_final, 
                                'LED_time_ms': LED_time, 
                                'LED_power_mWmm': LED_power_pulse, 
+                               'LED_calibration': LED_calibration,
+                               'LED_scale_factor': LED_scale_factor,
                                'control_I_pre_spike': control_I_pre_spike, 
                                'control_I_mid_spike': control_I_mid_spike, 
                                'control_I_post_spike': control_I_post_spike, 
@@ -496,21 +318,16 @@ CC_inhibitory_long_pulse = pd.DataFrame(columns = column_names) #transform into
 CC_inhibitory_long_pulse.to_csv('Analysis_output/CC_inhibitory_long_pulse.csv', header = True)
 """
 
-##open master sheet with data 
-CC_inhibitory_long_pulse = pd.read_csv('Analysis_output/CC_inhibitory_long_pulse.csv', index_col = 0) 
-
-### add data extracted here as a new row in opened dataframe
-CC_inhibitory_long_pulse = CC_inhibitory_long_pulse.append(trace_data_master, sort = False) #adds row with new values to main dataframe
-
-## save new version of updated dataframe as csv
-CC_inhibitory_long_pulse.to_csv('Analysis_output/CC_inhibitory_long_pulse.csv', header = True)
+### add data extracted here as new rows of the master in the results store, the master file is written by python resultsStore.py (when running Batch_Analysis rows are merged and the master written at the end of the batch)
+add_to_master(trace_data_master, 'CC_inhibitory_long_pulse')
 
 
+start_stage('plot')
 #### plot individual LED stim 
 
 ## extract data for plot 
-LED_expand_idx_plot =[np.concatenate([ [x[0]-i-1 for i in reversed(range(4000))], x, [x[-1]+i+1 for i in range(4000)] ]) for x in LED_idx_cons] ### add 5ms pre LED start and 100ms after .  
-voltage_data_plot = [voltage_trace [i] for i in LED_expand_idx_plot]
+LED_expand_idx_plot = get_epoch_bounds(LED_onsets, LED_offsets, pre_points = 4000, post_points = 4000) ### add 5ms pre LED start and 100ms after .  
+voltage_data_plot = extract_epochs(voltage_trace, LED_expand_idx_plot)
 
 time_points_plot = (np.arange(len(voltage_data_plot[0]))*abf.dataSecPerPoint) * 1000
 time_points_plot = [time_points_plot] * len(voltage_data_LED)
@@ -523,19 +340,11 @@ end_of_pulse = int(end_of_pulse)
 
 
 #### create plot here 
-fig1 = plt.figure(figsize =(40,5))
-fig1.subplots_adjust(wspace=0.3)
-
-for counter, (voltage, time, power) in enumerate (zip (voltage_data_plot, time_points_plot, LED_power_pulse), start = 1): 
-    sub = plt.subplot(2,len(voltage_data_LED),counter)
-    markers_on = [4000, end_of_pulse ]
-    sub.plot (time, voltage, '-om', markevery = markers_on, markerfacecolor="m", markeredgecolor = 'w', linewidth=0.3, color = '0.2')
-    sub.tick_params (axis = 'x', colors='black') 
-    sub.spines['bottom'].set_color('black')
-    sub.set_title(power + ' mW/mm2', color = '0.2')
-    plt.setp(sub.get_xticklabels(), visible = True)
-    plt.xlabel('Time (ms)\n Magenta Dots = LED ON/OFF')
-    plt.ylabel('Photocurrent (pA)')
-    plt.suptitle('Example opsin induced voltage deflections from this trace', fontsize=16)
-
-    sns.despine()
+markers_on = [4000, end_of_pulse ]
+add_figure('CC_inhibitory_long_pulse', file_name, 'LED_responses', plot_pulse_responses,
+           voltage_data_plot, time_points_plot, [power + ' mW/mm2' for power in LED_power_pulse], markers_on,
+           'Example opsin induced voltage deflections from this trace', 'Time (ms)\n Magenta Dots = LED ON/OFF', (40,5), 0.3) ## drawn in the background and saved in Analysis_output/Figures when running Batch_Analysis
+
+
+### save time and memory used by each stage of the script (Analysis_output/Stage_timing)
+save_stage_times('CC_inhibitory_long_pulse', file_name, protocol)
@@ -31,39 +31,47 @@ Percentage of overall spike inhibition present in protocol
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pyabf
+from traceCache import load_trace
+from ledPower import get_calibration, get_LED_steps, get_LED_power
 import pandas as pd
-from scipy.signal import find_peaks
+from analysisSession import ask
+from pulseEpochs import find_pulses, get_pulse_sweeps, get_epoch_bounds, check_epoch_bounds, extract_epochs
+from pulseIntervals import intersect_intervals, subtract_intervals
+from resultsStore import add_to_master
+from stageTiming import start_stage, save_stage_times
+from plotRendering import add_figure
+from tracePlots import plot_pulse_responses
+from spikeEpochs import find_spikes, get_epoch_spikes, count_spikes
 import os
 wdir=os.getcwd() 
 
 
+start_stage('load') ## time and memory of each stage of the script are measured, see stageTiming
 #### open file 
-file_path = input('Please give me the complete file path of the trace you want to analyse below:\n')
-abf = pyabf.ABF(file_path)
+file_path = ask('file_path', 'Please give me the complete file path of the trace you want to analyse below:\n')
+abf = load_trace(file_path) ## decoded data is kept in Trace_cache, see traceCache
 
 ### extract main data
-data = abf.data
-voltage_trace = data[0,:] # extracts primary channel recording in CC which is voltage measurement 
+voltage_trace = abf.get_channel(0) # extracts primary channel recording in CC which is voltage measurement 
 voltage_data_baseline = np.mean(voltage_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
-current_trace = data[1,:] # extracts 2ndary channel recording in CC which is current measurement 
+current_trace = abf.get_channel(1) # extracts 2ndary channel recording in CC which is current measurement 
 current_data_baseline = np.mean(current_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
 current_trace_baseline_substracted = current_trace - current_data_baseline
 
-LED_trace = data[-1,:] # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
+LED_trace = abf.get_channel(-1) # extracts 4th channel recording in CC which is LED analog signal (channel 3 = LED TTL, not needed)
 date_time = abf.abfDateTime
 protocol = abf.protocol
 time = abf.sweepX
 resting_potential = np.mean(voltage_trace [0:20000]) # takes mean of all values aquired in the 1st second which is used as baseline membrane resting potential 
 sampling_rate = abf.dataPointsPerMs
+sweep_points = abf.sweepPointCount ## points of each sweep, the sweeps of episodic protocols follow each other in each channel (see pulseEpochs)
 file_name = abf.abfID ### extract filename 
 protocol = abf.protocol
 
 
+start_stage('metadata')
 ### select experimenter 
-user_input = int(input('Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
+user_input = int(ask('rig', 'Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
 
 experimenter_dict = { 
        1 : 'Rig 1' , 
@@ -78,7 +86,7 @@ else:
     raise ValueError ('Wrong number entered for Rig used, please run script again. No data was saved') #print this if choice selected in not in the opsin dictionary 
 
 ### select opsin type 
-user_input = int(input('What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
+user_input = int(ask('cell_type', 'What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
 
 cell_type_dict = { 
        0 : 'WT' , 
@@ -105,7 +113,7 @@ else:
 ##### establish LED stimulation: LED wavelenght and power 
 
 ##extract wavelenght used 
-LED_wavelenght_user = int(input('What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
+LED_wavelenght_user = int(ask('LED_wavelength', 'What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
 
 LED_wavelength_dict = { 
        1 : '475' , 
@@ -124,7 +132,7 @@ else:
 
 
 ## extract power range 
-LED_stim_type_user = int(input('What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
+LED_stim_type_user = int(ask('LED_stim_type', 'What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
 
 LED_power_setup_dict = { 
        1 : 'LED_475_2%' , 
@@ -151,31 +159,31 @@ else:
 """
 Add any functions used in the script below here
 """
-## function to find consecutive elements
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) != stepsize)[0]+1)
+## current pulses with / without LED are calculated on the (start, end) of each pulse, see pulseIntervals
 
 '''
 Part 1 - find when a current pulse has been applied
 '''
 
+start_stage('detect')
+#### find the spikes of the whole voltage trace once (peaks over -30mV), the spikes of each current / LED pulse are taken from them (see spikeEpochs)
+spike_idx, spike_heights = find_spikes(voltage_trace, height = -30)
+
 #### find if a current pulse was applied: 
 if np.max(current_trace) > 40: ## if pulse detected in this trace
    
     print('Current pulse applied in this trace')   
     
     ### find indices where current pulse is applied
-    current_injection_idx = np.asarray(np.where(current_trace_baseline_substracted > 10)) # index of values in current trace where the current injected in more then 10pA
-    current_injection_idx_cons = consecutive(current_injection_idx[0]) #find consecutive indexes where current over 10pa is applied and split into separate arrays --> each array would be 1 pulse 
-    current_injection_idx_cons_df = pd.DataFrame(current_injection_idx_cons) #transform data into dataframe for easier processing below 
+    current_injection_onsets, current_injection_offsets, current_injection_lengths = find_pulses(current_trace_baseline_substracted > 10, sweep_points) #find where each current pulse starts and ends (current injected over 10pA) --> each onset + offset would be 1 pulse
 
-    current_pulse_length = current_injection_idx_cons_df.count(axis = 'columns') #count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+    current_pulse_length = pd.Series(current_injection_lengths) #number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
     current_pulse_length_final = round(current_pulse_length / sampling_rate) # transform number of elements into actual ms rounded 
     current_pulse_length_final = current_pulse_length_final.drop_duplicates ()
 
     ### increase array to add 100ms before and after current pulse to collect more voltage data
-    current_pulses_expanded =[np.concatenate([ [x[0]-i-1 for i in reversed(range(999))], x, [x[-1]+i+1 for i in range(999)] ]) for x in current_injection_idx_cons]
-    current_data_I_pulse = [current_trace_baseline_substracted [i] for i in current_pulses_expanded] # use index extracted for each individual pulse to extract current values 
+    current_pulses_expanded = get_epoch_bounds(current_injection_onsets, current_injection_offsets, pre_points = 999, post_points = 999, sweep_points = sweep_points)
+    current_data_I_pulse = extract_epochs(current_trace_baseline_substracted, current_pulses_expanded) # use index extracted for each individual pulse to extract current values 
     current_data_df = pd.DataFrame(current_data_I_pulse) #transform current_data into a data frame
     current_max_I_inj = list(map(max, current_data_I_pulse))
     current_max_I_inj = pd.Series(current_max_I_inj)
@@ -188,12 +196,16 @@ if np.max(current_trace) > 40: ## if pulse detected in this trace
     I_pulse_start_idx = I_pulse_max_df[0][0]
     stim_type_I_inj = 'I_pulse'
 
+    start_stage('extract')
 ### use current pulse indices to extract corresponding voltage response  
-    voltage_data_I_injection = [voltage_trace [i] for i in current_pulses_expanded]
+    voltage_data_I_injection = extract_epochs(voltage_trace, current_pulses_expanded)
     voltage_data_I_injection_df = pd.DataFrame(voltage_data_I_injection)
-    spike_I_stim = find_peaks(voltage_data_I_injection[0], height=0) ##check if there are any spikes present
+    I_spike_idx, I_spike_heights = spike_idx[spike_heights >= 0], spike_heights[spike_heights >= 0] ## spikes over 0mV
+    I_spike_first, I_spike_last = get_epoch_spikes(I_spike_idx, current_pulses_expanded)
+    spike_I_stim = I_spike_idx[I_spike_first[0]:I_spike_last[0]] - current_pulses_expanded[0][0] ##check if there are any spikes present in the 1st current pulse (index from the start of the pulse data)
+    spike_I_stim_heights = I_spike_heights[I_spike_first[0]:I_spike_last[0]]
     
-    if spike_I_stim [0].size ==0: ## no spike is detected for a given current pulse create subthreshold response arrays 
+    if spike_I_stim.size ==0: ## no spike is detected for a given current pulse create subthreshold response arrays 
         print('Curent pulses gave rise to subthreshold event')
         spike_count_I_stim = 0
         subthresh_event = 1
@@ -208,14 +220,9 @@ if np.max(current_trace) > 40: ## if pulse detected in this trace
     
     else: ## is spike detected extract values 
         print('Curent pulses gave rise to Spike(s)')
-        spike_count_I_stim = len(spike_I_stim[0])
-        voltage_max_I_inj = spike_I_stim[1]
-        voltage_max_I_inj_tup = sum(voltage_max_I_inj.items(), ())
-        voltage_max_I_inj_arr = voltage_max_I_inj_tup[1]
-        voltage_max_I_inj = voltage_max_I_inj_arr[0].tolist() ## extract peak spike value for 1st spike
-        voltage_max_I_inj_idx = spike_I_stim[0] ###
-        V_resp_delay_I_inj = (voltage_max_I_inj_idx - I_pulse_start_idx) / sampling_rate
-        V_resp_delay_I_inj =  V_resp_delay_I_inj[0].tolist() ## extract delay just to the 1st encoutered spike 
+        spike_count_I_stim = len(spike_I_stim)
+        voltage_max_I_inj = spike_I_stim_heights[0].tolist() ## extract peak spike value for 1st spike
+        V_resp_delay_I_inj = ((spike_I_stim[0] - I_pulse_start_idx) / sampling_rate).tolist() ## extract delay just to the 1st encoutered spike 
         voltage_data_I_injection_points = [voltage_data_I_injection[0]]
         I_inj_V_deflection =  voltage_max_I_inj - voltage_data_baseline 
         I_pulse_response_type = 'Spike'
@@ -239,30 +246,24 @@ else:
 '''
 Part 2: find if LED pulses have been applied
 '''
+start_stage('detect')
 ###### find index values where LED is ON use this to extract all other info from current trace
-LED_idx = (np.where(LED_trace > 0.18)) # index of values in LED trace where V values are over 0
-LED_array = np.asarray(LED_idx) #transform into an array for next step
-
-LED_idx_cons = consecutive(LED_array[0]) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-LED_idx_cons_df = pd.DataFrame(LED_idx_cons) #transform data into dataframe for easier processing below 
-LED_idx_cons_df_T = LED_idx_cons_df.T
-LED_idx_cons_df_T_last = LED_idx_cons_df_T.iloc[19899:19999]
-LED_idx_cons_df_last = LED_idx_cons_df_T.iloc[19899:19999].T
-LED_end_idx = LED_idx_cons_df_last.values
-
+LED_onsets, LED_offsets, LED_lengths = find_pulses(LED_trace > 0.18, sweep_points) #find where each LED pulse starts and ends (LED trace V values over 0.18) --> each pulse would be 1 LED stim
 ### determine lenght of LED Stimq1
-LED_time =pd.Series (LED_idx_cons_df.count(axis = 'columns'), name ='LED_time_ON' )#count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+LED_time =pd.Series (LED_lengths, name ='LED_time_ON' )#number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
 LED_time = round(LED_time / sampling_rate) # transform number of elements into actual ms rounded 
 LED_time = LED_time[0]
+LED_sweeps = get_pulse_sweeps(LED_onsets, sweep_points) ## sweep of each LED pulse (0 = 1st sweep)
+start_stage('extract')
 ### increase array to add 100ms before and 1s after current pulse to collect more current data
-LED_expand_idx =[np.concatenate([ [x[0]-i-1 for i in reversed(range(999))], x, [x[-1]+i+1 for i in range(999)] ]) for x in LED_idx_cons]
+LED_expand_idx = get_epoch_bounds(LED_onsets, LED_offsets, pre_points = 999, post_points = 999, sweep_points = sweep_points)
 
 ###### use selected LED indices to extract current and voltage data
-voltage_data_LED = [voltage_trace [i] for i in LED_expand_idx]
-current_data_LED =  [current_trace_baseline_substracted [i] for i in LED_expand_idx] # use index extracted for each individual pulse to extract voltage values 
+voltage_data_LED = extract_epochs(voltage_trace, LED_expand_idx)
+current_data_LED =  extract_epochs(current_trace_baseline_substracted, LED_expand_idx) # use index extracted for each individual pulse to extract voltage values 
 voltage_data_LED_df = pd.DataFrame (voltage_data_LED)
 
-LED_data = [LED_trace [i] for i in LED_expand_idx] 
+LED_data = extract_epochs(LED_trace, LED_expand_idx) 
 LED_data_df = pd.DataFrame(LED_data)
 
 ####### determine max current and voltage  response value 
@@ -273,105 +274,63 @@ voltage_baseline_LED = voltage_data_baseline
 voltage_deflection_LED = voltage_max_LED - voltage_baseline_LED
 stim_type_LED = 'LED_pulse'
 
-##### counting spikes 
-voltage_data_LED_array = np.vstack(voltage_data_LED)
+##### counting spikes (per sweep, each sweep is 1 row of the master)
+sweeps = np.arange(abf.sweepCount) ## 0 = 1st sweep
 
 #### spikes per I pulses paired with coincident opsin activation 
-I_plus_LED_index = np.intersect1d(current_injection_idx, LED_array) ## put together indices where both current and light are on 
-    
-I_plus_LED_index_cons  = consecutive(I_plus_LED_index) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-I_plus_LED_index_cons_expand_idx =[np.concatenate([ [x[0]-i-1 for i in reversed(range(999))], x, [x[-1]+i+1 for i in range(999)] ]) for x in I_plus_LED_index_cons]
-
-spike_per_I_and_LED_pulse = []
-for pulse in voltage_data_LED_array:
-    spike_per_LED = find_peaks(pulse, height = -30)
-    spike_per_I_and_LED_pulse.append(spike_per_LED[0])
+I_plus_LED_onsets, I_plus_LED_offsets = intersect_intervals((current_injection_onsets, current_injection_offsets), (LED_onsets, LED_offsets)) ## parts of the trace where both current and light are on --> each would be 1 LED stim
 
-spike_count_I_LED_total = 0
-for lst in spike_per_I_and_LED_pulse:
-    for spike in lst:
-        spike_count_I_LED_total = spike_count_I_LED_total + 1
+spike_count_I_LED_total = np.bincount(LED_sweeps, weights = count_spikes(spike_idx, LED_expand_idx), minlength = len(sweeps)).astype(int) ## spikes of every LED stim (with current pulse) of each sweep, taken from the spikes of the whole trace
 
-spike_count_I_LED_avg_per_pulse =  spike_count_I_LED_total  / len(I_plus_LED_index_cons)
+total_I_plus_LED_pulses = np.bincount(get_pulse_sweeps(I_plus_LED_onsets, sweep_points), minlength = len(sweeps))
 
-total_I_plus_LED_pulses = len(I_plus_LED_index_cons)
+spike_count_I_LED_avg_per_pulse =  spike_count_I_LED_total  / total_I_plus_LED_pulses
 
 #### spikes per I pulse with no LED ON 
-mask = np.isin(current_injection_idx,LED_array, invert=True) ## create mask of where only I pulse idx are 
-
-I_pulse_only = current_injection_idx [mask] ## create array using mask of where only I pulses are 
-I_only_idx_cons = consecutive(I_pulse_only) ## separate them in separate arrays by pulse
-
-I_pulse_only_index_cons_expand_idx =[np.concatenate([ [x[0]-i-1 for i in reversed(range(999))], x, [x[-1]+i+1 for i in range(999)] ]) for x in I_only_idx_cons]
-voltage_data_I_pulse_only = [voltage_trace [i] for i in I_pulse_only_index_cons_expand_idx]
-
-spike_per_I_only = []
-for pulse in voltage_data_I_pulse_only :
-    spike_per_I = find_peaks(pulse, height = -30)
-    spike_per_I_only.append(spike_per_I[0])
-
+I_only_onsets, I_only_offsets = subtract_intervals((current_injection_onsets, current_injection_offsets), (LED_onsets, LED_offsets)) ## parts of the trace where only the current is on --> each would be 1 current pulse
+I_pulse_only_index_cons_expand_idx = get_epoch_bounds(I_only_onsets, I_only_offsets, pre_points = 999, post_points = 999, sweep_points = sweep_points)
+check_epoch_bounds(voltage_trace, I_pulse_only_index_cons_expand_idx)
 
-spike_count_I_total = 0
-for lst in spike_per_I_only:
-    for spike in lst:
-        spike_count_I_total = spike_count_I_total + 1
+I_only_sweeps = get_pulse_sweeps(I_only_onsets, sweep_points) ## sweep of each current pulse without LED
+spike_count_I_total = np.bincount(I_only_sweeps, weights = count_spikes(spike_idx, I_pulse_only_index_cons_expand_idx), minlength = len(sweeps)).astype(int) ## spikes of every current pulse without LED of each sweep
 
-spike_count_I_avg_per_pulse =  spike_count_I_total  / len(spike_per_I_only) 
-total_I_pulses = len(I_only_idx_cons)
+total_I_pulses = np.bincount(I_only_sweeps, minlength = len(sweeps))
+spike_count_I_avg_per_pulse =  spike_count_I_total  / total_I_pulses 
 
 #### difference between current pulses vs current + LED stim 
 spike_dif_on_avg = spike_count_I_avg_per_pulse - spike_count_I_LED_avg_per_pulse
 spike_inhibition_percent = (spike_dif_on_avg / spike_count_I_avg_per_pulse) * 100
 
 
+start_stage('power lookup')
 ####### determine power in mW/mm2 of max LED analog pulse V value
 LED_max_V = list(map(max, LED_data)) ## find max LED pulse points 
-threshold = len([1 for i in LED_max_V if i > 5])## count if there are any values over 5V in LED_max_V, means that scale was set up wrong and pulse values in V need to be introduced manually by user 
+LED_index_value, LED_scale_factor = get_LED_steps(experimenter, LED_stim_type, LED_max_V, date_time, abf) ## LED steps rounded to 0.1V, pulses over 5V (LED analog input recorded with the wrong scale) are rescaled automatically
 
-if threshold == 0: ## pulse values are below 5V
-    LED_max_V_round = [round (i,1) for i in LED_max_V] ## round number to 2 decimals
-    LED_max_V_round_int = [str(i) for i in  LED_max_V_round] ## transform number to int otherwise can't index into LED_stim_power_table
-    LED_index_value = LED_max_V_round_int
-else:
-    print('Wrong scale detected for LED analog input. Please add LED steps in Volts below, and na for no pulse applied:\n')
-    LED_max_V_user = [input('pulse_1:  \n')]
-    LED_index_value = LED_max_V_user
-    while 'na' in LED_max_V_user: LED_max_V_user.remove('na')  ## remove any na values since we don't need them 
-
-##### open up excel sheet with all LED power values
-if experimenter == 'Rig 2':
-    xlsx_filename = os.path.join(wdir, 'Rig_2_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_543_50%', 'LED_543_100%', 'LED_630_50%', 'LED_630_100%']
-
-else: 
-    xlsx_filename = os.path.join(wdir, 'Rig_1_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_2%', 'LED_475_20%', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_575_50%', 'LED_575_100%']
-
-### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2
-LED_power_pulse =  LED_stim_power_table.loc[LED_index_value, LED_stim_type] ## index and extract mW/mm2 value of pulse based on V pulse value and type of stimulation 
-LED_power_pulse= round(LED_power_pulse,2) ## round up to 2 decimal values, can't do more since I have some 0.xx values 
-LED_power_pulse= pd.Series(LED_power_pulse.astype(str)) # transform to str 
-LED_power_pulse = LED_power_pulse.reset_index( drop = True)
+### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2 (LED power tables compiled once, see ledPower)
+LED_calibration = get_calibration(experimenter, date_time) ## LED power table valid on the day of the recording, saved with the data
+LED_power_pulse = get_LED_power(experimenter, LED_stim_type, LED_index_value, date_time) ## mW/mm2 value of each pulse, interpolated between calibrated V steps
+LED_power_pulse= pd.Series(np.round(LED_power_pulse, 2)).astype(str) ## round up to 2 decimal values, can't do more since I have some 0.xx values; transform to str 
+LED_power_sweep = LED_power_pulse.groupby(LED_sweeps).first().reindex(sweeps).values ## power of the 1st LED pulse of each sweep
 
+start_stage('extract')
 ## create time based on points extracted data 
 time_points_plot = (np.arange(len(voltage_data_LED[0]))*abf.dataSecPerPoint) * 1000
 
+start_stage('persist')
 ###putting all data together to extract response values per trace 
 trace_data_LED = pd.DataFrame({'trace_number':file_name ,
                                'date_time' : date_time, 
                                'experimenter': experimenter, 
                                'protocol' : protocol,  
+                               'sweep': sweeps,
                                'cell_type': cell_type_selected, 
                                'V_baseline': voltage_data_baseline, 
                                'LED_wavelenght': LED_wavelength,
                                'LED_time_ms': LED_time, 
-                               'LED_power_mWmm': LED_power_pulse, 
+                               'LED_power_mWmm': LED_power_sweep, 
+                               'LED_calibration': LED_calibration,
+                               'LED_scale_factor': LED_scale_factor,
                                'total_I_only_pulses': total_I_pulses, 
                                'Spike_I_stim_total': spike_count_I_total, 
                                'Spike_I_avg': spike_count_I_avg_per_pulse, 
@@ -379,7 +338,7 @@ trace_data_LED = pd.DataFrame({'trace_number':file_name ,
                                'spike_I_and_LED_stim_total': spike_count_I_LED_total,  
                                'spike_I_and_LED_stim_avg': spike_count_I_LED_avg_per_pulse, 
                                'spike_diff_on_avg_I_vs_LED': spike_dif_on_avg, 
-                               'spike_inhibition_%': spike_inhibition_percent  } ,  index=[0])
+                               'spike_inhibition_%': spike_inhibition_percent  })
 
 trace_data_master = trace_data_LED
 
@@ -402,46 +361,36 @@ CC_inhibitory_short_pulse = pd.DataFrame(columns = column_names) #transform into
 CC_inhibitory_short_pulse.to_csv('Analysis_output/CC_inhibitory_short_pulse.csv', header = True)
 """
 
-##open master sheet with data 
-CC_inhibitory_short_pulse = pd.read_csv('Analysis_output/CC_inhibitory_short_pulse.csv', index_col = 0) 
-
-### add data extracted here as a new row in opened dataframe
-CC_inhibitory_short_pulse = CC_inhibitory_short_pulse.append(trace_data_master, sort = False) #adds row with new values to main dataframe
-
-## save new version of updated dataframe as csv
-CC_inhibitory_short_pulse.to_csv('Analysis_output/CC_inhibitory_short_pulse.csv', header = True)
+### add data extracted here as new rows of the master in the results store, the master file is written by python resultsStore.py (when running Batch_Analysis rows are merged and the master written at the end of the batch)
+add_to_master(trace_data_master, 'CC_inhibitory_short_pulse')
 
 
+start_stage('plot')
 #### plot individual LED stim 
 
 ## extract data for plot 
-LED_expand_idx_plot =[np.concatenate([ [x[0]-i-1 for i in reversed(range(99))], x, [x[-1]+i+1 for i in range(999)] ]) for x in LED_idx_cons] ### add 5ms pre LED start and 100ms after .  
-voltage_data_plot = [voltage_trace [i] for i in LED_expand_idx_plot]
+LED_expand_idx_plot = get_epoch_bounds(LED_onsets, LED_offsets, pre_points = 99, post_points = 999) ### add 5ms pre LED start and 100ms after .  
+voltage_data_plot = extract_epochs(voltage_trace, LED_expand_idx_plot)
 
 time_points_plot = (np.arange(len(voltage_data_plot[0]))*abf.dataSecPerPoint) * 1000
 time_points_plot = [time_points_plot] * len(voltage_data_LED)
 
 #### create plot here 
-fig1 = plt.figure(figsize =(50,5))
-fig1.subplots_adjust(wspace=0.4)
-
-for counter, (voltage, time) in enumerate (zip (voltage_data_plot, time_points_plot), start = 1): 
-    sub = plt.subplot(2,len(voltage_data_LED),counter)
-    markers_on = [99]
-    sub.plot (time, voltage, '-om', markevery = markers_on, markerfacecolor="m", markeredgecolor = 'w', linewidth=0.3, color = '0.2')
-    sub.tick_params (axis = 'x', colors='black') 
-    sub.spines['bottom'].set_color('black')
-    sub.set_title('LED Stim' + str(counter) , color = '0.2')
-    plt.setp(sub.get_xticklabels(), visible = True)
-    plt.xlabel('Time (ms)\n Magenta Dot = LED ON')
-    plt.ylabel('Photocurrent (pA)')
-    plt.suptitle('Example opsin induced voltage deflections from this trace', fontsize=16)
-
-    sns.despine()
-
-
-print ('Total number of current and LED pulses: N = ' +str(total_I_plus_LED_pulses ))
-print ('During which we counted a total of spikes : N = ' +str(spike_count_I_LED_total ))
-print ('Coming to and average of spikes per pulse of  : N = ' +str(spike_count_I_LED_avg_per_pulse ))
-print ('Standard Current pulse only gave rise to an average of spikes per pulse  : N = ' +str(spike_count_I_avg_per_pulse))
-print ('Calculated that ' + str (round(spike_inhibition_percent,1)) + '% spikes were inhibited in this trace')
+markers_on = [99]
+add_figure('CC_inhibitory_short_pulse', file_name, 'LED_responses', plot_pulse_responses,
+           voltage_data_plot, time_points_plot, ['LED Stim' + str(counter) for counter in range(1, len(voltage_data_plot) + 1)], markers_on,
+           'Example opsin induced voltage deflections from this trace', 'Time (ms)\n Magenta Dot = LED ON', (50,5), 0.4) ## drawn in the background and saved in Analysis_output/Figures when running Batch_Analysis
+
+
+#### whole trace (all sweeps) 
+spike_count_I_LED_avg_trace = spike_count_I_LED_total.sum() / total_I_plus_LED_pulses.sum()
+spike_count_I_avg_trace = spike_count_I_total.sum() / total_I_pulses.sum()
+print ('Total number of current and LED pulses: N = ' +str(total_I_plus_LED_pulses.sum() ))
+print ('During which we counted a total of spikes : N = ' +str(spike_count_I_LED_total.sum() ))
+print ('Coming to and average of spikes per pulse of  : N = ' +str(spike_count_I_LED_avg_trace ))
+print ('Standard Current pulse only gave rise to an average of spikes per pulse  : N = ' +str(spike_count_I_avg_trace))
+print ('Calculated that ' + str (round((spike_count_I_avg_trace - spike_count_I_LED_avg_trace) / spike_count_I_avg_trace * 100,1)) + '% spikes were inhibited in this trace')
+
+
+### save time and memory used by each stage of the script (Analysis_output/Stage_timing)
+save_stage_times('CC_inhibitory_short_pulse', file_name, protocol)
@@ -10,7 +10,7 @@ How the script works:
 1. Asks user to provide a file path for the abf file to be analysed
 2. Asks user for meta-data that cannot be automatically extracted from abf file (such as stimulation regime and cell type etc)
 3. Finds all points where the LED is ON and uses these time-bins to extract data from the trace in which current values are recorded. 
-4. Puts all extracted data in a single .csv file named after the trace
+4. Puts all extracted data in a single .csv file named after the trace (raw data points are saved in a .npz file with the same name)
 5. Adds data as a new row to a master .csv file for the whole experiment 
 6. Outputs in line graphs showing cell response to LED stimulation
 
@@ -28,39 +28,47 @@ Extracts raw LED trace data points corresponding to LED stimulation
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pyabf
+from traceCache import load_trace
+from ledPower import get_calibration, get_LED_steps, get_LED_power
 import pandas as pd
+from analysisSession import ask
+from pulseEpochs import find_pulses, get_pulse_sweeps, get_epoch_bounds, extract_epochs
+from resultsStore import add_to_master, save_waveforms
+from stageTiming import start_stage, save_stage_times
+from exponentialFitGetTauBatch import exponentialFitGetTauBatch, plotExponentialFitsBatch
+from plotRendering import add_figure, add_fit_plot
+from tracePlots import plot_pulse_responses
 import os
 
 wdir=os.getcwd() 
 
 #from scipy.signal import find_peaks
 
+start_stage('load') ## time and memory of each stage of the script are measured, see stageTiming
 #### open file 
-file_path = input('Please give me the complete file path of the trace you want to analyse below:\n')
-abf = pyabf.ABF(file_path)
+file_path = ask('file_path', 'Please give me the complete file path of the trace you want to analyse below:\n')
+abf = load_trace(file_path) ## decoded data is kept in Trace_cache, see traceCache
 
 ### extract main data
-data = abf.data
-current_trace = data[0,:] # extracts primary channel recording in VC which is voltage measurement 
+current_trace = abf.get_channel(0) # extracts primary channel recording in VC which is voltage measurement 
 current_data_baseline = np.mean(current_trace [0:1999])### calculate baseline pA response by averaging the first 100ms
 current_trace_baseline_substracted = current_trace - current_data_baseline
-voltage_trace = data[1,:] # extracts 2ndary channel recording in VC which is current measurement 
+voltage_trace = abf.get_channel(1) # extracts 2ndary channel recording in VC which is current measurement, only the points used below (baseline and epochs) are decoded
 voltage_data_baseline = np.mean(voltage_trace [0:1999])
-LED_trace = data[-1,:] # extracts last channel recording in VC which is LED analog signal (channel 3 = LED TTL, not needed)
+LED_trace = abf.get_channel(-1) # extracts last channel recording in VC which is LED analog signal (channel 3 = LED TTL, not needed)
 date_time = abf.abfDateTime
 protocol = abf.protocol
 time = abf.sweepX
 resting_potential = np.mean(voltage_trace [0:20000]) # takes mean of all values aquired in the 1st second which is used as baseline membrane resting potential 
 sampling_rate = abf.dataPointsPerMs
+sweep_points = abf.sweepPointCount ## points of each sweep, the sweeps of episodic protocols follow each other in each channel (see pulseEpochs)
 file_name = abf.abfID ### extract filename 
 protocol = abf.protocol
 
+start_stage('metadata')
 ### select experimenter 
 
-user_input = int(input('Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
+user_input = int(ask('rig', 'Which rig was used for this recording:   Rig 1 = 1   Rig 2 = 2\n'))
 
 experimenter_dict = { 
        1 : 'Rig 1' , 
@@ -75,7 +83,7 @@ else:
     raise ValueError ('Wrong number entered for Rig used, please run script again. No data was saved') #print this if choice selected in not in the opsin dictionary 
 
 ### select opsin type 
-user_input = int(input('What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
+user_input = int(ask('cell_type', 'What cell type is this? Type the corresponding number: \nWT = 0\nEXCITATORY OPSINS: ChR2(1)      CoChR(2)     Chrimson(3)         ReaChR(4)       Chronos(5)      Cheriff(6)     \nINHIBITORY OPSINS: GtACR1(7)       GtACR2(8)       NpHR(9)         Arch(10)\n\n'))
 
 cell_type_dict = { 
        0 : 'WT' , 
@@ -102,7 +110,7 @@ else:
 ##### establish LED stimulation: LED wavelenght and power 
 
 ##extract wavelenght used 
-LED_wavelenght_user = int(input('What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
+LED_wavelenght_user = int(ask('LED_wavelength', 'What LED wavelenght did you use for this trace? Chose from the following options: \n(1)  475nm (LED3)    \n(2)  520nm (LED4)  \n(3)  543nm (TRITC)\n(4)  575nm (LED5)\n(5)  630nm (cy5)\n'))
 
 LED_wavelength_dict = { 
        1 : '475' , 
@@ -121,7 +129,7 @@ else:
 
 
 ## extract power range 
-LED_stim_type_user = int(input('What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
+LED_stim_type_user = int(ask('LED_stim_type', 'What LED stim did you do? Chose from the following options: \n(1)  475nm 2% max irradiance\n(2)  475nm 20% max irradiance\n(3)  475nm 50% max irradiance\n(4)  475nm 100% max irradiance\n\n(5)  520nm 50% max irradiance\n(6)  520nm 100% max irradiance\n\n(7)  543nm 50% max irradiance\n(8)  543nm 100% max irradiance\n\n(9)  575nm 50% max irradiance\n(10)  575nm 100% max irradiance\n\n(11)  630nm 50% max irradiance\n(12)  630nm 100% max irradiance\n\n'))
 
 LED_power_setup_dict = { 
        1 : 'LED_475_2%' , 
@@ -145,38 +153,29 @@ if LED_stim_type != None:
 else:
     raise ValueError ('Wrong number entered for LED stimulation type, please run script again. No data was saved') #print this if choice selected in not in the opsin dictionary 
 
+start_stage('detect')
 ###### find index values where LED is ON use this to extract all other info from current trace
-LED_idx = (np.where(LED_trace > 0)) # index of values in LED trace where V values are over 0
-LED_array = np.asarray(LED_idx) #transform into an array for next step
 
-## function to find consecutive elements
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) != stepsize)[0]+1)
-
-LED_idx_cons = consecutive(LED_array[0]) #find consecutive indexes where LED is ON and split into separate arrays --> each array would be 1 LED stim
-LED_idx_cons_df = pd.DataFrame(LED_idx_cons) #transform data into dataframe for easier processing below 
-LED_idx_cons_df_T = LED_idx_cons_df.T
-LED_idx_cons_df_T_last = LED_idx_cons_df_T.iloc[19899:19999]
-LED_idx_cons_df_last = LED_idx_cons_df_T.iloc[19899:19999].T
-
-LED_end_idx = LED_idx_cons_df_last.values
+LED_onsets, LED_offsets, LED_lengths = find_pulses(LED_trace > 0, sweep_points) #find where each LED pulse starts and ends (LED trace V values over 0) --> each pulse would be 1 LED stim
 
 ### determine lenght of LED Stim
-LED_time =pd.Series (LED_idx_cons_df.count(axis = 'columns'), name ='LED_time_ON' )#count the number of elements in each row so that you can extract the length of each pulse (e.g 20 elements = 1ms)
+LED_time =pd.Series (LED_lengths, name ='LED_time_ON' )#number of points of each pulse so that you can extract the length of each pulse (e.g 20 elements = 1ms)
 LED_time = round(LED_time / sampling_rate) # transform number of elements into actual ms rounded 
+LED_sweeps = get_pulse_sweeps(LED_onsets, sweep_points) ## sweep of each LED pulse (0 = 1st sweep)
 
+start_stage('extract')
 ### increase array to add 100ms before and 1s after current pulse to collect more current data
-LED_expand_idx =[np.concatenate([ [x[0]-i-1 for i in reversed(range(1999))], x, [x[-1]+i+1 for i in range(19999)] ]) for x in LED_idx_cons]
-LED_steady_calculation = [np.concatenate([x, [x[-1]+i+1 for i in range(19999)] ]) for x in LED_end_idx]
+LED_expand_idx = get_epoch_bounds(LED_onsets, LED_offsets, pre_points = 1999, post_points = 19999, sweep_points = sweep_points)
+LED_steady_calculation = get_epoch_bounds(LED_offsets - 100, LED_offsets, post_points = 19999, sweep_points = sweep_points) ## last 100 points of each LED pulse + 1s after
 
 
 ###### use selected indices to extract current and voltage data
-current_data = [current_trace_baseline_substracted [i] for i in LED_expand_idx] # use index extracted for each individual pulse to extract current values 
+current_data = extract_epochs(current_trace_baseline_substracted, LED_expand_idx) # use index extracted for each individual pulse to extract current values 
 current_data_df = pd.DataFrame(current_data) #transform current_data into a data frame
 
-current_data_steady = [current_trace_baseline_substracted [i] for i in LED_steady_calculation]
-voltage_data = [voltage_trace [i] for i in LED_expand_idx]  # use index extracted for each individual pulse to extract voltage values 
-LED_data = [LED_trace [i] for i in LED_expand_idx] 
+current_data_steady = extract_epochs(current_trace_baseline_substracted, LED_steady_calculation)
+voltage_data = extract_epochs(voltage_trace, LED_expand_idx)  # use index extracted for each individual pulse to extract voltage values 
+LED_data = extract_epochs(LED_trace, LED_expand_idx) 
 LED_data_df = pd.DataFrame(LED_data)
 
 
@@ -187,41 +186,17 @@ else:
     current_max = list(map(max, current_data))
 
 
+start_stage('power lookup')
 ####### determine max LED analog pulse value
 LED_max_V = list(map(max, LED_data)) ## find max LED pulse points 
-threshold = len([1 for i in LED_max_V if i > 5])## count if there are any values over 5V in LED_max_V, means that scale was set up wrong and pulse values in V need to be introduced manually by user 
+LED_index_value, LED_scale_factor = get_LED_steps(experimenter, LED_stim_type, LED_max_V, date_time, abf) ## LED steps rounded to 0.1V, pulses over 5V (LED analog input recorded with the wrong scale) are rescaled automatically
 
-if threshold == 0: ## pulse values are below 5V
-    LED_max_V_round = [round (i,1) for i in LED_max_V] ## round number to 2 decimals
-    LED_max_V_round_int = [str(i) for i in  LED_max_V_round] ## transform number to int otherwise can't index into LED_stim_power_table
-    LED_index_value = LED_max_V_round_int
-else:
-    print('Wrong scale detected for LED analog input. Please add LED steps in Volts below, and na for no pulse applied:\n')
-    LED_max_V_user = [input('pulse_1:  \n'), input('pulse2:  \n'), input('pulse3:  \n'), input('pulse4:  \n'), input('pulse5:  \n'), input('pulse6:  \n'), input('pulse7:  \n'),input('pulse8:  \n')]
-    LED_index_value = LED_max_V_user
-    while 'na' in LED_max_V_user: LED_max_V_user.remove('na')  ## remove any na values since we don't need them 
-
-##### open up excel sheet with all LED power values
-if experimenter == 'Rig 2':
-    xlsx_filename = os.path.join(wdir, 'Rig_2_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_543_50%', 'LED_543_100%', 'LED_630_50%', 'LED_630_100%']
-
-else: 
-    xlsx_filename = os.path.join(wdir, 'Rig_1_LED_power.xlsx')
-    LED_stim_power_table = pd.read_excel(xlsx_filename, index_col = 1) #load dataframe containing LED powers and use V step as index values
-    LED_stim_power_table_index = LED_stim_power_table.index.astype(str) #extract index from dataframe as string 
-    LED_stim_power_table.index = LED_stim_power_table_index ## add index back to dataframe as string and not float as it was originally 
-    LED_stim_power_table.columns = [ 'Voltage_step_V', 'LED_475_2%', 'LED_475_20%', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_575_50%', 'LED_575_100%']
-
-### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2
-LED_power_pulse =  LED_stim_power_table.loc[LED_index_value, LED_stim_type] ## index and extract mW/mm2 value of pulse based on V pulse value and type of stimulation 
-LED_power_pulse= round(LED_power_pulse,2 ) ## round up to 2 decimal values, can't do more since I have some 0.xx values 
-LED_power_pulse= pd.Series(LED_power_pulse.astype(str)) # transform to str 
-LED_power_pulse = LED_power_pulse.reset_index( drop = True)
+### use LED max value extracted and the stimulation type to get absolute power value in mW/mm2 (LED power tables compiled once, see ledPower)
+LED_calibration = get_calibration(experimenter, date_time) ## LED power table valid on the day of the recording, saved with the data
+LED_power_pulse = get_LED_power(experimenter, LED_stim_type, LED_index_value, date_time) ## mW/mm2 value of each pulse, interpolated between calibrated V steps
+LED_power_pulse= pd.Series(np.round(LED_power_pulse, 2)).astype(str) ## round up to 2 decimal values, can't do more since I have some 0.xx values; transform to str 
 
+start_stage('extract')
 #### calculate delay between light onset and peak of response
 
 ## find where current response starts 
@@ -251,50 +226,49 @@ opsin_resp_max_delay_ms = 'Clampfit calculation'
 steady_current = current_data_df_temp.iloc[21898:21998] ##last 5ms where light is on
 steady_current_mean = steady_current.mean(axis=0)
 
+start_stage('fit')
 ### extracting inactivation time constant
 ### extracting tau value from peak to steady 
 if cell_type_selected == 'GtACR1' or cell_type_selected == 'GtACR2':
-    from exponentialFitGetTau import exponentialFitGetTau # fits to depolarising inward current 
+    fit_from = 'min' # fits to depolarising inward current 
 else:
-    from exponentialFitGetTauInhibitory import exponentialFitGetTau # fits to hyperpolarising outward current 
-
-inactivation_tau = []
+    fit_from = 'max' # fits to hyperpolarising outward current 
 
-for data_row in current_data:
-    y = data_row
-    x = np.linspace(1, len(y), len(y))
-    tau = exponentialFitGetTau(x, y, 1, 18000)
-    tau_LED_stim = tau / sampling_rate
-    inactivation_tau.append(tau_LED_stim)
-    print('Inactivation time constant for this photocurrent response is ' +str(round(tau_LED_stim,2)) + ' ms')
+inactivation_tau_points, inactivation_amplitude, inactivation_offset, inactivation_fit_r2 = exponentialFitGetTauBatch(current_data, 18000, fit_from, 0) ## all pulses fitted at once
+add_fit_plot('VC_inhibitory', file_name, plotExponentialFitsBatch, current_data, inactivation_tau_points, inactivation_amplitude, inactivation_offset, inactivation_fit_r2, 18000, fit_from, 'Inactivation') ## only drawn when fit plots are asked for
+inactivation_tau = list(inactivation_tau_points / sampling_rate)
+for tau_LED_stim, fit_r2 in zip(inactivation_tau, inactivation_fit_r2):
+    print('Inactivation time constant for this photocurrent response is ' +str(round(tau_LED_stim,2)) + ' ms (R squared of fit = ' + str(round(fit_r2,3)) + ')')
 
 ### extracting deactivation time constant
 ### extract tau off value from steady to baseline
 
-deactivation_tau = []
-for data_row in current_data_steady:
-    y = data_row
-    x = np.linspace(1, len(y), len(y))
-    tau = exponentialFitGetTau(x, y, 1, 10000)
-    tau_LED_stim = tau / sampling_rate
-    deactivation_tau.append(tau_LED_stim)
-    print('Deactivation time constant for this photocurrent response is ' +str(round(tau_LED_stim,2)) + ' ms')
+deactivation_tau_points, deactivation_amplitude, deactivation_offset, deactivation_fit_r2 = exponentialFitGetTauBatch(current_data_steady, 10000, fit_from, 0)
+add_fit_plot('VC_inhibitory', file_name, plotExponentialFitsBatch, current_data_steady, deactivation_tau_points, deactivation_amplitude, deactivation_offset, deactivation_fit_r2, 10000, fit_from, 'Deactivation')
+deactivation_tau = list(deactivation_tau_points / sampling_rate)
+for tau_LED_stim, fit_r2 in zip(deactivation_tau, deactivation_fit_r2):
+    print('Deactivation time constant for this photocurrent response is ' +str(round(tau_LED_stim,2)) + ' ms (R squared of fit = ' + str(round(fit_r2,3)) + ')')
 
+start_stage('extract')
 ## create time based on points extracted data 
 time_points_plot = [(np.arange(len(current_data[0]))*abf.dataSecPerPoint) * 1000]
 
 
+start_stage('persist')
 ###putting all data together to extract response values per trace 
 trace_data = pd.DataFrame({'trace_number':file_name ,
                            'date_time' : date_time,
                            'Experimenter': experimenter, 
                            'protocol' : protocol,  
+                           'sweep': LED_sweeps,
                            'cell_type': cell_type_selected, 
                            'I_level_baseline_pA': abs(current_data_baseline), 
                            'V_data_baseline':voltage_data_baseline,  
                            'LED_stim_wavelenght': LED_wavelength, 
                            'LED_time_ms': LED_time, 
                            'LED_power_mWmm': LED_power_pulse, 
+                           'LED_calibration': LED_calibration,
+                           'LED_scale_factor': LED_scale_factor,
                            'Max_photocurrent_pA' : current_max,
                            'Steady_photocurrent_pA': steady_current_mean, 
                            'Activation_time_ms':opsin_resp_max_delay_ms, 
@@ -305,6 +279,7 @@ trace_data = pd.DataFrame({'trace_number':file_name ,
 
 ### save individual file
 save_to_file = os.path.join(wdir, 'Analysis_output/Single_Trace_data/VC_inhibitory/')
+trace_data = save_waveforms(trace_data, save_to_file, file_name) ## raw data points are saved in a .npz file, .csv keeps a reference to them
 trace_data.to_csv(save_to_file + str(file_name) +'.csv', header = True) ## write file as individual csv file 
 
 
@@ -316,49 +291,36 @@ The master .csv file has already been provided but if you need to create it agai
 To make am empty dataframe with correctly labelled columns for this particular analysis: 
 
 ## make column list     
-VC_inhibitory_opsin_master_columns= ['trace_number','date_time','Experimenter', 'protocol',  'cell_type', 'I_level_baseline_pA', 'V_data_baseline',  'LED_stim_wavelenght', 'LED_time_ms', 'LED_power_mWmm', 'Max_photocurrent_pA', 'Steady_photocurrent_pA', 'Activation_time_ms','Inactivation_time_ms', 'Deactivation_time_ms', 'Current_points_plot', 'LED_points_plot'] #make index for values to be saved 
+VC_inhibitory_opsin_master_columns= ['trace_number','date_time','Experimenter', 'protocol',  'cell_type', 'I_level_baseline_pA', 'V_data_baseline',  'LED_stim_wavelenght', 'LED_time_ms', 'LED_power_mWmm', 'LED_calibration', 'LED_scale_factor', 'Max_photocurrent_pA', 'Steady_photocurrent_pA', 'Activation_time_ms','Inactivation_time_ms', 'Deactivation_time_ms', 'Current_points_plot', 'LED_points_plot'] #make index for values to be saved 
 ## make emty dataframe + column list 
 VC_inhibitory_opsin_master = pd.DataFrame(columns = VC_inhibitory_opsin_master_columns) #transform into Series and use given index 
 ## save it as .csv
 VC_inhibitory_opsin_master.to_csv('Analysis_output/VC_inhibitory_opsin_master.csv', header = True)
 """
-##open master sheet with data 
-VC_inhibitory_opsin_master = pd.read_csv('Analysis_output/VC_inhibitory_opsin_master.csv', index_col = 0) 
-
-### add data extracted here as a new row in opened dataframe
-VC_inhibitory_opsin_master = VC_inhibitory_opsin_master.append(trace_data, sort=False) #adds row with new values to main dataframe
-
-## save new version of updated dataframe as csv
-VC_inhibitory_opsin_master.to_csv('Analysis_output/VC_inhibitory_opsin_master.csv', header = True,)
+### add data extracted here as new rows of the master in the results store, the master file is written by python resultsStore.py (when running Batch_Analysis rows are merged and the master written at the end of the batch)
+add_to_master(trace_data, 'VC_inhibitory_opsin_master')
 
 
 
 
+start_stage('plot')
 #### plotting data
 
 ## create arrays for sample data to be plotted  
-LED_expand_idx_plot =[np.concatenate([ [x[0]-i-1 for i in reversed(range(1999))], x, [x[-1]+i+1 for i in range(19999)] ]) for x in LED_idx_cons] ### add 5ms pre LED start and 100ms after .  
-current_data_plot = [ current_trace_baseline_substracted [i] for i in LED_expand_idx_plot]
+LED_expand_idx_plot = get_epoch_bounds(LED_onsets, LED_offsets, pre_points = 1999, post_points = 19999) ### add 5ms pre LED start and 100ms after .  
+current_data_plot = extract_epochs(current_trace_baseline_substracted, LED_expand_idx_plot)
 
 time_points_plot = (np.arange(len(current_data_plot[0]))*abf.dataSecPerPoint) * 1000
 time_points_plot = [time_points_plot] * len(current_data)
 
     
-#### make figure with sample data 
+#### make figure with sample data (drawn in the background and saved in Analysis_output/Figures when running Batch_Analysis)
     
-fig1 = plt.figure(figsize =(30,5))
-fig1.subplots_adjust(wspace=0.5)
-
-for counter, (current, time, power) in enumerate (zip (current_data_plot, time_points_plot, LED_power_pulse), start = 1): 
-    sub = plt.subplot(2,len(current_data),counter)
-    markers_on = [1999, 22000]
-    sub.plot (time, current, '-om', markevery = markers_on, markerfacecolor="m", markeredgecolor = 'w', linewidth=0.3, color = '0.2')
-    sub.tick_params (axis = 'x', colors='black') 
-    sub.spines['bottom'].set_color('black')
-    sub.set_title(power + ' mW/mm2', color = '0.2')
-    plt.setp(sub.get_xticklabels(), visible = True)
-    plt.xlabel('Time (ms)\n Magenta Dots = LED ON/OFF')
-    plt.ylabel('Photocurrent (pA)')
-    plt.suptitle('Example opsin photocurrent responses from this trace', fontsize=16)
-
-    sns.despine()
+markers_on = [1999, 22000]
+add_figure('VC_inhibitory', file_name, 'LED_responses', plot_pulse_responses,
+           current_data_plot, time_points_plot, [power + ' mW/mm2' for power in LED_power_pulse], markers_on,
+           'Example opsin photocurrent responses from this trace', 'Time (ms)\n Magenta Dots = LED ON/OFF', (30,5), 0.5)
+
+
+### save time and memory used by each stage of the script (Analysis_output/Stage_timing)
+save_stage_times('VC_inhibitory', file_name, protocol)
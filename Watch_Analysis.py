@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script watches the data folder of a recording session and analyses every new .abf file as soon as it is fully written,
+so that the results of a cell are in the master .csv files while the next cell is being recorded.
+
+How the script works:
+1. Runs until stopped (Ctrl+C) in one process: python, numpy, pandas, scipy, pyabf, the helper modules and the LED power
+   tables are loaded once when the script starts, so each new trace only takes the time of its analysis
+2. Every --poll seconds looks for .abf files in the data folder. A file is ready once its size and modification time
+   have not changed for --settle seconds and its header says the data is complete (header readable by pyabf and
+   file at least as long as the data points announced), so a trace still being acquired by Clampex is never opened
+3. Matches each ready file to the metadata of the session, as Batch_Analysis does:
+   - rows of the metadata sheet (--metadata) with the same Trace_ID. The sheet is read again whenever it is saved, so
+     rows can be added during the session; a file without metadata waits until its row is added
+   - otherwise the analyses given for the whole session (--script, --rig, --opsin, --wavelength, --irradiance,
+     --LED-frequency), e.g. every trace of the session recorded with Excitatory_Opsin_Voltage_Clamp. Several scripts
+     can be given (--script Excitatory_Opsin_Current_Clamp Inhibitory_Opsin_Current_Clamp), or auto to recognise the
+     script of each trace from its protocol and stimulus (see protocolClassifier)
+4. Runs the analysis scripts on the trace (Batch_Analysis.analyse_recording: the trace is opened, and its pulses, spikes
+   and epochs found, once for all of them) and adds their rows to the master .csv files at once
+   (resultsStore.merge_into_masters, rows of a trace analysed again are replaced)
+5. Figures are drawn by separate render processes (--render-workers) so that the next trace does not wait for them
+6. Appends what happened to each trace to Analysis_output/Watch_log.csv, with the size and modification time of the file.
+   Files already analysed in an earlier session (same size and modification time in the log) are not analysed again,
+   unless --reanalyse is used
+
+Usage from a terminal:
+python Watch_Analysis.py D:/Data/2020-06-15 --metadata D:/Data/2020-06-15/Session_info.xlsx
+python Watch_Analysis.py D:/Data/2020-06-15 --script Excitatory_Opsin_Voltage_Clamp --rig 1 --opsin ChR2 --wavelength 475 --irradiance LED_475_100%
+python Watch_Analysis.py Sample_data --once      (analyse the files already complete and stop, e.g. to catch up after a crash)
+"""
+
+import argparse
+import datetime
+import glob
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg') ## figures are drawn without opening a window so that the script never waits on the user
+import numpy as np
+import pandas as pd
+
+import Batch_Analysis
+import ledPower
+import resultsStore
+import traceCache
+
+## helper modules imported by the analysis scripts, loaded once when the script starts
+import exponentialFitGetTauBatch
+import pulseEpochs
+import pulseIntervals
+import rheobase
+import spikeEpochs
+import spikeTrains
+import tracePlots
+import traceStream
+
+poll_interval_s = 2 ## time between two looks at the data folder
+settle_time_s = 5 ## time a file must stay unchanged before it is analysed
+watch_log_name = 'Watch_log.csv'
+watch_log_columns = ['trace_number', 'script', 'status', 'message', 'file_size', 'file_mtime_ns', 'analysis_time_s', 'finished_at']
+
+
+def get_file_state(file_path):
+    """
+    Returns (size, modification time in ns) of a file, None if it cannot be read (e.g. removed).
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def is_recording_complete(file_path, file_size):
+    """
+    Returns True when the header of the .abf file can be read and the file holds all the data points it announces.
+    """
+    try:
+        header = traceCache.read_abf_header(file_path)
+    except Exception: ## header not fully written yet
+        return False
+    data_end = header['dataByteStart'] + header['dataPointCount'] * np.dtype(header['raw_dtype']).itemsize
+    return header['dataPointCount'] > 0 and file_size >= data_end
+
+
+def find_ready_files(data_folder, file_states, done_states, settle_time = settle_time_s):
+    """
+    Returns the .abf files of data_folder (sorted) that stopped changing settle_time seconds ago and are complete.
+    1st term = folder watched
+    2nd term = dictionary file path -> (size, modification time, time it was first seen with them), updated here
+    3rd term = dictionary file path -> (size, modification time) of the files already analysed (or waiting for metadata)
+    """
+    ready_files = []
+    now = time.monotonic()
+    abf_files = sorted(glob.glob(os.path.join(data_folder, '*.abf')))
+    for file_path in abf_files:
+        file_state = get_file_state(file_path)
+        if file_state is None or done_states.get(file_path) == file_state:
+            continue
+        if file_states.get(file_path, (None, None, None))[:2] != file_state: ## new file, or still being written
+            file_states[file_path] = file_state + (now,)
+            if settle_time > 0:
+                continue
+        if now - file_states[file_path][2] >= settle_time and is_recording_complete(file_path, file_state[0]):
+            ready_files.append(file_path)
+    for file_path in set(file_states) - set(abf_files): ## removed or renamed files
+        del file_states[file_path]
+    return ready_files
+
+
+def get_session_metadata(args):
+    """
+    Returns the metadata rows used for every trace of the session, one per --script (same keys as a row of the metadata
+    sheet), None if no --script.
+    """
+    if args.script is None:
+        return None
+    session_metadata = []
+    for script_name in args.script:
+        metadata_row = {'Python_Script' : script_name ,
+                        'Rig ID' : args.rig ,
+                        'Opsin' : args.opsin ,
+                        'Wavelength' : args.wavelength ,
+                        'Irradiance_Range' : args.irradiance ,
+                        'LED_frequency_Hz' : args.LED_frequency }
+        metadata_row = {key: Batch_Analysis.clean_metadata_value(value) for key, value in metadata_row.items()}
+        if metadata_row['Python_Script'].lower() != Batch_Analysis.auto_script_name:
+            Batch_Analysis.get_script_path(metadata_row['Python_Script'])
+        Batch_Analysis.metadata_to_answers(metadata_row) ## wrong answers stop the script now, not at the first trace
+        session_metadata.append(metadata_row)
+    return session_metadata
+
+
+def get_trace_metadata(trace_id, metadata, session_metadata):
+    """
+    Returns the list of metadata rows of a trace: its rows of the metadata sheet, otherwise the session metadata.
+    """
+    if metadata is not None:
+        trace_metadata = metadata[metadata['Trace_ID'] == trace_id]
+        if not trace_metadata.empty:
+            return [metadata_row.to_dict() for _, metadata_row in trace_metadata.iterrows()]
+    if session_metadata is not None:
+        return list(session_metadata)
+    return []
+
+
+def read_watch_log(log_path):
+    """
+    Returns a dictionary file name -> (size, modification time) of the files already analysed according to the watch log.
+    """
+    if not os.path.isfile(log_path):
+        return {}
+    watch_log = pd.read_csv(log_path, dtype = {'trace_number' : str })
+    watch_log = watch_log[watch_log['status'] != 'skipped']
+    return {str(trace_id): (int(file_size), int(file_mtime_ns)) for trace_id, file_size, file_mtime_ns
+            in zip(watch_log['trace_number'], watch_log['file_size'], watch_log['file_mtime_ns'])}
+
+
+def append_to_watch_log(log_path, log_rows):
+    log_rows = pd.DataFrame(log_rows, columns = watch_log_columns)
+    log_rows.to_csv(log_path, mode = 'a', header = not os.path.isfile(log_path), index = False)
+
+
+def load_led_power_tables():
+    """
+    Loads the LED power tables of every rig once, so that the first trace of the session does not read the .xlsx files.
+    """
+    for rig in Batch_Analysis.rig_answer_dict:
+        for calibration in ledPower.get_calibrations(rig)[1]:
+            ledPower.compile_power_table(calibration, rig)
+
+
+def collect_figures(render_futures, wait = False):
+    """
+    Reports the figures drawn since the last call and returns the figures still being drawn.
+    wait = True waits until all figures are drawn.
+    """
+    pending_futures = []
+    for job_no, figure_path, render_future in render_futures:
+        if not wait and not render_future.done():
+            pending_futures.append((job_no, figure_path, render_future))
+            continue
+        try:
+            render_future.result()
+        except Exception as error:
+            print ('Figure ' + figure_path + ' could not be drawn: ' + repr(error))
+    return pending_futures
+
+
+def analyse_file(file_path, trace_metadata, render_pool, render_futures, figures = True, fit_plots = False, track_memory = True):
+    """
+    Analyses one ready trace with each of its metadata rows and adds its rows to the master .csv files.
+    Returns the rows of the watch log.
+    """
+    trace_id = os.path.splitext(os.path.basename(file_path))[0]
+    log_rows = []
+    master_rows = []
+    trace_jobs = []
+    for metadata_row in trace_metadata:
+        script_name = metadata_row['Python_Script']
+        try:
+            trace_answers = Batch_Analysis.metadata_to_answers(metadata_row)
+            if script_name.lower() == Batch_Analysis.auto_script_name:
+                script_name, trace_answers = Batch_Analysis.classify_trace(file_path, trace_answers)
+        except Exception as error: ## wrong metadata or trace not recognised
+            print ('Trace ' + trace_id + ' failed: ' + repr(error) + '\n')
+            log_rows.append({'trace_number': trace_id, 'script': script_name, 'status': 'failed', 'message': repr(error)})
+            continue
+        trace_jobs.append((trace_id, file_path, script_name, trace_answers))
+
+    for status, message, trace_master_rows, figure_jobs, stage_times, script_name in Batch_Analysis.analyse_recording(trace_jobs, figures, fit_plots, track_memory):
+        master_rows.extend(trace_master_rows)
+        render_futures.extend(Batch_Analysis.render_trace_figures(render_pool, trace_id, figure_jobs))
+        log_rows.append({'trace_number': trace_id, 'script': script_name, 'status': status, 'message': message,
+                         'analysis_time_s': stage_times.get('total_time_s', np.nan)})
+
+    if master_rows:
+        resultsStore.merge_into_masters(master_rows)
+    return log_rows
+
+
+def watch_folder(data_folder, metadata_path = None, session_metadata = None, once = False, reanalyse = False, render_workers = 2,
+                 figures = True, fit_plots = False, track_memory = True, poll_interval = poll_interval_s, settle_time = settle_time_s):
+    """
+    Analyses the new .abf files of data_folder until stopped (Ctrl+C), see the description at the top.
+    1st term = folder watched
+    2nd term = metadata sheet (.xlsx or .csv) of the session, None to only use session_metadata
+    3rd term = metadata rows used for the traces not in the sheet (see get_session_metadata), None to wait for their row
+    once = True to analyse the files already complete and stop
+    Returns the number of traces analysed, skipped and failed.
+    """
+    log_path = os.path.join(resultsStore.output_folder, watch_log_name)
+    os.makedirs(resultsStore.output_folder, exist_ok = True)
+    analysed_files = {} if reanalyse else read_watch_log(log_path) ## file name -> (size, modification time)
+    load_led_power_tables()
+
+    metadata, metadata_state = None, None
+    file_states = {}
+    done_states = {} ## file path -> (size, modification time) analysed or waiting for metadata
+    waiting_files = set() ## files without metadata, until the metadata sheet changes
+    status_counts = {'analysed' : 0 , 'skipped' : 0 , 'failed' : 0 }
+    render_futures = []
+    print ('Watching ' + str(data_folder) + ' for new .abf files (Ctrl+C to stop)\n')
+    with Batch_Analysis.start_render_pool(render_workers, figures) as render_pool:
+        try:
+            while True:
+                if metadata_path is not None and get_file_state(metadata_path) != metadata_state:
+                    metadata_state = get_file_state(metadata_path)
+                    try:
+                        metadata = Batch_Analysis.load_metadata(metadata_path)
+                    except Exception as error: ## sheet being saved, the last version read is kept until the next change
+                        print ('Metadata sheet could not be read: ' + repr(error) + '\n')
+                    for file_path in waiting_files: ## files without metadata are matched again with the new sheet
+                        done_states.pop(file_path, None)
+                    waiting_files = set()
+
+                for file_path in find_ready_files(data_folder, file_states, done_states, 0 if once else settle_time):
+                    file_state = file_states[file_path][:2]
+                    done_states[file_path] = file_state
+                    trace_id = os.path.splitext(os.path.basename(file_path))[0]
+                    if analysed_files.get(trace_id) == file_state:
+                        continue
+                    trace_metadata = get_trace_metadata(trace_id, metadata, session_metadata)
+                    if not trace_metadata:
+                        print ('Trace ' + trace_id + ' waiting: no metadata found\n')
+                        waiting_files.add(file_path)
+                        if once:
+                            status_counts['skipped'] += 1
+                            append_to_watch_log(log_path, [{'trace_number': trace_id, 'status': 'skipped', 'message': 'no metadata found'}])
+                        continue
+
+                    log_rows = analyse_file(file_path, trace_metadata, render_pool, render_futures, figures, fit_plots, track_memory)
+                    finished_at = datetime.datetime.now().isoformat(timespec = 'seconds')
+                    for log_row in log_rows:
+                        log_row.update({'file_size': file_state[0], 'file_mtime_ns': file_state[1], 'finished_at': finished_at})
+                        status_counts[log_row['status']] += 1
+                    append_to_watch_log(log_path, log_rows)
+                    analysed_files[trace_id] = file_state
+                    render_futures = collect_figures(render_futures)
+
+                if once:
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print ('\nStopping, waiting for the last figures')
+        collect_figures(render_futures, wait = True)
+    return status_counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Analyse the new .abf files of a folder as soon as they are recorded')
+    parser.add_argument('data_folder', help = 'folder where the .abf files of the session are saved')
+    parser.add_argument('--metadata', default = None, help = 'metadata sheet of the session (.xlsx or .csv, layout of Sample_data_info.xlsx)')
+    parser.add_argument('--script', nargs = '+', default = None, help = 'analysis script(s) used for the traces not in the metadata sheet, e.g. Excitatory_Opsin_Voltage_Clamp')
+    parser.add_argument('--rig', default = None, help = 'rig of the session, e.g. 1')
+    parser.add_argument('--opsin', default = None, help = 'opsin of the session, e.g. ChR2')
+    parser.add_argument('--wavelength', default = None, help = 'LED wavelength of the session, e.g. 475')
+    parser.add_argument('--irradiance', default = None, help = 'LED stimulation type of the session, e.g. LED_475_100%%')
+    parser.add_argument('--LED-frequency', default = None, help = 'LED frequency tested (Hz), needed by Excitatory_Opsin_Current_Clamp_Frequency')
+    parser.add_argument('--once', action = 'store_true', help = 'analyse the files already complete and stop')
+    parser.add_argument('--reanalyse', action = 'store_true', help = 'also analyse the files already in the watch log')
+    parser.add_argument('--poll', type = float, default = poll_interval_s, help = 'seconds between two looks at the folder, default = ' + str(poll_interval_s))
+    parser.add_argument('--settle', type = float, default = settle_time_s, help = 'seconds a file must stay unchanged before it is analysed, default = ' + str(settle_time_s))
+    parser.add_argument('--render-workers', type = int, default = 2, help = 'number of processes drawing the figures in the background, default = 2')
+    parser.add_argument('--no-figures', action = 'store_true', help = 'do not draw any figure')
+    parser.add_argument('--fit-plots', action = 'store_true', help = 'also draw the monoexponential fit of every pulse (one .pdf per trace)')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'only measure the time of each stage, not its peak memory')
+    args = parser.parse_args()
+
+    data_folder = os.path.abspath(args.data_folder)
+    metadata_path = os.path.abspath(args.metadata) if args.metadata else None
+    if metadata_path is None and args.script is None:
+        parser.error('give the metadata sheet of the session (--metadata) or the analysis of every trace (--script and its answers)')
+
+    os.chdir(Batch_Analysis.wdir) ## analysis scripts save their output relative to their own folder
+    status_counts = watch_folder(data_folder, metadata_path, get_session_metadata(args), once = args.once, reanalyse = args.reanalyse,
+                                 render_workers = args.render_workers, figures = not args.no_figures, fit_plots = args.fit_plots,
+                                 track_memory = not args.no_memory, poll_interval = args.poll, settle_time = args.settle)
+    print ('\nWatch finished: ' + ', '.join(str(count) + ' ' + status for status, count in status_counts.items()))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keeps the answers to the questions each analysis script asks the user (file path, rig, opsin, LED wavelength etc).
+
+When a script is run on its own (e.g. from Spyder) nothing changes: every question is asked with input().
+When a script is launched by Batch_Analysis the answers are registered here before the script starts,
+using the metadata sheet of the experiment, so the script runs from start to end without any prompt.
+"""
+
+answers = None ## dictionary of pre-registered answers for the trace being analysed, None when running interactively
+master_rows = None ## list collecting the rows meant for the master .csv files when running inside a batch, None when running by hand
+
+
+def start(trace_answers, collect_master_rows = False):
+    """
+    Registers the answers for the next trace to be analysed.
+    1st term = dictionary with key = name of the question (e.g. 'rig', 'cell_type') and value = answer as the user would type it
+    2nd term = True to keep the rows meant for the master .csv files here instead of saving them (see resultsStore)
+    """
+    global answers, master_rows
+    answers = dict(trace_answers)
+    master_rows = [] if collect_master_rows else None
+
+
+def stop():
+    """
+    Removes registered answers so that scripts go back to asking the user.
+    Returns the master rows collected for the trace (None if they were not collected).
+    """
+    global answers, master_rows
+    collected_rows = master_rows
+    answers = None
+    master_rows = None
+    return collected_rows
+
+
+def ask(key, question):
+    """
+    Replacement for input() used by the analysis scripts.
+    1st term = name of the question in the registered answers (e.g. 'rig')
+    2nd term = question shown to the user when running interactively
+    Returns the answer as a string, exactly like input() would.
+    """
+    if answers is None:
+        return input(question)
+
+    answer = answers.get(key)
+    if answer is None:
+        raise ValueError ('No ' + str(key) + ' value found in the metadata for this trace. No data was saved')
+
+    print (str(key) + ' = ' + str(answer) + ' (from metadata)')
+    return str(answer)
@@ -0,0 +1,161 @@
+"""
+Monoexponential fit of all LED pulses of a trace at once.
+
+Same fit as exponentialFitGetTau / exponentialFitGetTauInhibitory (y = a * exp(-x/b) + c, fitted from the min or max
+of each pulse over nbPointsForFit points) but done on all pulses together with numpy instead of one curve_fit per pulse:
+1. initial estimate of a, b and c for every pulse with a linear regression on the integral of y (no iteration needed)
+2. Levenberg-Marquardt iterations on all pulses at once, using the analytic derivatives of the exponential
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def getExponentialPartBatch(data, nbPointsForFit=0, fitFrom='min'):
+  """
+  Returns the points to fit for every pulse as a 2D array (pulses x points), padded with 0 where a pulse has less points,
+  the matching 2D array of weights (1 = point to fit, 0 = padding) and the index of the 1st point fitted in each pulse.
+  1st term = list of arrays or 2D array with the data points of each pulse
+  2nd term = number of points for which to do the fit (0 = until the end of each pulse)
+  3rd term = 'min' to start the fit at the min of each pulse (downward slopes), 'max' to start at the max (upward slopes)
+  """
+  pulseLengths = np.array([len(y) for y in data])
+  yAll = np.full((len(data), pulseLengths.max()), np.nan)
+  for pulse, y in enumerate(data):
+    yAll[pulse, :len(y)] = y
+
+  if fitFrom == 'min':
+    startIndex = np.where(np.isnan(yAll), np.inf, yAll).argmin(axis=1)
+  elif fitFrom == 'max':
+    startIndex = np.where(np.isnan(yAll), -np.inf, yAll).argmax(axis=1)
+  else:
+    raise ValueError("fitFrom must be 'min' or 'max'")
+
+  fitLengths = pulseLengths - startIndex
+  if nbPointsForFit != 0:
+    fitLengths = np.minimum(fitLengths, nbPointsForFit)
+
+  pointIndex = np.arange(fitLengths.max())
+  weights = (pointIndex[None, :] < fitLengths[:, None]).astype(float)
+  yExpPart = np.take_along_axis(yAll, np.minimum(startIndex[:, None] + pointIndex[None, :], yAll.shape[1] - 1), axis=1)
+  yExpPart = np.where(weights > 0, yExpPart, 0)
+  return [yExpPart, weights, startIndex]
+
+
+def initialEstimateBatch(t, y, weights):
+  """
+  Closed form estimate of a, k (= 1/b) and c for every pulse.
+  For y = a * exp(-k t) + c, the integral S of y from 0 to t gives y = (a + c) + c k t - k S,
+  so a weighted linear regression of y on [1, t, S] gives k, then a regression of y on [exp(-k t), 1] gives a and c.
+  """
+  dt = np.diff(t, prepend=t[0])
+  S = np.cumsum(0.5 * (y + np.roll(y, 1, axis=1)) * dt, axis=1)
+  S[:, 0] = 0
+  k = -solveWeightedBatch([np.ones_like(y), np.broadcast_to(t, y.shape), S], y, weights)[:, 2]
+  k = np.where(np.isfinite(k) & (k > 0), k, 1.0 / t[-1]) ## flat or growing responses: start from a slow decay
+  a, c = solveWeightedBatch([np.exp(-k[:, None] * t), np.ones_like(y)], y, weights).T
+  return a, k, c
+
+
+def solveWeightedBatch(columns, y, weights):
+  """
+  Weighted least squares y = sum(p_i * column_i) for every row at once. Returns the parameters (rows x columns).
+  """
+  X = np.stack(columns, axis=2) * weights[:, :, None]
+  XtX = np.einsum('rni,rnj->rij', X, X)
+  Xty = np.einsum('rni,rn->ri', X, y * weights)
+  XtX = XtX + np.eye(len(columns)) * 1e-12 * np.trace(XtX, axis1=1, axis2=2)[:, None, None]
+  return np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]
+
+
+def exponentialFitGetTauBatch(data, nbPointsForFit=0, fitFrom='min', showPlot=0, maxIterations=50, tolerance=1.49012e-08):
+  """
+  This function outputs a monoexponential fit to the points of every pulse in data.
+  1st term = list of arrays or 2D array with the data points of each pulse (e.g. current_data)
+  2nd term = number of points for which to do the fit (0 = until the end of each pulse)
+  3rd term = 'min' for downward slopes (as exponentialFitGetTau), 'max' for upward slopes (as exponentialFitGetTauInhibitory)
+  4th term = show plot of monoexponential fits (1) or not (0)
+  Returns 4 arrays with one value per pulse: tau (in points, as exponentialFitGetTau), amplitude of the exponential
+  at the 1st point fitted, offset (value the exponential decays to) and goodness of fit (R squared).
+  Iterations stop for a pulse when the sum of squares or the parameters change by less than tolerance (same default as curve_fit).
+  """
+  [y, weights, startIndex] = getExponentialPartBatch(data, nbPointsForFit, fitFrom)
+  pointNo = y.shape[1]
+  t = np.arange(pointNo) / max(pointNo - 1, 1) ## time scaled from 0 to 1 so that a, k and c have similar sizes
+  params = np.stack(initialEstimateBatch(t, y, weights), axis=1) ## a, k, c of every pulse
+
+  def sumSquares(params, rows):
+    residuals = (y[rows] - (params[:, 0, None] * np.exp(-params[:, 1, None] * t) + params[:, 2, None])) * weights[rows]
+    return residuals, np.einsum('rn,rn->r', residuals, residuals)
+
+  timePowers = np.stack([np.ones_like(t), t, t * t], axis=1)
+  pointsFitted = weights.sum(axis=1)
+
+  allRows = np.arange(len(params))
+  residuals, sse = sumSquares(params, allRows)
+  residualSums = residuals.sum(axis=1)
+  damping = np.full(len(params), 1e-3)
+  active = allRows[np.isfinite(sse)] ## pulses still being fitted, only these are computed at each iteration
+  for iteration in range(maxIterations):
+    if len(active) == 0:
+      break
+    a, k = params[active, 0], params[active, 1]
+    expPart = np.exp(-k[:, None] * t) * weights[active]
+    ## J = [e, -a t e, 1] (d(fit)/d(a, k, c)): JtJ and Jtr only need sums of e^2, e and e*r times 1, t and t^2
+    sums = np.stack([expPart * expPart, expPart, expPart * residuals[active]], axis=1) @ timePowers
+    e2, e2t, e2tt = sums[:, 0].T
+    e1, e1t = sums[:, 1, 0], sums[:, 1, 1]
+    er, ert = sums[:, 2, 0], sums[:, 2, 1]
+    JtJ = np.stack([np.stack([e2, -a * e2t, e1], axis=1),
+                    np.stack([-a * e2t, a * a * e2tt, -a * e1t], axis=1),
+                    np.stack([e1, -a * e1t, pointsFitted[active]], axis=1)], axis=1)
+    Jtr = np.stack([er, -a * ert, residualSums[active]], axis=1)
+    diagonal = np.einsum('rii->ri', JtJ)
+    dampedJtJ = JtJ + (damping[active, None, None] * diagonal[:, :, None] + 1e-12) * np.eye(3)
+    step = np.linalg.solve(dampedJtJ, Jtr[:, :, None])[:, :, 0]
+
+    paramsNew = params[active] + step
+    residualsNew, sseNew = sumSquares(paramsNew, active)
+    better = np.isfinite(sseNew) & (sseNew <= sse[active])
+    converged = better & (((sse[active] - sseNew) <= tolerance * sse[active]) |
+                          (np.abs(step) <= tolerance * (np.abs(params[active]) + tolerance)).all(axis=1))
+
+    improved = active[better]
+    params[improved] = paramsNew[better]
+    residuals[improved] = residualsNew[better]
+    sse[improved] = sseNew[better]
+    residualSums[improved] = residualsNew[better].sum(axis=1)
+    damping[active] = np.where(better, damping[active] / 10, damping[active] * 10)
+    active = active[~converged & (damping[active] < 1e10)]
+
+  a, k, c = params.T
+  tau = (pointNo - 1) / k ## back from scaled time to points
+  yMean = np.einsum('rn,rn->r', y, weights) / weights.sum(axis=1)
+  sst = np.einsum('rn,rn->r', (y - yMean[:, None]) * weights, (y - yMean[:, None]) * weights)
+  rSquared = 1 - sse / sst
+
+  if showPlot:
+    print('Monoexponential fits are superimposed (red) on raw data (blue)')
+    plotExponentialFitsBatch(data, tau, a, c, rSquared, nbPointsForFit, fitFrom)
+    plt.show()
+  return tau, a, c, rSquared
+
+
+def plotExponentialFitsBatch(data, tau, amplitude, offset, rSquared, nbPointsForFit=0, fitFrom='min', title=''):
+  """
+  Figure with one subplot per pulse showing the monoexponential fit (red) superimposed on the raw data (blue).
+  1st term = same data as given to exponentialFitGetTauBatch
+  2nd to 5th term = tau, amplitude, offset and R squared returned by exponentialFitGetTauBatch
+  6th and 7th term = same nbPointsForFit and fitFrom as given to exponentialFitGetTauBatch
+  """
+  [y, weights, startIndex] = getExponentialPartBatch(data, nbPointsForFit, fitFrom)
+  fig = plt.figure(figsize=(4 * len(y), 3))
+  for pulse in range(len(y)):
+    fitted = weights[pulse] > 0
+    points = np.arange(y.shape[1])[fitted]
+    x = startIndex[pulse] + 1 + points ## same x as exponentialFitGetTau (1st point of the pulse = 1)
+    sub = plt.subplot(1, len(y), pulse + 1)
+    sub.plot(x, y[pulse, fitted])
+    sub.plot(x, amplitude[pulse] * np.exp(-points / tau[pulse]) + offset[pulse], 'r-')
+    sub.set_title('tau = ' + str(round(tau[pulse], 1)) + ' points, R2 = ' + str(round(rSquared[pulse], 3)), fontsize=8)
+  plt.suptitle(title)
+  return fig
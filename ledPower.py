@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converts the LED pulses (V, analog input of the LED driver) to absolute LED powers (mW/mm2) with the calibration
+table of each rig that was valid on the day of the recording.
+
+The LEDs are calibrated again from time to time. Each calibration is an .xlsx file with the layout of
+Rig_1_LED_power.xlsx / Rig_2_LED_power.xlsx:
+- Rig_1_LED_power.xlsx, Rig_2_LED_power.xlsx (working directory) hold the first calibration of each rig
+- LED_calibrations/Rig_1_LED_power_2020-06-15.xlsx (the rig and the day from which it is used) holds a new calibration,
+  used for every recording made from that day until the day of the next calibration of the rig
+get_calibration(rig, recording_date) returns the name of the calibration used for a recording (e.g. 'Rig_1_LED_power'
+or 'Rig_1_LED_power_2020-06-15'), found by bisection in the calibration days of the rig; the scripts save it with the
+LED powers (LED_calibration column) so that it is always known which table gave them.
+
+Reading an .xlsx file takes longer than analysing a short trace, so each table is read once and saved as a compiled
+table (Trace_cache/LED_power/<calibration name>.npz: voltage steps, stimulation types and powers as numbers) together with the
+content hash (sha1) of the .xlsx file it comes from. The next analyses (also in other processes, e.g. batch workers)
+load the compiled table instead, and the .xlsx file is only read again once it has been changed. Analyses of the same
+recording run one after the other (see traceIndex) check the table once.
+
+get_LED_power(rig, LED_stim_type, LED_steps_V, recording_date) looks up all pulses of a trace at once. A pulse on a calibrated voltage
+step gets the power of the table, as before; a pulse between two calibrated steps of the stimulation type (e.g. 1.9 V
+when only 1.8 V and 2.0 V were measured) gets the power interpolated linearly between them instead of failing.
+A pulse outside the calibrated steps cannot be converted and raises a ValueError.
+
+get_LED_steps(rig, LED_stim_type, LED_max_V, recording_date, abf) turns the max value of each LED pulse into the
+LED step (V, rounded to 0.1 V) used to look up its power. LED steps never go above 5 V, so larger pulses mean that the
+LED analog input was recorded with the wrong scale. Instead of asking the user for every step, the scale is found from
+the pulses and the header of the .abf file. A scale fits when it brings every pulse inside the calibrated steps of the
+stimulation type and within scale_tolerance_V of a 0.1 V step. In order:
+- the gain of the LED channel in the acquisition software (e.g. 0.1 V/V records the pulses x10) is used when it fits
+- the units of the LED channel (mV instead of V gives 1000) are used when they fit
+- otherwise the usual gains (LED_scale_factors) that fit are kept; when the LED was driven by an output channel of the
+  protocol (name containing LED), only the gains giving its command levels are kept
+Several gains can still fit the pulses (e.g. 12 and 18 V pulses give 1.2 and 1.8 V divided by 10 but also 2.4 and 3.6 V
+divided by 5): the first of LED_scale_factors is then used and the others are given with it, e.g. '10 (or 5)', so that
+these traces can be found and checked. The scripts save the scale in the LED_scale_factor column (1 = scale correct).
+The steps can also be given in the LED_steps_V column of the metadata sheet of Batch_Analysis (e.g. 1.2, 1.8, one per
+pulse), which is used instead of any scale found; LED_scale_factor is then the ratio between the pulses and the steps given.
+"""
+
+import bisect
+import datetime
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import analysisSession
+import traceIndex
+from traceCache import cache_folder
+
+table_folder = os.path.join(cache_folder, 'LED_power')
+calibration_folder = 'LED_calibrations' ## calibrations made after the first one, see above
+step_tolerance_V = 1e-6 ## a pulse this close to a calibrated step gets the power of that step
+LED_max_step_V = 5 ## largest LED step, pulses above it were recorded with the wrong scale
+LED_scale_factors = (10, 100, 1000, 2, 5, 20, 50) ## scales tried for the LED analog input, most likely first
+unit_scale_factors = {'mV' : 1000 } ## scale given by the units of the LED channel
+scale_tolerance_V = 0.025 ## largest distance between a rescaled pulse and a 0.1 V step
+power_table_files = {'Rig 1' : 'Rig_1_LED_power.xlsx' ,
+                     'Rig 2' : 'Rig_2_LED_power.xlsx' }
+power_table_columns = {'Rig 1' : [ 'Voltage_step_V', 'LED_475_2%', 'LED_475_20%', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_575_50%', 'LED_575_100%'] ,
+                       'Rig 2' : [ 'Voltage_step_V', 'LED_475_50%','LED_475_100%' , 'LED_520_50%', 'LED_520_100%', 'LED_543_50%', 'LED_543_100%', 'LED_630_50%', 'LED_630_100%'] }
+## the column names of the .xlsx files contain invisible characters, so the names above replace them
+loaded_tables = {} ## calibration name -> (content hash of the .xlsx file, voltage steps, stimulation types, powers) used by this process
+calibration_lists = {} ## rig -> (modification time of calibration_folder, days from which each calibration is used, calibration names)
+
+
+def get_table_path(calibration):
+    """
+    Returns the path of the .xlsx file of a calibration (name returned by get_calibration).
+    """
+    if calibration in [os.path.splitext(file_name)[0] for file_name in power_table_files.values()]:
+        return os.path.join(os.getcwd(), calibration + '.xlsx')
+    return os.path.join(os.getcwd(), calibration_folder, calibration + '.xlsx')
+
+
+def get_calibrations(rig):
+    """
+    Returns the calibrations of a rig sorted by day: the days from which each one is used (None for the first one)
+    and their names. The list is only made again when a calibration is added to calibration_folder.
+    """
+    if rig not in power_table_files:
+        raise ValueError ('No LED power table for ' + repr(rig) + ', expected one of ' + ', '.join(power_table_files))
+    try:
+        folder_time = os.stat(calibration_folder).st_mtime_ns
+        file_names = os.listdir(calibration_folder)
+    except OSError: ## no calibration made after the first one
+        folder_time, file_names = None, []
+    if rig in calibration_lists and calibration_lists[rig][0] == folder_time:
+        return calibration_lists[rig][1:]
+
+    first_calibration = os.path.splitext(power_table_files[rig])[0]
+    dated_calibrations = []
+    for file_name in file_names:
+        calibration_match = re.fullmatch(re.escape(first_calibration) + r'_(\d{4}-\d{2}-\d{2})\.xlsx', file_name)
+        if calibration_match:
+            dated_calibrations.append((datetime.date.fromisoformat(calibration_match.group(1)), os.path.splitext(file_name)[0]))
+    dated_calibrations.sort()
+    calibration_days = [None] + [calibration_day for calibration_day, _ in dated_calibrations]
+    calibration_names = [first_calibration] + [calibration_name for _, calibration_name in dated_calibrations]
+    calibration_lists[rig] = (folder_time, calibration_days, calibration_names)
+    return calibration_days, calibration_names
+
+
+def get_calibration(rig, recording_date = None):
+    """
+    Returns the name of the calibration of a rig used for a recording: the last one made on or before the recording day.
+    1st term = rig the trace was recorded on ('Rig 1' or 'Rig 2')
+    2nd term = date of the recording (abf.abfDateTime), None if it is not known
+    """
+    calibration_days, calibration_names = get_calibrations(rig)
+    if len(calibration_names) == 1:
+        return calibration_names[0]
+    if isinstance(recording_date, str):
+        try:
+            recording_date = datetime.datetime.fromisoformat(recording_date)
+        except ValueError:
+            recording_date = None
+    if not isinstance(recording_date, datetime.date): ## datetime.datetime is a datetime.date too
+        raise ValueError ('Recording date of the trace unknown, cannot choose between the LED calibrations of ' + rig + ': ' + ', '.join(calibration_names))
+    if isinstance(recording_date, datetime.datetime):
+        recording_date = recording_date.date()
+    return calibration_names[bisect.bisect_right(calibration_days, recording_date, lo = 1) - 1]
+
+
+def read_power_table(calibration, rig):
+    """
+    Reads an LED power table from its .xlsx file.
+    Returns the voltage steps (V, sorted), the stimulation types and the powers (mW/mm2, one row per voltage step and
+    one column per stimulation type, nan where the step was not calibrated).
+    """
+    LED_stim_power_table = pd.read_excel(get_table_path(calibration), index_col = 1) #load dataframe containing LED powers and use V step as index values
+    LED_stim_power_table.columns = power_table_columns[rig]
+    LED_stim_power_table = LED_stim_power_table.drop(columns = 'Voltage_step_V').sort_index()
+    LED_stim_power_table = LED_stim_power_table.apply(pd.to_numeric, errors = 'coerce') ## empty cells can be read as text
+    return (LED_stim_power_table.index.to_numpy(dtype = float), np.array(LED_stim_power_table.columns, dtype = str),
+            LED_stim_power_table.to_numpy(dtype = float))
+
+
+def compile_power_table(calibration, rig):
+    """
+    Returns an LED power table (see read_power_table), from the compiled table when the .xlsx file has not changed
+    since it was compiled, otherwise from the .xlsx file (and compiles it again).
+    1st term = name of the calibration (see get_calibration)
+    2nd term = rig of the calibration, which sets the names of the stimulation types
+    """
+    with open(get_table_path(calibration), 'rb') as xlsx_file:
+        content_hash = hashlib.sha1(xlsx_file.read()).hexdigest()
+    if calibration in loaded_tables and loaded_tables[calibration][0] == content_hash:
+        return loaded_tables[calibration][1:]
+
+    compiled_path = os.path.join(table_folder, calibration + '.npz')
+    try:
+        with np.load(compiled_path) as compiled_table:
+            if str(compiled_table['content_hash']) != content_hash:
+                raise ValueError ('LED power table changed')
+            power_table = (compiled_table['voltage_steps'], compiled_table['stim_types'], compiled_table['powers'])
+    except (OSError, ValueError, KeyError):
+        power_table = read_power_table(calibration, rig)
+        os.makedirs(table_folder, exist_ok = True)
+        temporary_path = compiled_path + '.' + str(os.getpid()) + '.tmp.npz' ## other processes never see half of the file
+        np.savez(temporary_path, content_hash = content_hash, voltage_steps = power_table[0], stim_types = power_table[1], powers = power_table[2])
+        os.replace(temporary_path, compiled_path)
+
+    loaded_tables[calibration] = (content_hash,) + tuple(power_table)
+    return power_table
+
+
+def get_LED_power(rig, LED_stim_type, LED_steps_V, recording_date = None):
+    """
+    Returns the LED power (mW/mm2) of each LED pulse as an array.
+    1st term = rig the trace was recorded on ('Rig 1' or 'Rig 2'), which sets the LED power table
+    2nd term = stimulation type, a column of the LED power table (e.g. 'LED_475_50%')
+    3rd term = max value of each LED pulse in V (numbers or text, e.g. the values typed in by the user)
+    4th term = date of the recording (abf.abfDateTime), which sets the calibration used (see get_calibration)
+    """
+    calibration = get_calibration(rig, recording_date)
+    voltage_steps, stim_types, powers = traceIndex.get(('LED power table', calibration), lambda: compile_power_table(calibration, rig)) ## checked once per recording (see traceIndex)
+    if LED_stim_type not in stim_types:
+        raise ValueError ('Unknown LED stimulation type ' + repr(LED_stim_type) + ' for ' + rig + ', expected one of ' + ', '.join(stim_types))
+    stim_powers = powers[:, list(stim_types).index(LED_stim_type)]
+    calibrated = ~np.isnan(stim_powers)
+    voltage_steps, stim_powers = voltage_steps[calibrated], stim_powers[calibrated]
+
+    if not calibrated.any():
+        raise ValueError ('No calibrated step for ' + LED_stim_type + ' in ' + calibration)
+
+    LED_steps_V = np.atleast_1d(np.asarray(LED_steps_V, dtype = float))
+    closest_step = np.abs(LED_steps_V[:, None] - voltage_steps[None, :]).argmin(axis = 1)
+    on_step = np.abs(voltage_steps[closest_step] - LED_steps_V) <= step_tolerance_V
+    LED_steps_V = np.where(on_step, voltage_steps[closest_step], LED_steps_V) ## e.g. a float32 value rounded to 0.1
+
+    outside = (LED_steps_V < voltage_steps[0]) | (LED_steps_V > voltage_steps[-1]) | np.isnan(LED_steps_V)
+    if outside.any():
+        raise ValueError ('LED pulse(s) of ' + ', '.join(str(i) for i in LED_steps_V[outside]) + ' V outside the steps calibrated for ' + LED_stim_type
+                          + ' in ' + calibration + ' (' + str(voltage_steps[0]) + ' to ' + str(voltage_steps[-1]) + ' V)')
+    return np.interp(LED_steps_V, voltage_steps, stim_powers)
+
+
+def get_LED_steps(rig, LED_stim_type, LED_max_V, recording_date = None, abf = None, LED_channel = -1):
+    """
+    Returns the LED step of each pulse (V, rounded to 0.1 V) and the scale factor the LED analog input was divided by
+    (1 when the pulses are below LED_max_step_V, i.e. recorded with the right scale, text when several scales fit).
+    1st term = rig the trace was recorded on ('Rig 1' or 'Rig 2')
+    2nd term = stimulation type, a column of the LED power table (e.g. 'LED_475_50%')
+    3rd term = max value of each LED pulse as recorded
+    4th term = date of the recording (abf.abfDateTime), which sets the calibration used (see get_calibration)
+    5th term = trace (from traceCache.load_trace), its header gives the gain and units of the LED channel and the command levels
+    6th term = LED channel (-1 = last)
+    """
+    LED_max_V = np.asarray(LED_max_V)
+    if not (LED_max_V > LED_max_step_V).any():
+        return np.round(LED_max_V, 1), 1
+
+    calibration = get_calibration(rig, recording_date)
+    voltage_steps, stim_types, powers = traceIndex.get(('LED power table', calibration), lambda: compile_power_table(calibration, rig)) ## checked once per recording (see traceIndex)
+    if LED_stim_type not in stim_types:
+        raise ValueError ('Unknown LED stimulation type ' + repr(LED_stim_type) + ' for ' + rig + ', expected one of ' + ', '.join(stim_types))
+    voltage_steps = voltage_steps[~np.isnan(powers[:, list(stim_types).index(LED_stim_type)])]
+
+    LED_max_V = LED_max_V.astype(float)
+    LED_steps_V = get_metadata_LED_steps(len(LED_max_V))
+    if LED_steps_V is not None:
+        scale_factor = round(float(np.median(LED_max_V / LED_steps_V)), 1)
+        print ('Wrong scale detected for LED analog input: LED steps ' + ', '.join(str(i) for i in LED_steps_V) + ' V taken from the metadata (pulses divided by ' + str(scale_factor) + ')\n')
+        return LED_steps_V, scale_factor
+
+    fits = lambda scale_factor: fits_LED_steps(LED_max_V / scale_factor, voltage_steps)
+    header = getattr(abf, 'header', {})
+    LED_gain = header['adc_gains'][LED_channel] if header.get('adc_gains') else 1
+    LED_units = abf.adcUnits[LED_channel] if abf is not None else None
+    if abs(LED_gain - 1) > 1e-3 and fits(round(1 / LED_gain, 6)): ## gain of the channel set in the acquisition software
+        scale_factors = [round(1 / LED_gain, 6)]
+    elif LED_units in unit_scale_factors and fits(unit_scale_factors[LED_units]): ## the units of the channel give the scale
+        scale_factors = [unit_scale_factors[LED_units]]
+    else:
+        scale_factors = [i for i in LED_scale_factors if fits(i)]
+        command_levels_V = get_LED_command_levels(header)
+        if len(scale_factors) > 1 and len(command_levels_V):
+            scale_factors = [i for i in scale_factors if is_on_levels(LED_max_V / i, command_levels_V)] or scale_factors ## scales giving the LED command of the protocol
+
+    if len(scale_factors) == 0:
+        raise ValueError ('Wrong scale detected for LED analog input (pulses of ' + ', '.join(str(round(float(i), 2)) for i in LED_max_V) + ' V) and no scale factor ('
+                          + ', '.join(str(i) for i in LED_scale_factors) + ') brings them to the steps calibrated for ' + LED_stim_type + ' in ' + calibration)
+
+    LED_steps_V = np.round(LED_max_V / scale_factors[0], 1)
+    print ('Wrong scale detected for LED analog input: pulses divided by ' + str(scale_factors[0]) + ' (LED steps ' + ', '.join(str(i) for i in LED_steps_V) + ' V)\n')
+    if len(scale_factors) > 1:
+        print ('LED scale not certain: the pulses also fit ' + ', '.join(str(i) for i in scale_factors[1:]) + ', check LED_scale_factor or give the steps in LED_steps_V\n')
+        return LED_steps_V, str(scale_factors[0]) + ' (or ' + ', '.join(str(i) for i in scale_factors[1:]) + ')'
+    return LED_steps_V, scale_factors[0]
+
+
+def get_LED_command_levels(header):
+    """
+    Returns the levels (V, without 0) of the output channels driving the LED (name containing LED) in the protocol of the trace.
+    1st term = header of the trace (traceCache.read_abf_header)
+    """
+    command_levels_V = []
+    for dac in header.get('dac_levels') or []:
+        if 'led' in dac['name'].lower():
+            command_levels_V += [level / unit_scale_factors.get(dac['units'], 1) for level in dac['levels'] if level != 0]
+    return np.array(command_levels_V)
+
+
+def is_on_levels(LED_steps_V, command_levels_V):
+    """
+    Returns True when every rescaled pulse is within scale_tolerance_V of a command level.
+    """
+    return bool((np.abs(LED_steps_V[:, None] - command_levels_V[None, :]) <= scale_tolerance_V).any(axis = 1).all())
+
+
+def fits_LED_steps(LED_steps_V, voltage_steps):
+    """
+    Returns True when every rescaled pulse is within scale_tolerance_V of a 0.1 V step and inside the calibrated steps.
+    1st term = rescaled max value of each LED pulse (V)
+    2nd term = calibrated voltage steps of the stimulation type
+    """
+    on_grid = np.abs(LED_steps_V - np.round(LED_steps_V, 1)) <= scale_tolerance_V
+    calibrated = (LED_steps_V >= voltage_steps[0] - scale_tolerance_V) & (LED_steps_V <= voltage_steps[-1] + scale_tolerance_V)
+    return bool(on_grid.all() and calibrated.all())
+
+
+def get_metadata_LED_steps(pulse_no):
+    """
+    Returns the LED steps given in the LED_steps_V column of the metadata sheet for the trace analysed by Batch_Analysis
+    (V, one per pulse, na for no pulse applied), None when none were given or when the script is run on its own.
+    1st term = number of LED pulses found in the trace
+    """
+    if analysisSession.answers is None or analysisSession.answers.get('LED_steps_V') is None:
+        return None
+    LED_steps_V = [step.strip() for step in str(analysisSession.answers['LED_steps_V']).split(',')]
+    LED_steps_V = np.array([float(step) for step in LED_steps_V if step != '' and step.lower() != 'na'])
+    if len(LED_steps_V) != pulse_no:
+        raise ValueError (str(len(LED_steps_V)) + ' LED steps given in the LED_steps_V column of the metadata for ' + str(pulse_no) + ' LED pulses')
+    return LED_steps_V
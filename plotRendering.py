@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Draws the figures of the analysis scripts, either straight away or in the background.
+
+When a script is run on its own (e.g. from Spyder) nothing changes: add_figure() draws the figure at once so it is
+shown like before. The monoexponential fits of every pulse are only drawn when fit_plots = True.
+
+When a script is launched by Batch_Analysis the figures are not drawn by the script. add_figure() only keeps the
+function and the data points needed to draw the figure (a figure job). Batch_Analysis hands the jobs of each trace to
+a pool of render processes as soon as the trace is analysed, so that drawing never slows down the analysis. Each
+figure is saved in Analysis_output/Figures/<analysis>/<trace>_<figure>.png and the monoexponential fits of a trace
+(only with --fit-plots) are saved together in one multipage file: Analysis_output/Figures/<analysis>/<trace>_fits.pdf
+"""
+
+import os
+import time
+
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+figure_folder = os.path.join('Analysis_output', 'Figures')
+figure_format = 'png'
+fit_plots = False ## True to also draw the monoexponential fit of every pulse (diagnostic plots)
+figure_jobs = None ## list collecting the figures to draw when running inside a batch, None when running by hand
+draw_figures = True ## False to skip all figures (batch run with --no-figures)
+
+
+def start(collect_figures = True, draw = True, draw_fit_plots = False):
+    """
+    Sets how figures are drawn for the next trace to be analysed.
+    1st term = True to keep the figures as jobs for a render process instead of drawing them (see Batch_Analysis)
+    2nd term = False to skip all figures
+    3rd term = True to also draw the monoexponential fits
+    """
+    global figure_jobs, draw_figures, fit_plots
+    figure_jobs = [] if collect_figures else None
+    draw_figures = draw
+    fit_plots = draw_fit_plots
+
+
+def stop():
+    """
+    Goes back to drawing figures straight away. Returns the figure jobs collected for the trace.
+    """
+    global figure_jobs, draw_figures, fit_plots
+    collected_jobs = figure_jobs
+    figure_jobs = None
+    draw_figures = True
+    fit_plots = False
+    return collected_jobs or []
+
+
+def get_figure_path(analysis_name, file_name, figure_name, figure_extension = None):
+    return os.path.join(figure_folder, analysis_name, str(file_name) + '_' + figure_name + '.' + (figure_extension or figure_format))
+
+
+def add_figure(analysis_name, file_name, figure_name, plot_function, *plot_args, **plot_kwargs):
+    """
+    Draws a figure, or keeps it as a figure job when running inside a batch.
+    1st term = name of the analysis, used as folder name (e.g. 'VC_excitatory')
+    2nd term = name of the trace
+    3rd term = name of the figure, added to the file name (e.g. 'LED_responses')
+    4th term = function drawing the figure from the terms that follow (see tracePlots)
+    """
+    if not draw_figures:
+        return None
+    if figure_jobs is None:
+        return plot_function(*plot_args, **plot_kwargs)
+    figure_jobs.append((get_figure_path(analysis_name, file_name, figure_name), [(plot_function, plot_args, plot_kwargs)]))
+    return None
+
+
+def add_fit_plot(analysis_name, file_name, plot_function, *plot_args, **plot_kwargs):
+    """
+    Same as add_figure() for the monoexponential fit plots, which are only drawn when fit_plots = True.
+    Inside a batch all fit plots of a trace become the pages of a single .pdf file.
+    """
+    if not (draw_figures and fit_plots):
+        return None
+    if figure_jobs is None:
+        figure = plot_function(*plot_args, **plot_kwargs)
+        plt.show()
+        return figure
+
+    figure_path = get_figure_path(analysis_name, file_name, 'fits', 'pdf')
+    for job_path, pages in figure_jobs:
+        if job_path == figure_path:
+            pages.append((plot_function, plot_args, plot_kwargs))
+            return None
+    figure_jobs.append((figure_path, [(plot_function, plot_args, plot_kwargs)]))
+    return None
+
+
+def render_figure_job(figure_job):
+    """
+    Draws the figure(s) of a figure job and saves them. Runs in a render process.
+    1st term = (file path, list of (plot function, args, kwargs)), one page per plot function
+    Returns the time (s) it took to draw and save the figure.
+    """
+    render_start_time = time.perf_counter()
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.switch_backend('Agg') ## render processes never open a window
+    figure_path, pages = figure_job
+    os.makedirs(os.path.dirname(figure_path), exist_ok = True)
+
+    if len(pages) == 1 and not figure_path.endswith('.pdf'):
+        plot_function, plot_args, plot_kwargs = pages[0]
+        figure = plot_function(*plot_args, **plot_kwargs)
+        figure.savefig(figure_path)
+        plt.close(figure)
+        return time.perf_counter() - render_start_time
+
+    with PdfPages(figure_path) as pdf_file:
+        for plot_function, plot_args, plot_kwargs in pages:
+            figure = plot_function(*plot_args, **plot_kwargs)
+            pdf_file.savefig(figure)
+            plt.close(figure)
+    return time.perf_counter() - render_start_time
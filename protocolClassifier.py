@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recognises the analysis script a trace was recorded for, from the name of its Clampex protocol (abf.protocol) and a
+few values describing its stimulus (fingerprint), so that folders mixing every protocol can be analysed without
+typing the Python_Script of each trace in the metadata sheet (Python_Script = auto, see Batch_Analysis).
+
+get_fingerprint() only reads the LED channel and, in current clamp, the injected current channel, as raw samples (see
+traceCache), never the recorded response:
+- clamp: VC or CC, from the unit of the 1st channel (pA in voltage clamp, mV in current clamp)
+- number and median duration of the LED pulses and of the current steps (current clamp only)
+- LED train: largest number of LED pulses in a sweep, regularity (CV of the intervals) and frequency of the pulses
+- LED / current overlap: fraction of the LED pulses given during a current step
+- gap-free recording (one sweep)
+The fingerprint and the words of the protocol name (e.g. 'CC', '1s', 'Hz', 'gapfree') are turned into the same yes / no
+features (get_stimulus_features, get_name_features; None when unknown). Each analysis expects some of them
+(analysis_features, None = either). classify() scores every analysis as naive Bayes: a feature that agrees with the
+analysis counts its reliability (stimulus features are measured, so more reliable than the words of the name), one
+that disagrees 1 - reliability and one the analysis does not expect either way 0.5. The confidence is the share of the
+analysis chosen in the scores of all analyses: close to 1 when the stimulus and the name only fit one analysis, about
+0.5 when two analyses fit equally well.
+Excitatory and inhibitory opsins given the same stimulus (e.g. 5ms LED pulses) cannot be told apart this way.
+
+Usage from a terminal (prints and saves Analysis_output/Protocol_classification.csv):
+python protocolClassifier.py Sample_data
+python protocolClassifier.py Sample_data --metadata Sample_data/Sample_data_info.xlsx   (also compares with the sheet)
+"""
+
+import argparse
+import glob
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from traceCache import load_trace
+from pulseEpochs import find_pulses, get_pulse_sweeps
+from pulseIntervals import overlaps_any
+
+LED_threshold_V = 0.1 ## LED analog input over this value is an LED pulse
+current_threshold_pA = 10 ## current injected over the baseline by more than this value is a current step
+baseline_ms = 100 ## the current baseline is the mean of the first 100ms, as in the analysis scripts
+long_LED_pulse_ms = 100 ## LED pulses of inhibitory opsin protocols last about 1s, those of excitatory opsin protocols a few ms
+train_min_pulses = 3 ## fewest LED pulses in a sweep making a train
+train_max_interval_CV = 0.1 ## intervals between the pulses of a train are regular
+overlap_min_fraction = 0.5 ## LED pulses are given during current steps when at least half of them are
+stimulus_reliability = 0.95 ## how often a feature measured on the stimulus agrees with the analysis of the trace
+name_reliability = 0.8 ## how often a feature read in the protocol name agrees with the analysis of the trace
+min_confidence = 0.7 ## Batch_Analysis only analyses traces recognised with at least this confidence
+classification_name = 'Protocol_classification.csv'
+
+"""
+Features of the stimulus expected by each analysis script: True / False, None = either
+"""
+analysis_features = {
+        'Excitatory_Opsin_Voltage_Clamp' : {'current_clamp' : False, 'LED' : True, 'long_LED' : False, 'current_steps' : None, 'LED_train' : False, 'LED_during_current' : None, 'gap_free' : None} ,
+        'Inhibitory_Opsin_Voltage_Clamp' : {'current_clamp' : False, 'LED' : True, 'long_LED' : True, 'current_steps' : None, 'LED_train' : False, 'LED_during_current' : None, 'gap_free' : None} ,
+        'Excitatory_Opsin_Current_Clamp' : {'current_clamp' : True, 'LED' : True, 'long_LED' : False, 'current_steps' : None, 'LED_train' : False, 'LED_during_current' : False, 'gap_free' : None} ,
+        'Excitatory_Opsin_Current_Clamp_Frequency' : {'current_clamp' : True, 'LED' : True, 'long_LED' : False, 'current_steps' : False, 'LED_train' : True, 'LED_during_current' : False, 'gap_free' : None} ,
+        'Inhibitory_Opsin_Current_Clamp' : {'current_clamp' : True, 'LED' : True, 'long_LED' : True, 'current_steps' : False, 'LED_train' : False, 'LED_during_current' : False, 'gap_free' : None} ,
+        'Inhibitory_Opsin_CC_Long_AP_Inhibit' : {'current_clamp' : True, 'LED' : True, 'long_LED' : True, 'current_steps' : True, 'LED_train' : False, 'LED_during_current' : True, 'gap_free' : None} ,
+        'Inhibitory_Opsin_CC_Short_AP_Inhibit' : {'current_clamp' : True, 'LED' : True, 'long_LED' : False, 'current_steps' : True, 'LED_train' : None, 'LED_during_current' : True, 'gap_free' : None} ,
+        'Gapfree_AP_stim' : {'current_clamp' : True, 'LED' : False, 'long_LED' : None, 'current_steps' : True, 'LED_train' : False, 'LED_during_current' : None, 'gap_free' : True}
+        }
+
+"""
+Words of the protocol name (lower case, split on anything that is not a letter or a digit) and the feature they give
+"""
+name_words = {
+        'cc' : ('current_clamp', True) ,
+        'vc' : ('current_clamp', False) ,
+        'led' : ('LED', True) ,
+        'light' : ('LED', True) ,
+        '1s' : ('long_LED', True) ,
+        'ap' : ('current_steps', True) ,
+        'spike' : ('current_steps', True) ,
+        'hz' : ('LED_train', True) ,
+        'inhibit' : ('LED_during_current', True) ,
+        'gapfree' : ('gap_free', True)
+        }
+
+
+def get_fingerprint(abf):
+    """
+    Measures the stimulus of a trace from its LED channel and, in current clamp, its injected current channel.
+    1st term = trace opened with traceCache.load_trace
+    Returns a dictionary: clamp, LED pulse number / median duration (ms), LED pulses per sweep (largest number), CV and
+    frequency (Hz) of the intervals between the LED pulses of a sweep (nan with a single pulse per sweep), current step
+    number / median duration (ms, nan in voltage clamp), fraction of the LED pulses given during a current step (nan
+    without LED pulse or in voltage clamp) and gap_free
+    """
+    sampling_rate = abf.dataPointsPerMs
+    sweep_points = abf.sweepPointCount
+    clamp = {'pA' : 'VC', 'mV' : 'CC' }.get(abf.adcUnits[0])
+
+    LED_onsets, LED_offsets, LED_lengths = find_pulses(abf.get_channel(-1) > LED_threshold_V, sweep_points)
+    LED_sweeps = get_pulse_sweeps(LED_onsets, sweep_points)
+    same_sweep = LED_sweeps[1:] == LED_sweeps[:-1]
+    LED_intervals = np.diff(LED_onsets)[same_sweep] ## between the onsets of consecutive pulses of a sweep
+
+    fingerprint = {'clamp' : clamp ,
+                   'LED_pulses' : len(LED_onsets) ,
+                   'LED_pulse_ms' : np.median(LED_lengths) / sampling_rate if len(LED_onsets) else np.nan ,
+                   'LED_pulses_per_sweep' : int(np.bincount(LED_sweeps).max()) if len(LED_onsets) else 0 ,
+                   'LED_interval_CV' : np.std(LED_intervals) / np.mean(LED_intervals) if len(LED_intervals) > 1 else np.nan ,
+                   'LED_train_Hz' : 1000 / (np.median(LED_intervals) / sampling_rate) if len(LED_intervals) else np.nan ,
+                   'current_steps' : np.nan ,
+                   'current_step_ms' : np.nan ,
+                   'LED_during_current' : np.nan ,
+                   'gap_free' : abf.sweepCount == 1 }
+
+    if clamp == 'CC': ## in voltage clamp the 2nd channel is the holding voltage, there are no current steps
+        current_trace = abf.get_channel(1)
+        current_baseline = np.mean(current_trace[0:int(baseline_ms * sampling_rate)])
+        current_onsets, current_offsets, current_lengths = find_pulses((current_trace - current_baseline) > current_threshold_pA, sweep_points)
+        fingerprint['current_steps'] = len(current_onsets)
+        fingerprint['current_step_ms'] = np.median(current_lengths) / sampling_rate if len(current_onsets) else np.nan
+        if len(LED_onsets):
+            fingerprint['LED_during_current'] = overlaps_any((LED_onsets, LED_offsets), (current_onsets, current_offsets)).mean()
+    return fingerprint
+
+
+def get_stimulus_features(fingerprint):
+    """
+    Returns the features of analysis_features measured on the stimulus (True / False, None when not measured).
+    """
+    has_LED = fingerprint['LED_pulses'] > 0
+    LED_train = fingerprint['LED_pulses_per_sweep'] >= train_min_pulses and fingerprint['LED_interval_CV'] <= train_max_interval_CV
+    return {'current_clamp' : None if fingerprint['clamp'] is None else fingerprint['clamp'] == 'CC' ,
+            'LED' : has_LED ,
+            'long_LED' : bool(fingerprint['LED_pulse_ms'] >= long_LED_pulse_ms) if has_LED else None ,
+            'current_steps' : None if np.isnan(fingerprint['current_steps']) else fingerprint['current_steps'] > 0 ,
+            'LED_train' : bool(LED_train) ,
+            'LED_during_current' : None if np.isnan(fingerprint['LED_during_current']) else fingerprint['LED_during_current'] >= overlap_min_fraction ,
+            'gap_free' : bool(fingerprint['gap_free']) }
+
+
+def get_name_features(protocol):
+    """
+    Returns the features given by the words of the protocol name (see name_words), e.g. 'CC_LED_1s_step' gives
+    current_clamp, LED and long_LED; a duration in ms (e.g. '5ms') gives short LED pulses.
+    """
+    name_features = {}
+    for word in re.findall('[a-z0-9]+', str(protocol).lower()):
+        if word in name_words:
+            feature, value = name_words[word]
+            name_features[feature] = value
+        elif re.fullmatch('[0-9]+ms', word):
+            name_features['long_LED'] = False
+    return name_features
+
+
+def classify(abf):
+    """
+    Finds the analysis script of a trace.
+    1st term = trace opened with traceCache.load_trace
+    Returns a dictionary: Python_Script (analysis with the highest score), confidence (0 to 1), runner_up (analysis
+    with the 2nd score) and the fingerprint of the trace (see get_fingerprint)
+    """
+    fingerprint = get_fingerprint(abf)
+    observations = [(get_stimulus_features(fingerprint), stimulus_reliability), (get_name_features(abf.protocol), name_reliability)]
+
+    log_scores = np.zeros(len(analysis_features))
+    for analysis_no, expected_features in enumerate(analysis_features.values()):
+        for features, reliability in observations:
+            for feature, value in features.items():
+                if value is None:
+                    continue ## not measured: same score for every analysis
+                if expected_features[feature] is None:
+                    log_scores[analysis_no] += np.log(0.5) ## either value fits the analysis
+                else:
+                    log_scores[analysis_no] += np.log(reliability if value == expected_features[feature] else 1 - reliability)
+
+    scores = np.exp(log_scores - log_scores.max())
+    scores /= scores.sum()
+    ranking = np.argsort(-scores, kind = 'stable')
+    analysis_names = list(analysis_features)
+    return dict({'Python_Script' : analysis_names[ranking[0]] ,
+                 'confidence' : scores[ranking[0]] ,
+                 'runner_up' : analysis_names[ranking[1]] }, **fingerprint)
+
+
+def classify_folder(data_folder):
+    """
+    Classifies every .abf file of a folder.
+    Returns a dataframe with one row per trace (sorted by file name): Trace_ID, protocol and the result of classify(),
+    or the error in the error column when the file cannot be read.
+    """
+    classification_rows = []
+    for file_path in sorted(glob.glob(os.path.join(data_folder, '*.abf'))):
+        trace_id = os.path.splitext(os.path.basename(file_path))[0]
+        try:
+            abf = load_trace(file_path)
+            classification_rows.append(dict({'Trace_ID' : trace_id, 'protocol' : abf.protocol }, **classify(abf)))
+        except Exception as error: ## one unreadable file never stops the folder
+            classification_rows.append({'Trace_ID' : trace_id, 'error' : repr(error)})
+    return pd.DataFrame(classification_rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Recognise the analysis script of every .abf file of a folder')
+    parser.add_argument('data_folder', help = 'folder containing the .abf files')
+    parser.add_argument('--metadata', default = None, help = 'metadata sheet (.xlsx or .csv) to compare the scripts found with its Python_Script column')
+    args = parser.parse_args()
+
+    data_folder = os.path.abspath(args.data_folder)
+    metadata_path = os.path.abspath(args.metadata) if args.metadata else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__))) ## Trace_cache and Analysis_output live next to this file
+    classification = classify_folder(data_folder)
+
+    if metadata_path is not None:
+        import Batch_Analysis
+        metadata = Batch_Analysis.load_metadata(metadata_path)
+        metadata_scripts = metadata.groupby('Trace_ID')['Python_Script'].agg(lambda scripts: ', '.join(Batch_Analysis.script_name_alias_dict.get(script, script) for script in scripts))
+        classification['metadata_script'] = classification['Trace_ID'].map(metadata_scripts)
+        classification['agrees'] = [str(script) in str(metadata_script).split(', ') for script, metadata_script
+                                    in zip(classification['Python_Script'], classification['metadata_script'])]
+
+    classification.to_csv(os.path.join('Analysis_output', classification_name), index = False)
+    print (classification.drop(columns = [column for column in classification.columns if column.startswith(('LED_', 'current_'))]).round(3).to_string(index = False))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by the analysis scripts to find LED or current pulses in a trace and cut the trace into epochs around them.
+
+find_pulses() finds each pulse from the rising and falling edges of a boolean trace (e.g. LED_trace > 0.1) and
+returns the index where each pulse starts (onset), the index after its last point (offset) and its number of points.
+Only 3 values per pulse are kept, instead of the index of every point where the stimulus is ON.
+
+The epoch around a pulse (points before the pulse + pulse + points after the pulse) is a contiguous part of the
+trace. The start and end of each epoch are calculated once with get_epoch_bounds() and then used to cut the current,
+voltage and LED traces with extract_epochs(), which returns views on the trace: no data is copied. A channel kept as
+raw samples (traceCache.TraceChannel) converts the points of all epochs at once and returns views on the converted points.
+
+Episodic protocols (e.g. LED power steps, current steps) record several sweeps per file. abf.get_channel() and
+abf.data[channel] hold the sweeps one after the other, so the pulses of all sweeps are found and measured in one pass
+over the channel. Given the number of points of a sweep (abf.sweepPointCount), find_pulses() never joins the end of a
+sweep to the start of the next one, get_epoch_bounds() checks that no epoch takes points from the next sweep (recorded
+later, after the gap between sweeps) and get_pulse_sweeps() gives the sweep of each pulse (0 = 1st sweep, as abf.sweepList).
+"""
+
+import numpy as np
+
+import traceIndex
+
+
+def find_pulses(pulse_on, sweep_points = None):
+    """
+    Finds the pulses of a trace.
+    1st term = boolean array, True where the stimulus is ON (e.g. LED_trace > 0.1)
+    2nd term = number of points of each sweep (abf.sweepPointCount), a pulse ON at the end of a sweep and at the start
+               of the next one gives 2 pulses. None = the trace is one sweep
+    Returns 3 arrays: index of the 1st point of each pulse, index after the last point of each pulse, number of points of each pulse
+    The pulses of a boolean trace shared by several analyses of the recording are only found once (see traceIndex).
+    """
+    pulse_key = ('pulses', id(pulse_on), sweep_points)
+    return traceIndex.get(pulse_key, lambda: (pulse_on,) + find_pulse_edges(pulse_on, sweep_points))[1:] ## boolean trace kept with its pulses: its id is never used by another array
+
+
+def find_pulse_edges(pulse_on, sweep_points = None):
+    """
+    Finds the pulses of a trace, see find_pulses().
+    """
+    pulse_on = np.asarray(pulse_on, dtype = bool)
+    if pulse_on.size == 0:
+        no_pulse = np.zeros(0, dtype = np.int64)
+        return no_pulse, no_pulse, no_pulse
+
+    edges = np.flatnonzero(pulse_on[1:] != pulse_on[:-1]) + 1 ## index of every rising and falling edge
+    if pulse_on[0]:
+        edges = np.concatenate([[0], edges]) ## trace starts during a pulse
+    if pulse_on[-1]:
+        edges = np.concatenate([edges, [len(pulse_on)]]) ## trace ends during a pulse
+    if sweep_points is not None and len(pulse_on) > sweep_points:
+        sweep_starts = np.arange(sweep_points, len(pulse_on), sweep_points)
+        sweep_starts = sweep_starts[pulse_on[sweep_starts - 1] & pulse_on[sweep_starts]] ## pulses going on from one sweep to the next
+        edges = np.sort(np.concatenate([edges, sweep_starts, sweep_starts])) ## end of the pulse of one sweep and start of the pulse of the next
+    pulse_onsets = edges[0::2].astype(np.int64)
+    pulse_offsets = edges[1::2].astype(np.int64)
+    return pulse_onsets, pulse_offsets, pulse_offsets - pulse_onsets
+
+
+def get_pulse_sweeps(pulse_onsets, sweep_points):
+    """
+    Returns the sweep of each pulse (0 = 1st sweep).
+    1st term = index of the 1st point of each pulse (from find_pulses)
+    2nd term = number of points of each sweep (abf.sweepPointCount)
+    """
+    return np.asarray(pulse_onsets, dtype = np.int64) // sweep_points
+
+
+def get_epoch_bounds(pulse_onsets, pulse_offsets, pre_points = 0, post_points = 0, sweep_points = None):
+    """
+    Returns the index where each epoch starts and the index where it ends (excluded) as two arrays.
+    1st term = index of the 1st point of each pulse (from find_pulses)
+    2nd term = index after the last point of each pulse (from find_pulses)
+    3rd term = number of points added before the 1st point of each pulse
+    4th term = number of points added after the last point of each pulse
+    5th term = number of points of each sweep (abf.sweepPointCount) to check that each epoch stays in one sweep, None = not checked
+    """
+    starts = np.asarray(pulse_onsets, dtype = np.int64) - pre_points
+    ends = np.asarray(pulse_offsets, dtype = np.int64) + post_points
+    if sweep_points is not None and len(starts) and (starts // sweep_points != (ends - 1) // sweep_points).any():
+        raise IndexError ('Data points requested around the pulses go beyond the start or end of their sweep (' + str(sweep_points) + ' points)')
+    return starts, ends
+
+
+def check_epoch_bounds(trace, epoch_bounds):
+    starts, ends = epoch_bounds
+    if len(starts) and (starts.min() < 0 or ends.max() > len(trace)):
+        raise IndexError ('Data points requested around the pulses go beyond the start or end of the trace (' + str(len(trace)) + ' points)')
+
+
+def extract_epochs(trace, epoch_bounds):
+    """
+    Returns the list of epochs of the trace, one per pulse. Each epoch is a view on the trace (no data copied).
+    1st term = trace to cut (e.g. voltage_trace)
+    2nd term = (starts, ends) from get_epoch_bounds()
+    """
+    check_epoch_bounds(trace, epoch_bounds)
+    starts, ends = epoch_bounds
+    if hasattr(trace, 'extract_epochs'): ## channel kept as raw samples (traceCache.TraceChannel): all epochs are converted at once
+        return trace.extract_epochs(starts, ends)
+    return [trace[start:end] for start, end in zip(starts, ends)]
+
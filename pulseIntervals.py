@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by the analysis scripts to combine pulses of different stimuli (e.g. current pulses and LED pulses).
+
+Each pulse is kept as an interval: index of its 1st point (start) and index after its last point (end), as returned by
+pulseEpochs.find_pulses(). A set of pulses is a (starts, ends) pair of sorted arrays of pulses that do not overlap. The
+points where the current is injected and the LED is ON, or where only the current is injected, are calculated from
+the intervals (one value per pulse) instead of comparing the index of every point of both stimuli (np.isin / np.intersect1d).
+
+The pulses returned are the same as consecutive runs of the points: pulses from find_pulses() never touch each other
+(there is at least one point OFF between two pulses), so the intersections and differences of two sets do not either.
+"""
+
+import numpy as np
+
+
+def get_overlaps(intervals, other_intervals):
+    """
+    For each pulse of intervals, returns the position in other_intervals of the 1st pulse overlapping it and the position
+    after the last one (same position if none).
+    """
+    starts, ends = intervals
+    other_starts, other_ends = other_intervals
+    overlap_first = np.searchsorted(other_ends, starts, side = 'right')
+    overlap_last = np.maximum(np.searchsorted(other_starts, ends, side = 'left'), overlap_first)
+    return overlap_first, overlap_last
+
+
+def overlaps_any(intervals, other_intervals):
+    """
+    Returns a boolean array, True for the pulses of intervals that overlap at least one pulse of other_intervals.
+    """
+    overlap_first, overlap_last = get_overlaps(intervals, other_intervals)
+    return overlap_last > overlap_first
+
+
+def intersect_intervals(intervals, other_intervals):
+    """
+    Returns the intervals (starts, ends) where both stimuli are ON (e.g. current injected and LED ON).
+    1st term = (starts, ends) of the pulses of the 1st stimulus (e.g. current pulses from find_pulses)
+    2nd term = (starts, ends) of the pulses of the 2nd stimulus (e.g. LED pulses)
+    """
+    starts, ends = (np.asarray(bounds, dtype = np.int64) for bounds in intervals)
+    other_starts, other_ends = (np.asarray(bounds, dtype = np.int64) for bounds in other_intervals)
+    overlap_first, overlap_last = get_overlaps((starts, ends), (other_starts, other_ends))
+    overlap_counts = overlap_last - overlap_first
+    pulse_pos = np.repeat(np.arange(len(starts)), overlap_counts) ## one row per pair of overlapping pulses
+    other_pos = np.repeat(overlap_first - np.concatenate([[0], np.cumsum(overlap_counts)[:-1]]), overlap_counts) + np.arange(overlap_counts.sum())
+    return (np.maximum(starts[pulse_pos], other_starts[other_pos]), np.minimum(ends[pulse_pos], other_ends[other_pos]))
+
+
+def subtract_intervals(intervals, other_intervals):
+    """
+    Returns the intervals (starts, ends) where the 1st stimulus is ON and the 2nd one is OFF (e.g. current injected without LED).
+    A pulse of the 1st stimulus cut by a pulse of the 2nd one gives the part before and the part after it.
+    """
+    other_starts, other_ends = (np.asarray(bounds, dtype = np.int64) for bounds in other_intervals)
+    no_pulse = np.iinfo(np.int64)
+    gaps = (np.concatenate([[no_pulse.min], other_ends]), np.concatenate([other_starts, [no_pulse.max]])) ## intervals where the 2nd stimulus is OFF
+    return intersect_intervals(intervals, gaps)
+
+
+def split_intervals(intervals, pre_points, post_points):
+    """
+    Splits each pulse in 3 parts: its first pre_points, its last post_points and the points in between (mid).
+    Returns 3 interval sets (pre, mid, post); parts of a pulse shorter than pre_points + post_points overlap or are empty.
+    """
+    starts, ends = (np.asarray(bounds, dtype = np.int64) for bounds in intervals)
+    pre_ends = np.minimum(starts + pre_points, ends)
+    post_starts = np.maximum(ends - post_points, starts)
+    return (starts, pre_ends), (pre_ends, np.maximum(post_starts, pre_ends)), (post_starts, ends)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by the analysis scripts to add the data extracted from a trace to the master files in Analysis_output.
+
+The rows of all masters are kept in one SQLite file (Analysis_output/Results_store.sqlite). Adding a trace only
+appends its rows to the store: the master is never opened and parsed again. The master .csv files, with exactly the
+same layout as before, are exported from the store once at the end of the batch when running Batch_Analysis (or after
+each trace in Watch_Analysis), or on request with:
+python resultsStore.py                              (export all masters)
+python resultsStore.py VC_excitatory_opsin_master   (export only the masters named)
+A script run by hand only appends its rows to the store, set export_after_trace = True to also write the master .csv
+file after every trace (the whole file is written again each time).
+
+When a script runs inside a Batch_Analysis worker the rows are handed back to Batch_Analysis instead, which merges the
+rows of all traces into the store once at the end of the batch, always in the same (file sorted) order.
+
+A master .csv file that already has rows but is not in the store yet (e.g. masters made before the store existed)
+is imported in the store the first time a trace is added to it.
+
+The raw data points extracted for each LED / current pulse (Current_points_plot, LED_points_plot, voltage_points_plot,
+V_data_points) are not written in the .csv files. They are saved as float32 in a .npz file next to the single trace
+.csv file (save_waveforms) and the .csv cells only keep a reference to them: 'npz file:column:pulse number'
+(e.g. Single_Trace_data/VC_excitatory/18n270027_1.npz:Current_points_plot:0). Use load_waveform(reference) to get
+the data points of one pulse back, or load_trace_waveforms() to get the data points of all pulses of a trace.
+"""
+
+import argparse
+import io
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+import analysisSession
+
+output_folder = 'Analysis_output'
+store_name = 'Results_store.sqlite'
+trace_id_columns = ['trace_number', 'Trace_Number'] ## name of the trace ID column in the different masters
+waveform_columns = ['Current_points_plot', 'LED_points_plot', 'voltage_points_plot', 'V_data_points'] ## columns holding raw data points per pulse
+export_after_trace = False ## True to write the master .csv file after every trace run by hand, see above
+compress_waveforms = False ## True to save the .npz files compressed (smaller but slower to write and read)
+
+
+def get_master_path(master_name):
+    return os.path.join(output_folder, master_name + '.csv')
+
+
+def get_store_path():
+    return os.path.join(output_folder, store_name)
+
+
+def open_store():
+    """
+    Opens the results store, creating it the first time.
+    Table masters = header line of each master .csv file
+    Table trace_rows = .csv text of the rows of each trace, in the order they were added (row_id)
+    """
+    connection = sqlite3.connect(get_store_path())
+    connection.execute('CREATE TABLE IF NOT EXISTS masters (master_name TEXT PRIMARY KEY, header TEXT NOT NULL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS trace_rows (row_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'master_name TEXT NOT NULL, trace_id TEXT, rows TEXT NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS trace_rows_trace ON trace_rows (master_name, trace_id)')
+    return connection
+
+
+def read_master(master_name):
+    """
+    Opens a master .csv file. If the master does not exist yet an empty dataframe is returned.
+    """
+    master_path = get_master_path(master_name)
+    if not os.path.isfile(master_path):
+        return pd.DataFrame()
+    return pd.read_csv(master_path, index_col = 0, float_precision = 'round_trip') ## round_trip so that floats are saved back unchanged
+
+
+def get_trace_id(trace_data):
+    for column in trace_id_columns:
+        if column in trace_data.columns and len(trace_data) > 0:
+            return str(trace_data[column].iloc[0])
+    return None
+
+
+def trace_data_to_text(trace_data):
+    """
+    Returns (header line, rows) of trace_data written exactly as to_csv writes them in the master.
+    """
+    header, rows = trace_data.to_csv(header = True).split('\n', 1)
+    return header, rows
+
+
+def get_header(columns):
+    """
+    Returns the header line of a master with these columns, as to_csv writes it.
+    """
+    return pd.DataFrame(columns = columns).to_csv(header = True).split('\n', 1)[0].rstrip('\r')
+
+
+def read_rows_as_text(header, rows):
+    """
+    Reads rows saved in the store back as a dataframe of text, so that writing it again gives the same values.
+    """
+    return pd.read_csv(io.StringIO(header + '\n' + rows), index_col = 0, dtype = str, keep_default_na = False)
+
+
+def migrate_rows(connection, master_name, header, new_header):
+    """
+    Rewrites the rows already saved for a master with the columns of new_header (columns added at the end are left empty).
+    """
+    new_columns = read_rows_as_text(new_header, '').columns
+    for row_id, rows in connection.execute('SELECT row_id, rows FROM trace_rows WHERE master_name = ?', (master_name,)).fetchall():
+        new_rows = trace_data_to_text(read_rows_as_text(header, rows).reindex(columns = new_columns, fill_value = ''))[1]
+        connection.execute('UPDATE trace_rows SET rows = ? WHERE row_id = ?', (new_rows, row_id))
+    connection.execute('UPDATE masters SET header = ? WHERE master_name = ?', (new_header, master_name))
+
+
+def register_master(connection, master_name, trace_data):
+    """
+    Returns the columns of a master, in the order of the master .csv file. The first time a master is used its header
+    (from the existing master .csv file, or else from trace_data) is saved in the store and rows already present in
+    the master .csv file are imported. Columns of trace_data missing from the master are added at the end of the
+    master, and the rows already saved get them empty (as when appending to the master with pandas).
+    """
+    saved_header = connection.execute('SELECT header FROM masters WHERE master_name = ?', (master_name,)).fetchone()
+    if saved_header is None:
+        master = read_master(master_name)
+        header = get_header(master.columns if len(master.columns) else trace_data.columns)
+        connection.execute('INSERT INTO masters (master_name, header) VALUES (?, ?)', (master_name, header))
+        if not master.empty:
+            trace_ids = master[[column for column in trace_id_columns if column in master.columns][0]].astype(str)
+            for trace_id in pd.unique(trace_ids): ## one entry per trace, in the order of the master
+                connection.execute('INSERT INTO trace_rows (master_name, trace_id, rows) VALUES (?, ?, ?)',
+                                   (master_name, trace_id, trace_data_to_text(master[(trace_ids == trace_id).values])[1]))
+            print ('Imported ' + str(len(master)) + ' rows of ' + get_master_path(master_name) + ' in ' + get_store_path())
+    else:
+        header = saved_header[0]
+
+    master_columns = list(read_rows_as_text(header, '').columns)
+    new_columns = [column for column in trace_data.columns if column not in master_columns]
+    if new_columns: ## e.g. columns added to the scripts since the master was started
+        migrate_rows(connection, master_name, header, get_header(master_columns + new_columns))
+        print ('Added columns ' + ', '.join(new_columns) + ' to master ' + master_name)
+    return master_columns + new_columns
+
+
+def append_trace(connection, master_name, trace_data, replace = False):
+    """
+    Appends the rows of one trace to a master in the store, in the column order of the master (columns the trace
+    does not have are left empty).
+    replace = True removes the rows previously saved for the same trace (trace analysed again)
+    """
+    master_columns = register_master(connection, master_name, trace_data)
+    rows = trace_data_to_text(trace_data.reindex(columns = master_columns))[1]
+    trace_id = get_trace_id(trace_data)
+    if replace and trace_id is not None:
+        connection.execute('DELETE FROM trace_rows WHERE master_name = ? AND trace_id = ?', (master_name, trace_id))
+    connection.execute('INSERT INTO trace_rows (master_name, trace_id, rows) VALUES (?, ?, ?)', (master_name, trace_id, rows))
+
+
+def export_master(master_name, connection = None):
+    """
+    Writes the master .csv file from the rows saved in the store. Returns the number of traces exported.
+    """
+    own_connection = connection is None
+    if own_connection:
+        connection = open_store()
+    try:
+        header = connection.execute('SELECT header FROM masters WHERE master_name = ?', (master_name,)).fetchone()
+        if header is None:
+            raise ValueError ('Master ' + master_name + ' not found in ' + get_store_path())
+        trace_rows = connection.execute('SELECT rows FROM trace_rows WHERE master_name = ? ORDER BY row_id', (master_name,)).fetchall()
+    finally:
+        if own_connection:
+            connection.close()
+
+    with open(get_master_path(master_name), 'w', newline = '') as master_file: ## rows already hold their own line endings
+        master_file.write(header[0] + '\n')
+        master_file.write(''.join(rows for rows, in trace_rows))
+    return len(trace_rows)
+
+
+def export_all_masters(master_names = None):
+    """
+    Writes the .csv file of every master saved in the store (or only of the masters named).
+    """
+    connection = open_store()
+    try:
+        if not master_names:
+            master_names = [name for name, in connection.execute('SELECT master_name FROM masters ORDER BY master_name')]
+        for master_name in master_names:
+            trace_no = export_master(master_name, connection)
+            print ('Exported ' + str(trace_no) + ' traces to ' + get_master_path(master_name))
+    finally:
+        connection.close()
+
+
+def save_waveforms(trace_data, single_trace_folder, file_name):
+    """
+    Saves the raw data points of the waveform columns of trace_data in a .npz file and replaces them by references.
+    1st term = dataframe with the data extracted from the trace
+    2nd term = folder where the single trace .csv file is saved (e.g. 'Analysis_output/Single_Trace_data/VC_excitatory/')
+    3rd term = name of the trace
+    For every waveform column the .npz file holds all pulses one after the other (column name) and the index at which
+    each pulse starts and ends (column name + '_offsets'). Returns a copy of trace_data with the references.
+    """
+    waveform_path = os.path.join(single_trace_folder, str(file_name) + '.npz')
+    waveform_key = os.path.relpath(os.path.abspath(waveform_path), os.path.abspath(output_folder)).replace(os.sep, '/')
+    trace_data = trace_data.copy()
+    waveforms = {}
+
+    for column in waveform_columns:
+        if column not in trace_data.columns:
+            continue
+        has_points = [isinstance(value, (np.ndarray, list)) for value in trace_data[column]] ## rows without data points are na
+        if not any(has_points):
+            continue
+
+        points = [np.asarray(value, dtype = np.float32).ravel() for value, points_found in zip(trace_data[column], has_points) if points_found]
+        offsets = np.zeros(len(points) + 1, dtype = np.int64)
+        offsets[1:] = np.cumsum([len(pulse_points) for pulse_points in points])
+        waveforms[column] = np.concatenate(points)
+        waveforms[column + '_offsets'] = offsets
+
+        pulse_no = np.cumsum(has_points) - 1
+        trace_data[column] = [waveform_key + ':' + column + ':' + str(pulse) if points_found else value
+                              for value, points_found, pulse in zip(trace_data[column], has_points, pulse_no)]
+
+    if waveforms:
+        if compress_waveforms:
+            np.savez_compressed(waveform_path, **waveforms)
+        else:
+            np.savez(waveform_path, **waveforms)
+    return trace_data
+
+
+def load_trace_waveforms(waveform_key, column):
+    """
+    Returns the list of data point arrays (one per pulse) saved for a waveform column of a trace.
+    1st term = .npz file relative to Analysis_output (first part of the reference saved in the .csv files)
+    2nd term = name of the waveform column (e.g. 'Current_points_plot')
+    """
+    with np.load(os.path.join(output_folder, waveform_key)) as waveforms:
+        points = waveforms[column]
+        offsets = waveforms[column + '_offsets']
+    return [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def load_waveform(reference):
+    """
+    Returns the data points of one pulse from the reference saved in a .csv file ('npz file:column:pulse number').
+    """
+    waveform_key, column, pulse = reference.rsplit(':', 2)
+    with np.load(os.path.join(output_folder, waveform_key)) as waveforms:
+        offsets = waveforms[column + '_offsets']
+        return waveforms[column][offsets[int(pulse)]:offsets[int(pulse) + 1]]
+
+
+def add_to_master(trace_data, master_name):
+    """
+    Adds the rows extracted from one trace to a master.
+    1st term = dataframe with the data extracted from the trace (columns missing from the master are added at its end)
+    2nd term = name of the master file in Analysis_output without .csv (e.g. 'VC_excitatory_opsin_master')
+    """
+    if analysisSession.master_rows is not None: ## running inside a batch: rows are merged by Batch_Analysis at the end
+        analysisSession.master_rows.append((master_name, trace_data))
+        return
+
+    connection = open_store()
+    try:
+        with connection: ## commits the new rows, or none of them if something goes wrong
+            append_trace(connection, master_name, trace_data)
+        if export_after_trace:
+            export_master(master_name, connection)
+        else:
+            print ('Added ' + str(len(trace_data)) + ' rows to ' + master_name + ' in ' + get_store_path() + ' (python resultsStore.py writes the master .csv files)')
+    finally:
+        connection.close()
+
+
+def merge_into_masters(master_rows):
+    """
+    Adds the rows extracted during a batch to the store in one go and exports each master .csv file once.
+    1st term = list of (master name, trace dataframe) already in the order in which they should be added
+    Rows already present in a master for a trace that has just been re-analysed are replaced, so running the
+    same batch twice gives exactly the same master files. The old rows of a trace are removed once, before its 1st
+    rows of the batch, so that a trace listed several times (e.g. two irradiance ranges) keeps the rows of each analysis.
+    """
+    master_names = []
+    replaced_traces = set() ## (master name, trace ID) whose old rows were already removed in this merge
+    connection = open_store()
+    try:
+        with connection:
+            for master_name, trace_data in master_rows:
+                trace_key = (master_name, get_trace_id(trace_data))
+                append_trace(connection, master_name, trace_data, replace = trace_key not in replaced_traces)
+                replaced_traces.add(trace_key)
+                if master_name not in master_names:
+                    master_names.append(master_name)
+
+        for master_name in master_names:
+            row_no = sum(len(trace_data) for name, trace_data in master_rows if name == master_name)
+            export_master(master_name, connection)
+            print ('Added ' + str(row_no) + ' rows to ' + get_master_path(master_name))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Export the master .csv files from the results store')
+    parser.add_argument('master_names', nargs = '*', help = 'masters to export (e.g. VC_excitatory_opsin_master), default = all')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__))) ## Analysis_output lives next to this file
+    export_all_masters(args.master_names)
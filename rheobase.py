@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by Gapfree_AP_stim.py to find the rheobase (minimum current that triggers a spike) of every pulse duration.
+
+The current pulses of the trace are grouped by their duration, rounded to duration_resolution_ms, so that any set of
+durations can be tested (e.g. 0.5 to 20ms sweeps) and not only 1, 2 and 5ms pulses. Durations that round to one of the
+durations of the master file at 1ms (e.g. a 1.7ms pulse of a 2ms protocol) are kept in that group, as they were before
+the 0.5ms resolution, so that the master file gets the same pulses. get_rheobase() finds the pulse
+with the smallest current giving a voltage over 0mV in each group with a single groupby, and get_input_output_curve()
+keeps the response of every pulse, sorted by duration and current.
+"""
+
+import numpy as np
+
+duration_resolution_ms = 0.5 ## pulse durations are rounded to this step (1ms pulses of 19 to 21 points at 20 points/ms are all 1ms pulses)
+current_threshold_pA = 10 ## current injected over this value is part of the pulse
+
+
+def get_pulse_durations(pulse_lengths, sampling_rate, master_durations = ()):
+    """
+    Returns the duration in ms of each pulse, rounded to duration_resolution_ms, or to 1ms when this gives one of master_durations.
+    1st term = number of points of each pulse (from find_pulses)
+    2nd term = number of points per ms (abf.dataPointsPerMs)
+    3rd term = durations (ms) saved in the master file (e.g. [5, 2, 1])
+    """
+    durations = np.asarray(pulse_lengths) / sampling_rate
+    durations_ms = np.round(durations) ## 1ms rounding used for the master file
+    return np.where(np.isin(durations_ms, master_durations), durations_ms, np.round(durations / duration_resolution_ms) * duration_resolution_ms)[()] ## [()] keeps a single duration a number
+
+
+def get_rheobase(pulse_data):
+    """
+    Finds the rheobase pulse of each pulse duration.
+    1st term = dataframe with one row per pulse: Pulse_Length, Current_Value, Voltage_Value (max of the pulse) and Spike_count
+    Returns a dataframe with one row per pulse duration (sorted): the row of pulse_data of the pulse with the smallest
+    current giving a voltage over 0mV, with its position in pulse_data as Pulse_idx; Current_Value, Voltage_Value and Pulse_idx
+    are nan and Spike_count 0 for durations where no pulse gave a spike.
+    """
+    spiking_pulses = pulse_data[pulse_data['Voltage_Value'] > 0]
+    rheobase_idx = spiking_pulses.groupby('Pulse_Length')['Current_Value'].idxmin() ## 1st pulse with the minimum current if several
+    rheobase = pulse_data.loc[rheobase_idx].astype({'Current_Value' : float, 'Voltage_Value' : float})
+    rheobase.insert(0, 'Pulse_idx', rheobase.index.astype(float))
+
+    pulse_lengths = np.sort(pulse_data['Pulse_Length'].unique())
+    rheobase = rheobase.set_index('Pulse_Length').reindex(pulse_lengths)
+    rheobase['Spike_count'] = rheobase['Spike_count'].fillna(0).astype(int)
+    return rheobase.rename_axis('Pulse_Length').reset_index()
+
+
+def get_spike_delay(current_points, voltage_points, sampling_rate):
+    """
+    Returns the delay in ms between the start of the current pulse and the voltage max, and between the end of the pulse and the voltage max.
+    1st and 2nd term = current and voltage data points around the pulse
+    3rd term = number of points per ms (abf.dataPointsPerMs)
+    """
+    I_pulse_idx = np.flatnonzero(np.asarray(current_points) > current_threshold_pA)
+    V_max_idx = np.argmax(voltage_points) ## 1st point of the voltage max
+    return (V_max_idx - I_pulse_idx[0]) / sampling_rate, (V_max_idx - I_pulse_idx[-1]) / sampling_rate
+
+
+def get_input_output_curve(pulse_data):
+    """
+    Returns the response of every pulse (spike count, spike yes / no, time to 1st spike) sorted by pulse duration and current.
+    """
+    input_output = pulse_data.sort_values(['Pulse_Length', 'Current_Value'], kind = 'stable')
+    return input_output.assign(Spike = input_output['Voltage_Value'] > 0)
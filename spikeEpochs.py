@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by the current clamp scripts to find the spikes of a trace once and count them in each epoch.
+
+The epochs of a trace (e.g. 100ms before to 1s after each LED pulse, each current pulse with or without LED) often
+overlap, and running scipy.signal.find_peaks on every epoch scans the same points many times. Instead find_spikes()
+runs find_peaks once over the whole voltage trace, and get_epoch_spikes() finds which spikes fall in each epoch with
+np.searchsorted on the sorted spike indexes: the spikes of epoch n are spike_idx[spike_first[n]:spike_last[n]].
+count_spikes() and get_first_spikes() then give the number of spikes, and the time and height of the 1st spike, of
+all epochs as arrays.
+
+The spikes found are the same as with find_peaks on each epoch: a peak is a point higher than the points next to it,
+so find_peaks never finds a peak on the 1st or last point of an epoch, and these points are left out here as well.
+Spikes found with a lower height can be kept for a higher one (e.g. spike_idx[spike_heights >= 0]), since the height
+only selects among the same peaks. When several analyses of a recording share a traceIndex, find_peaks runs once on
+each voltage channel with the lowest height asked for and the next analyses keep the spikes over their own height.
+"""
+
+import numpy as np
+from scipy.signal import find_peaks
+
+import traceIndex
+
+
+def find_spikes(trace, height):
+    """
+    Finds all spikes of a trace.
+    1st term = voltage trace (e.g. voltage_trace)
+    2nd term = lowest height (mV) of a spike peak
+    Returns 2 arrays: index of each spike peak in the trace (sorted) and its height
+    """
+    if traceIndex.index is None or not hasattr(trace, 'baselines'): ## not a channel of a shared recording (traceCache.TraceChannel)
+        return find_all_spikes(trace, height)
+
+    spike_key = ('spikes', trace.trace.abfFilePath, trace.channel, trace.baselines)
+    lowest_height, spike_idx, spike_heights = traceIndex.get(spike_key, lambda: (height,) + find_all_spikes(trace, height))
+    if height < lowest_height: ## spikes found by another analysis were over a higher height
+        spike_idx, spike_heights = find_all_spikes(trace, height)
+        traceIndex.index[spike_key] = (height, spike_idx, spike_heights)
+    kept = spike_heights >= height
+    return spike_idx[kept], spike_heights[kept]
+
+
+def find_all_spikes(trace, height):
+    """
+    Runs find_peaks over the whole trace, see find_spikes().
+    """
+    spike_idx, spike_properties = find_peaks(np.asarray(trace), height = height)
+    return spike_idx, spike_properties['peak_heights']
+
+
+def get_epoch_spikes(spike_idx, epoch_bounds):
+    """
+    Returns 2 arrays: for each epoch, the position in spike_idx of its 1st spike and the position after its last spike.
+    1st term = index of the spikes from find_spikes()
+    2nd term = (starts, ends) from pulseEpochs.get_epoch_bounds()
+    """
+    starts, ends = epoch_bounds
+    spike_first = np.searchsorted(spike_idx, np.asarray(starts) + 1) ## 1st point of the epoch is never a peak
+    spike_last = np.maximum(np.searchsorted(spike_idx, np.asarray(ends) - 1), spike_first) ## nor the last one
+    return spike_first, spike_last
+
+
+def count_spikes(spike_idx, epoch_bounds):
+    """
+    Returns the number of spikes of each epoch as an array.
+    """
+    spike_first, spike_last = get_epoch_spikes(spike_idx, epoch_bounds)
+    return spike_last - spike_first
+
+
+def get_first_spikes(spike_idx, spike_heights, epoch_bounds):
+    """
+    Returns 2 arrays: number of points between the start of each epoch and its 1st spike, and the height of the 1st
+    spike (nan for the epochs without spike).
+    """
+    spike_first, spike_last = get_epoch_spikes(spike_idx, epoch_bounds)
+    if len(spike_idx) == 0:
+        return np.full(len(spike_first), np.nan), np.full(len(spike_first), np.nan)
+    has_spike = spike_last > spike_first
+    first_spike = np.minimum(spike_first, len(spike_idx) - 1) ## any spike for the epochs without spike, replaced by nan
+    first_spike_points = np.where(has_spike, spike_idx[first_spike] - np.asarray(epoch_bounds[0]), np.nan)
+    first_spike_heights = np.where(has_spike, spike_heights[first_spike], np.nan)
+    return first_spike_points, first_spike_heights
+
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used by the current clamp scripts to calculate the spike frequency, inter-spike interval (ISI) and timing
+statistics of the spikes of every epoch (e.g. 1s after each LED pulse) at once.
+
+The spikes of all epochs are kept as one ragged array in CSR layout (like scipy.sparse): spike_points holds the spikes
+of every epoch one after the other, as number of points from the start of their epoch, and the spikes of epoch n are
+spike_points[offsets[n]:offsets[n+1]]. get_spike_trains() builds this from the spikes of the whole trace
+(spikeEpochs.find_spikes) and get_spike_train_stats() calculates all statistics with a few numpy calls on the whole
+array, instead of a Python call (and a print) per epoch.
+
+The mean frequency of an epoch is 1 / mean ISI (nan for epochs with less than 2 spikes), the instantaneous frequency
+is 1 / each ISI and the jitter is the standard deviation of the 1st spike latency across epochs.
+"""
+
+import numpy as np
+from spikeEpochs import get_epoch_spikes
+
+
+def get_spike_trains(spike_idx, epoch_bounds):
+    """
+    Returns the spikes of each epoch in CSR layout.
+    1st term = index of the spikes from spikeEpochs.find_spikes()
+    2nd term = (starts, ends) from pulseEpochs.get_epoch_bounds()
+    Returns 2 arrays: offsets (number of epochs + 1) and spike_points, number of points between the start of the epoch and each spike
+    """
+    spike_first, spike_last = get_epoch_spikes(spike_idx, epoch_bounds)
+    spike_counts = spike_last - spike_first
+    offsets = np.concatenate([[0], np.cumsum(spike_counts)]).astype(np.int64)
+    spike_pos = np.repeat(spike_first - offsets[:-1], spike_counts) + np.arange(offsets[-1]) ## position in spike_idx of every spike kept
+    spike_points = np.asarray(spike_idx)[spike_pos] - np.repeat(np.asarray(epoch_bounds[0]), spike_counts)
+    return offsets, spike_points
+
+
+def get_spike_train_stats(offsets, spike_points, sampling_rate):
+    """
+    Calculates the spike statistics of every epoch.
+    1st term = offsets from get_spike_trains()
+    2nd term = spike_points from get_spike_trains()
+    3rd term = number of points per ms (abf.dataPointsPerMs)
+    Returns a dictionary with for each epoch (arrays): spike_count, mean_freq_Hz (1 / mean ISI), CV_ISI (std / mean of
+    the ISIs, nan with less than 2 ISIs) and first_spike_latency_ms (nan without spike); jitter_ms, the standard deviation
+    of the 1st spike latencies of the epochs with a spike (nan with less than 2); and the instantaneous frequency of every
+    ISI in CSR layout: inst_freq_offsets and inst_freq_Hz.
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    spike_points = np.asarray(spike_points)
+    spike_counts = np.diff(offsets)
+    epoch_no = len(spike_counts)
+    has_spike = spike_counts > 0
+
+    ## ISIs: differences between consecutive spikes of the same epoch
+    spike_epoch = np.repeat(np.arange(epoch_no), spike_counts)
+    same_epoch = spike_epoch[1:] == spike_epoch[:-1]
+    ISI_points = np.diff(spike_points)[same_epoch]
+    ISI_epoch = spike_epoch[1:][same_epoch]
+    ISI_counts = np.maximum(spike_counts - 1, 0)
+    ISI_ms = ISI_points / sampling_rate
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ISI_mean_ms = np.bincount(ISI_epoch, weights = ISI_points, minlength = epoch_no) / ISI_counts / sampling_rate ## sum of the ISIs in points is exact
+        ISI_var = np.bincount(ISI_epoch, weights = (ISI_ms - ISI_mean_ms[ISI_epoch]) ** 2, minlength = epoch_no) / ISI_counts
+        mean_freq_Hz = 1 / ISI_mean_ms * 1000
+        CV_ISI = np.where(ISI_counts > 1, np.sqrt(ISI_var) / ISI_mean_ms, np.nan)
+    mean_freq_Hz[ISI_counts == 0] = np.nan
+
+    first_spike_latency_ms = np.full(epoch_no, np.nan)
+    first_spike_latency_ms[has_spike] = spike_points[offsets[:-1][has_spike]] / sampling_rate
+    latencies = first_spike_latency_ms[has_spike]
+    jitter_ms = np.std(latencies, ddof = 1) if latencies.size > 1 else np.nan
+
+    return {'spike_count' : spike_counts,
+            'mean_freq_Hz' : mean_freq_Hz,
+            'CV_ISI' : CV_ISI,
+            'first_spike_latency_ms' : first_spike_latency_ms,
+            'jitter_ms' : jitter_ms,
+            'inst_freq_offsets' : np.concatenate([[0], np.cumsum(ISI_counts)]).astype(np.int64),
+            'inst_freq_Hz' : 1 / ISI_ms * 1000 }
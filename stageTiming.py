@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures how long each stage of an analysis script takes and how much memory it needs.
+
+The analysis scripts run from top to bottom, so they only mark where each stage starts with start_stage('name'):
+the previous stage ends there. Stages used by the scripts:
+load (open the .abf file and extract the traces), metadata (questions about the trace), detect (find the LED / current
+pulses), extract (cut epochs and calculate the response values), fit (monoexponential fits), power lookup (LED power
+tables), persist (single trace .csv / .npz files and masters), plot (figures, or figure jobs when running in a batch).
+A stage started several times (e.g. extract before and after the power lookup) is added up.
+
+For every stage the wall time (s) and the peak memory (MB) are recorded. The peak memory is the largest resident memory
+of the process during the stage: on Linux the peak is reset at the start of every stage, on other systems it is the
+peak since the process started (the stage that first reaches it is the one to look at). At the end of the script save_stage_times() writes them in
+Analysis_output/Stage_timing/<analysis>/<trace>.json and prints them. When running Batch_Analysis the stage times of
+all traces (also of the traces that failed) are put together in Analysis_output/Stage_timing_traces.csv and
+Analysis_output/Stage_timing_summary.csv, see Batch_Analysis.
+"""
+
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError: ## not available on Windows
+    resource = None
+
+stage_folder = os.path.join('Analysis_output', 'Stage_timing')
+track_memory = True ## False to only measure time
+
+stage_times = None ## dictionary stage name -> {'time_s', 'peak_memory_MB', 'calls'} for the trace being analysed
+current_stage = None
+stage_start_time = None
+trace_start_time = None
+batch_session = False ## True when the stage times are collected by Batch_Analysis
+trace_details = {} ## trace number, analysis and protocol of the trace being analysed (known once save_stage_times is called)
+
+
+def start(memory = None, batch = False):
+    """
+    Starts measuring a new trace.
+    1st term = True / False to measure the peak memory or not, None = use track_memory
+    2nd term = True when Batch_Analysis collects the stage times (it then calls stop() after the script)
+    """
+    global stage_times, current_stage, stage_start_time, trace_start_time, track_memory, batch_session, trace_details
+    if memory is not None:
+        track_memory = memory
+    batch_session = batch
+    trace_details = {}
+    stage_times = {}
+    current_stage = None
+    stage_start_time = None
+    trace_start_time = time.perf_counter()
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident memory of the process (Linux only, elsewhere the peak since the process started is kept).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def get_peak_memory():
+    """
+    Returns the peak resident memory of the process in MB (nan if it cannot be measured).
+    """
+    try:
+        with open('/proc/self/status') as process_status:
+            for line in process_status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1e3 ## kB
+    except OSError:
+        pass
+    if resource is None:
+        return float('nan')
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory / 1e6 if sys.platform == 'darwin' else peak_memory / 1e3 ## bytes on macOS, kB elsewhere
+
+
+def end_stage():
+    """
+    Ends the current stage and adds its time and peak memory to stage_times.
+    """
+    global current_stage
+    if current_stage is None:
+        return
+    elapsed = time.perf_counter() - stage_start_time
+    stage_record = stage_times.setdefault(current_stage, {'time_s': 0.0, 'peak_memory_MB': 0.0, 'calls': 0})
+    stage_record['time_s'] += elapsed
+    stage_record['calls'] += 1
+    if track_memory:
+        stage_record['peak_memory_MB'] = max(stage_record['peak_memory_MB'], get_peak_memory())
+        reset_peak_memory()
+    current_stage = None
+
+
+def start_stage(stage_name):
+    """
+    Ends the current stage and starts measuring the next one.
+    1st term = name of the stage (e.g. 'load', 'detect', 'fit')
+    """
+    global current_stage, stage_start_time
+    if stage_times is None: ## script run by hand: 1st stage of the trace
+        start()
+    end_stage()
+    current_stage = stage_name
+    if track_memory:
+        reset_peak_memory()
+    stage_start_time = time.perf_counter()
+
+
+def get_trace_record():
+    """
+    Returns the stage times measured so far as a dictionary (see save_stage_times).
+    """
+    end_stage()
+    if stage_times is None:
+        return dict(trace_details, total_time_s = 0.0, stages = [])
+    return dict(trace_details, total_time_s = time.perf_counter() - trace_start_time,
+                stages = [dict(stage = stage_name, **stage_record) for stage_name, stage_record in stage_times.items()])
+
+
+def stop():
+    """
+    Stops measuring the trace. Returns the stage times measured (see get_trace_record).
+    """
+    global stage_times, batch_session
+    trace_record = get_trace_record()
+    stage_times = None
+    batch_session = False
+    return trace_record
+
+
+def save_stage_times(analysis_name, file_name, protocol = None):
+    """
+    Writes the stage times of the trace in Analysis_output/Stage_timing/<analysis>/<trace>.json and prints them.
+    1st term = name of the analysis, used as folder name (e.g. 'VC_excitatory')
+    2nd term = name of the trace
+    3rd term = protocol of the trace (abf.protocol), to compare protocols
+    """
+    trace_details.update(trace_number = str(file_name), analysis = analysis_name, protocol = protocol)
+    trace_record = get_trace_record() if batch_session else stop() ## in a batch, Batch_Analysis stops the measure after the script
+
+    trace_folder = os.path.join(stage_folder, analysis_name)
+    os.makedirs(trace_folder, exist_ok = True)
+    with open(os.path.join(trace_folder, str(file_name) + '.json'), 'w') as record_file:
+        json.dump(trace_record, record_file, indent = 1)
+
+    print ('Stage times for trace ' + str(file_name) + ': ' + ', '.join(stage['stage'] + ' ' + str(round(stage['time_s'], 3)) + 's (' + str(round(stage['peak_memory_MB'], 1)) + 'MB)'
+                                                                     for stage in trace_record['stages']))
+    return trace_record
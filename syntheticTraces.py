@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic recordings with the same layout and size as the .abf files recorded on our rigs, used by Benchmark_Analysis
+to time the analysis scripts on traces of any size (the only real traces are the 4 files in Sample_data).
+
+A recording is described by a dictionary (make_recording) holding the channels and the stimulus protocol: LED steps
+or trains, current steps, the opsin response to each LED pulse (exponential rise, inactivation and decay, in pA in
+voltage clamp or mV in current clamp), the membrane response to each current step, spikes and noise.
+The data points are only calculated chunk by chunk when the recording is written (write_abf), so that an hour-long
+gap-free recording never has to fit in memory.
+
+Files are written in the ABF1 format (like pyabf.abfWriter, which only writes single channel files) with all channels
+interleaved as int16, so the analysis scripts open them with pyabf exactly like the real recordings: same channel
+order, units, protocol name and sampling rate. The default parameters of each analysis script (see protocols) copy
+the matching trace of Sample_data and any of them can be changed, e.g.:
+recording = make_recording('Excitatory_Opsin_Voltage_Clamp', sweep_count = 70, noise = 5)
+write_abf(recording, 'Benchmark_data/VC_excitatory_long.abf')
+"""
+
+import datetime
+import os
+import struct
+import numpy as np
+
+
+"""
+Channels recorded on each rig, in the order saved in the .abf files (name, unit). Voltage clamp (VC) records the
+current first, current clamp (CC) the voltage first. The LED analog input is always the last channel.
+"""
+channel_layouts = {
+        ('VC', 'Rig 1') : [('Im_prime2', 'pA'), ('Vm_sec2', 'mV'), ('LED_TTL', 'V'), ('LED_input', 'V')] ,
+        ('CC', 'Rig 1') : [('Vm_prime2', 'mV'), ('Im_sec2', 'pA'), ('LED_TTL', 'V'), ('LED_input', 'V')] ,
+        ('VC', 'Rig 2') : [('IN 0', 'pA'), ('IN 1', 'mV'), ('LED_Ain', 'V')] ,
+        ('CC', 'Rig 2') : [('IN 0', 'mV'), ('IN 1', 'pA'), ('LED_Ain', 'V')]
+        }
+
+adc_ranges = {
+        'mV' : 200.0 ,
+        'pA' : 20000.0 ,
+        'V' : 10.0
+        } ## largest value recorded for each unit (gain of the amplifier), values are saved as int16 over +/- this range
+
+LED_TTL_V = 5.0 ## value of the LED TTL channel while the LED is ON
+LED_baseline_V = -0.01 ## offset of the LED channels while the LED is OFF (as recorded on both rigs, the noise never goes over 0)
+chunk_seconds = 10 ## seconds of recording calculated and written at a time
+
+"""
+Default parameters of the recording analysed by each script, taken from the traces of Sample_data.
+Times are in s within each sweep (onsets) or in ms (pulse durations and time constants).
+LED_steps_V, current_steps_pA and current_pulse_ms are used one after the other for every pulse of the recording,
+starting again from the first value when all were used. LED_onsets_s can also be one list of onsets per sweep.
+With LED_frequency_Hz / current_frequency_Hz the pulses are repeated until the end of the sweep from the first onset.
+opsin_amplitude = response to the largest LED step (pA in VC, mV in CC), opsin_steady = fraction of the response left
+after inactivation (1 = no inactivation). metadata = answers given for the trace, as in Sample_data_info.xlsx
+"""
+protocols = {
+        'Excitatory_Opsin_Voltage_Clamp' : dict(
+                protocol = 'VC_LED_step_NO_FILTER', clamp = 'VC', rig = 'Rig 2', sampling_rate = 20000,
+                sweep_count = 7, sweep_duration_s = 2.428, holding = (-28.0, -63.0), noise = 3.0,
+                LED_onsets_s = [1.2], LED_pulse_ms = 5, LED_steps_V = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+                opsin_amplitude = -1500.0, opsin_tau_on_ms = 1.0, opsin_tau_off_ms = 15.0,
+                metadata = {'Rig ID' : '2', 'Opsin' : 'Chrimson', 'Wavelength' : '630', 'Irradiance_Range' : 'LED_630_100%'}),
+
+        'Inhibitory_Opsin_Voltage_Clamp' : dict(
+                protocol = 'VC_LED_1s_step', clamp = 'VC', rig = 'Rig 2', sampling_rate = 20000,
+                sweep_count = 7, sweep_duration_s = 3.0, holding = (-20.0, -60.0), noise = 3.0,
+                LED_onsets_s = [0.5], LED_pulse_ms = 1000, LED_steps_V = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+                opsin_amplitude = 400.0, opsin_tau_on_ms = 5.0, opsin_tau_off_ms = 40.0,
+                opsin_tau_inactivation_ms = 250.0, opsin_steady = 0.6,
+                metadata = {'Rig ID' : '2', 'Opsin' : 'NpHR', 'Wavelength' : '543', 'Irradiance_Range' : 'LED_543_100%'}),
+
+        'Excitatory_Opsin_Current_Clamp' : dict(
+                protocol = 'CC_LED_step_NO_FILTER', clamp = 'CC', rig = 'Rig 2', sampling_rate = 20000,
+                sweep_count = 7, sweep_duration_s = 2.428, holding = (-60.0, 2.0), noise = 0.2,
+                LED_onsets_s = [1.2], LED_pulse_ms = 5, LED_steps_V = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+                opsin_amplitude = 35.0, opsin_tau_on_ms = 2.0, opsin_tau_off_ms = 20.0,
+                current_onsets_s = [2.3], current_pulse_ms = [2], current_steps_pA = [800.0],
+                metadata = {'Rig ID' : '2', 'Opsin' : 'Chrimson', 'Wavelength' : '630', 'Irradiance_Range' : 'LED_630_100%'}),
+
+        'Inhibitory_Opsin_Current_Clamp' : dict(
+                protocol = 'CC_LED_1s_step', clamp = 'CC', rig = 'Rig 2', sampling_rate = 20000,
+                sweep_count = 7, sweep_duration_s = 3.0, holding = (-60.0, 2.0), noise = 0.2,
+                LED_onsets_s = [0.5], LED_pulse_ms = 1000, LED_steps_V = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 3.5],
+                opsin_amplitude = -15.0, opsin_tau_on_ms = 10.0, opsin_tau_off_ms = 50.0,
+                opsin_tau_inactivation_ms = 300.0, opsin_steady = 0.7,
+                metadata = {'Rig ID' : '2', 'Opsin' : 'NpHR', 'Wavelength' : '543', 'Irradiance_Range' : 'LED_543_100%'}),
+
+        'Excitatory_Opsin_Current_Clamp_Frequency' : dict(
+                protocol = '7B CC 1 Hz light step 5ms', clamp = 'CC', rig = 'Rig 1', sampling_rate = 50000,
+                sweep_count = 1, sweep_duration_s = 5.0, holding = (-59.0, 5.0), noise = 0.2, gap_free = True,
+                LED_onsets_s = [0.578], LED_pulse_ms = 5, LED_steps_V = [1.2], LED_frequency_Hz = 1.0,
+                opsin_amplitude = 35.0, opsin_tau_on_ms = 1.0, opsin_tau_off_ms = 10.0,
+                metadata = {'Rig ID' : '1', 'Opsin' : 'CoChR', 'Wavelength' : '475', 'Irradiance_Range' : 'LED_475_20%', 'LED_frequency_Hz' : '1.0'}),
+
+        'Gapfree_AP_stim' : dict(
+                protocol = 'CC_gapfree_AP_stim', clamp = 'CC', rig = 'Rig 1', sampling_rate = 20000,
+                sweep_count = 1, sweep_duration_s = 60.0, holding = (-65.0, 4.0), noise = 0.2, gap_free = True,
+                current_onsets_s = [1.5], current_frequency_Hz = 2.0,
+                current_pulse_ms = [1] * 10 + [2] * 10 + [5] * 10, current_steps_pA = list(np.arange(200.0, 4200.0, 400.0)) * 3,
+                metadata = {'Rig ID' : '1', 'Opsin' : 'Cheriff', 'Wavelength' : 'na', 'Irradiance_Range' : 'na'}),
+
+        'Inhibitory_Opsin_CC_Long_AP_Inhibit' : dict(
+                protocol = 'CC_long_AP_inhibit', clamp = 'CC', rig = 'Rig 2', sampling_rate = 20000,
+                sweep_count = 3, sweep_duration_s = 8.5, holding = (-60.0, 2.0), noise = 0.2,
+                current_onsets_s = [0.5, 4.5], current_pulse_ms = [3000], current_steps_pA = [200.0],
+                LED_onsets_s = [5.5], LED_pulse_ms = 1000, LED_steps_V = [0.5, 1.0, 1.5],
+                opsin_amplitude = -20.0, opsin_tau_on_ms = 10.0, opsin_tau_off_ms = 50.0,
+                metadata = {'Rig ID' : '2', 'Opsin' : 'NpHR', 'Wavelength' : '543', 'Irradiance_Range' : 'LED_543_100%'}),
+
+        'Inhibitory_Opsin_CC_Short_AP_Inhibit' : dict(
+                protocol = '8 CC_520_Single Spike + Light pulse', clamp = 'CC', rig = 'Rig 1', sampling_rate = 10000,
+                sweep_count = 10, sweep_duration_s = 3.0, holding = (-62.5, 3.6), noise = 0.2,
+                current_onsets_s = [0.5469 + 0.2 * pulse for pulse in range(10)], current_pulse_ms = [5], current_steps_pA = [300.0],
+                LED_onsets_s = [[0.5469, 0.7469 + 0.2 * sweep] for sweep in range(9)], LED_pulse_ms = 5, LED_steps_V = [1.2],
+                opsin_amplitude = -5.0, opsin_tau_on_ms = 1.0, opsin_tau_off_ms = 10.0,
+                metadata = {'Rig ID' : '1', 'Opsin' : 'GtACR1', 'Wavelength' : '520', 'Irradiance_Range' : 'LED_520_100%'})
+        }
+
+default_parameters = dict(
+        gap_free = False, LED_onsets_s = [], LED_pulse_ms = 5, LED_steps_V = [1.0], LED_frequency_Hz = None,
+        current_onsets_s = [], current_pulse_ms = [5], current_steps_pA = [0.0], current_frequency_Hz = None,
+        opsin_amplitude = 0.0, opsin_tau_on_ms = 1.0, opsin_tau_off_ms = 10.0, opsin_tau_inactivation_ms = None, opsin_steady = 1.0,
+        input_resistance_MOhm = 100.0, membrane_tau_ms = 10.0, max_step_response_mV = 25.0, spike_peak_mV = 30.0, spike_threshold_mV = 15.0,
+        rheobase_pC = 1.5, spike_rate_Hz = 20.0, spike_latency_ms = 2.0, spontaneous_rate_Hz = 0.0,
+        recording_time = datetime.datetime(2020, 1, 1, 12, 0, 0), seed = 0, metadata = {})
+
+
+def get_pulse_onsets(onsets_s, frequency_Hz, sweep, sweep_duration_s):
+    """
+    Returns the onsets (s within the sweep) of the pulses of one sweep.
+    1st term = list of onsets, or one list of onsets per sweep
+    2nd term = frequency of the pulse train (None = only the onsets given)
+    """
+    if len(onsets_s) and isinstance(onsets_s[0], (list, tuple, np.ndarray)):
+        onsets_s = onsets_s[sweep % len(onsets_s)]
+    if frequency_Hz:
+        return list(np.arange(onsets_s[0], sweep_duration_s, 1 / frequency_Hz))
+    return list(onsets_s)
+
+
+def make_recording(analysis_name, **parameters):
+    """
+    Describes a synthetic recording for one analysis script.
+    1st term = name of the analysis script (key of protocols, e.g. 'Excitatory_Opsin_Voltage_Clamp')
+    Any parameter of protocols / default_parameters can be changed, e.g. sweep_count = 70 or sampling_rate = 50000.
+    Returns a dictionary with the parameters used, the channels and the events of the recording (pulses, responses, spikes),
+    each event list being an array with one row per event and the points of the recording as time unit.
+    """
+    if analysis_name not in protocols:
+        raise ValueError ('No synthetic protocol for analysis ' + str(analysis_name) + ', choose from ' + ', '.join(protocols))
+    unknown_parameters = set(parameters) - set(protocols[analysis_name]) - set(default_parameters)
+    if unknown_parameters:
+        raise ValueError ('Unknown parameters for a synthetic recording: ' + ', '.join(sorted(unknown_parameters)))
+    parameters = dict(default_parameters, **dict(protocols[analysis_name], **parameters))
+
+    sampling_rate = parameters['sampling_rate']
+    points_per_ms = sampling_rate / 1000
+    sweep_points = int(round(parameters['sweep_duration_s'] * sampling_rate))
+    sweep_count = parameters['sweep_count']
+    clamp = parameters['clamp']
+    channels = channel_layouts[(clamp, parameters['rig'])]
+    LED_channels = [len(channels) - 2, len(channels) - 1] if len(channels) == 4 else [len(channels) - 1] ## TTL and analog input, or analog input only
+    max_LED_V = max(parameters['LED_steps_V'])
+
+    LED_pulses = [] ## onset, offset, LED step (V)
+    current_pulses = [] ## onset, offset, current step (pA)
+    for sweep in range(sweep_count):
+        sweep_start = sweep * sweep_points
+        for onset_s in get_pulse_onsets(parameters['LED_onsets_s'], parameters['LED_frequency_Hz'], sweep, parameters['sweep_duration_s']):
+            onset = sweep_start + int(round(onset_s * sampling_rate))
+            offset = onset + int(round(parameters['LED_pulse_ms'] * points_per_ms))
+            if offset <= sweep_start + sweep_points:
+                LED_pulses.append((onset, offset, parameters['LED_steps_V'][len(LED_pulses) % len(parameters['LED_steps_V'])]))
+        for onset_s in get_pulse_onsets(parameters['current_onsets_s'], parameters['current_frequency_Hz'], sweep, parameters['sweep_duration_s']):
+            pulse_no = len(current_pulses)
+            onset = sweep_start + int(round(onset_s * sampling_rate))
+            offset = onset + int(round(parameters['current_pulse_ms'][pulse_no % len(parameters['current_pulse_ms'])] * points_per_ms))
+            if offset <= sweep_start + sweep_points:
+                current_pulses.append((onset, offset, parameters['current_steps_pA'][pulse_no % len(parameters['current_steps_pA'])]))
+    LED_pulses = np.array(LED_pulses, dtype = float).reshape(-1, 3)
+    current_pulses = np.array(current_pulses, dtype = float).reshape(-1, 3)
+
+    ## square steps: LED TTL and analog input, current injected in CC
+    steps = [(channel, onset, offset, LED_TTL_V if channels[channel][0] == 'LED_TTL' else LED_V)
+             for onset, offset, LED_V in LED_pulses for channel in LED_channels]
+    if clamp == 'CC':
+        steps += [(1, onset, offset, current) for onset, offset, current in current_pulses]
+
+    ## exponential responses of the recorded channel (channel 0): opsin response to each LED pulse, membrane response to each current step in CC
+    ## onset, offset, amplitude, tau on, tau off, tau inactivation, steady fraction (taus in points)
+    tau_inactivation = parameters['opsin_tau_inactivation_ms'] * points_per_ms if parameters['opsin_tau_inactivation_ms'] else np.inf
+    responses = [(onset, offset, parameters['opsin_amplitude'] * LED_V / max_LED_V, parameters['opsin_tau_on_ms'] * points_per_ms,
+                  parameters['opsin_tau_off_ms'] * points_per_ms, tau_inactivation, parameters['opsin_steady'])
+                 for onset, offset, LED_V in LED_pulses if parameters['opsin_amplitude']]
+    spikes = []
+    if clamp == 'CC':
+        membrane_tau = parameters['membrane_tau_ms'] * points_per_ms
+        max_step_response = parameters['max_step_response_mV'] ## the cell spikes instead of depolarising further
+        responses += [(onset, offset, np.clip(current * parameters['input_resistance_MOhm'] / 1000, -max_step_response, max_step_response),
+                       membrane_tau, membrane_tau, np.inf, 1.0) for onset, offset, current in current_pulses] ## V = R * I (mV = MOhm * nA)
+        spikes = get_spike_points(parameters, LED_pulses, current_pulses, max_LED_V)
+
+    return dict(parameters = parameters, channels = channels, sweep_points = sweep_points, point_count = sweep_points * sweep_count,
+                baselines = list(parameters['holding']) + [LED_baseline_V] * (len(channels) - 2),
+                noise = [parameters['noise'], 0.05 if clamp == 'VC' else 0.5] + [0.002] * (len(channels) - 2),
+                steps = np.array(steps, dtype = float).reshape(-1, 4),
+                responses = np.array(responses, dtype = float).reshape(-1, 7),
+                spikes = np.sort(np.array(spikes, dtype = np.int64)))
+
+
+def get_spike_points(parameters, LED_pulses, current_pulses, max_LED_V):
+    """
+    Returns the index of the peak of every spike of a current clamp recording:
+    LED pulses depolarising the cell by more than spike_threshold_mV give one spike after spike_latency_ms,
+    current steps bringing more than rheobase_pC give one spike at the end of the step (steps up to 10ms) or
+    a train of spikes at spike_rate_Hz (longer steps). Spikes during an inhibitory LED pulse (negative opsin_amplitude)
+    are removed. Spontaneous spikes are added at spontaneous_rate_Hz.
+    """
+    points_per_ms = parameters['sampling_rate'] / 1000
+    latency = int(round(parameters['spike_latency_ms'] * points_per_ms))
+    spikes = []
+    if parameters['opsin_amplitude'] > 0:
+        spikes += [onset + latency for onset, offset, LED_V in LED_pulses
+                   if parameters['opsin_amplitude'] * LED_V / max_LED_V > parameters['spike_threshold_mV']]
+
+    for onset, offset, current in current_pulses:
+        pulse_ms = (offset - onset) / points_per_ms
+        if current * pulse_ms / 1000 < parameters['rheobase_pC']:
+            continue
+        if pulse_ms <= 10:
+            spikes.append(offset + latency)
+        else:
+            spikes += list(np.arange(onset + 5 * points_per_ms, offset, parameters['sampling_rate'] / parameters['spike_rate_Hz']))
+
+    point_count = parameters['sweep_count'] * int(round(parameters['sweep_duration_s'] * parameters['sampling_rate']))
+    if parameters['spontaneous_rate_Hz']:
+        rng = np.random.default_rng(parameters['seed'])
+        spontaneous_no = rng.poisson(parameters['spontaneous_rate_Hz'] * point_count / parameters['sampling_rate'])
+        spikes += list(rng.integers(0, point_count, spontaneous_no))
+
+    spikes = np.array(spikes, dtype = np.int64)
+    if parameters['opsin_amplitude'] < 0 and len(LED_pulses) and len(spikes):
+        LED_onsets, LED_offsets = LED_pulses[:, 0], LED_pulses[:, 1] + latency
+        pulse_no = np.searchsorted(LED_onsets, spikes, side = 'right') - 1 ## last LED pulse starting before each spike
+        inhibited = (pulse_no >= 0) & (spikes <= LED_offsets[np.maximum(pulse_no, 0)])
+        spikes = spikes[~inhibited]
+    return spikes[(spikes > 0) & (spikes < point_count)]
+
+
+def render_chunk(recording, start, stop):
+    """
+    Calculates the data points of all channels between the points start and stop (excluded).
+    Returns a float32 array (channels x points). The noise only depends on the seed and on start, so a chunk is always the same.
+    """
+    point_no = stop - start
+    rng = np.random.default_rng([recording['parameters']['seed'], start])
+    data = (rng.standard_normal((len(recording['channels']), point_no), dtype = np.float32)
+            * np.array(recording['noise'], dtype = np.float32)[:, None] + np.array(recording['baselines'], dtype = np.float32)[:, None])
+
+    steps = recording['steps']
+    for channel, onset, offset, amplitude in steps[(steps[:, 1] < stop) & (steps[:, 2] > start)]:
+        data[int(channel), max(int(onset), start) - start:min(int(offset), stop) - start] += amplitude
+
+    responses = recording['responses']
+    response_ends = responses[:, 1] + 10 * responses[:, 4] ## responses are cut 10 tau after the end of the pulse
+    for onset, offset, amplitude, tau_on, tau_off, tau_inactivation, steady in responses[(responses[:, 0] < stop) & (response_ends > start)]:
+        onset, offset = int(onset), int(offset)
+        first, last = max(onset, start), min(int(offset + 10 * tau_off), stop)
+        if first >= last:
+            continue
+        time = np.arange(first - onset, last - onset, dtype = np.float64) ## points since the start of the pulse
+        pulse_time = np.minimum(time, offset - onset)
+        response = amplitude * (1 - np.exp(-pulse_time / tau_on)) * (steady + (1 - steady) * np.exp(-pulse_time / tau_inactivation))
+        response *= np.exp(-(time - pulse_time) / tau_off) ## decay once the pulse is over
+        data[0, first - start:last - start] += response.astype(np.float32)
+
+    spikes = recording['spikes']
+    if len(spikes):
+        points_per_ms = recording['parameters']['sampling_rate'] / 1000
+        spike_time = np.arange(-int(2 * points_per_ms), int(20 * points_per_ms)) / points_per_ms ## ms around the spike peak
+        spike_shape = np.where(spike_time < 0, np.exp(-(spike_time / 0.3) ** 2), np.exp(-(spike_time / 0.5) ** 2) - 0.1 * (1 - np.exp(-spike_time)) * np.exp(-spike_time / 5))
+        spike_shape = (spike_shape * (recording['parameters']['spike_peak_mV'] - recording['baselines'][0])).astype(np.float32)
+        first, last = np.searchsorted(spikes, [start + spike_time[0] * points_per_ms, stop - spike_time[-1] * points_per_ms])
+        for spike in spikes[max(first - 1, 0):last + 1]:
+            shape_start = spike - start - int(2 * points_per_ms)
+            shape_from, shape_to = max(0, -shape_start), min(len(spike_shape), point_no - shape_start)
+            if shape_from < shape_to:
+                data[0, shape_start + shape_from:shape_start + shape_to] += spike_shape[shape_from:shape_to]
+    return data
+
+
+def write_abf(recording, file_path):
+    """
+    Writes the recording in an ABF1 file that pyabf opens like the recordings of the rigs.
+    1st term = recording from make_recording()
+    2nd term = path of the .abf file (the trace name used by the analysis scripts is the file name)
+    Returns the size of the file in MB.
+    """
+    BLOCKSIZE = 512
+    HEADER_BLOCKS = 12 ## 6144 bytes, size of a full ABF1 header (pyabf reads the protocol path at byte 4898)
+    parameters = recording['parameters']
+    channels = recording['channels']
+    channel_no = len(channels)
+    header = bytearray(HEADER_BLOCKS * BLOCKSIZE)
+
+    recording_time = parameters['recording_time']
+    struct.pack_into('4s', header, 0, b'ABF ') # fFileSignature
+    struct.pack_into('f', header, 4, 1.83) # fFileVersionNumber
+    struct.pack_into('h', header, 8, 3 if parameters['gap_free'] else 5) # nOperationMode (3 = gap-free, 5 = episodic)
+    struct.pack_into('i', header, 10, recording['point_count'] * channel_no) # lActualAcqLength
+    struct.pack_into('i', header, 16, 1 if parameters['gap_free'] else parameters['sweep_count']) # lActualEpisodes
+    struct.pack_into('i', header, 20, int(recording_time.strftime('%Y%m%d'))) # lFileStartDate
+    struct.pack_into('i', header, 24, recording_time.hour * 3600 + recording_time.minute * 60 + recording_time.second) # lFileStartTime
+    struct.pack_into('i', header, 40, HEADER_BLOCKS) # lDataSectionPtr
+    struct.pack_into('h', header, 100, 0) # nDataFormat (0 = int16)
+    struct.pack_into('h', header, 120, channel_no) # nADCNumChannels
+    struct.pack_into('f', header, 122, 1e6 / (parameters['sampling_rate'] * channel_no)) # fADCSampleInterval (us between 2 points of any channel)
+    struct.pack_into('i', header, 138, recording['sweep_points'] * channel_no) # lNumSamplesPerEpisode
+    struct.pack_into('f', header, 244, 10.0) # fADCRange
+    struct.pack_into('i', header, 252, 2**15) # lADCResolution
+    struct.pack_into('h', header, 366, recording_time.microsecond // 1000) # nFileStartMillisecs
+    struct.pack_into('16h', header, 378, *range(16)) # nADCPtoLChannelMap
+    struct.pack_into('16h', header, 410, *(list(range(channel_no)) + [-1] * (16 - channel_no))) # nADCSamplingSeq
+    for channel, (name, unit) in enumerate(channels):
+        struct.pack_into('10s', header, 442 + channel * 10, name.ljust(10).encode()) # sADCChannelName
+        struct.pack_into('8s', header, 602 + channel * 8, unit.ljust(8).encode()) # sADCUnits
+        struct.pack_into('f', header, 922 + channel * 4, 10.0 / adc_ranges[unit]) # fInstrumentScaleFactor: value = int16 * 10 / (2**15 * scale factor)
+    for channel in range(16):
+        struct.pack_into('f', header, 730 + channel * 4, 1.0) # fADCProgrammableGain
+        struct.pack_into('f', header, 1050 + channel * 4, 1.0) # fSignalGain
+    struct.pack_into('256s', header, 4898, ('C:\\Axon\\Params\\' + parameters['protocol'] + '.pro').ljust(256).encode()) # sProtocolPath (strings are padded with spaces)
+
+    value_steps = np.array([adc_ranges[unit] / 2**15 for name, unit in channels], dtype = np.float32)[:, None]
+    chunk_points = int(chunk_seconds * parameters['sampling_rate'])
+    with open(file_path, 'wb') as abf_file:
+        abf_file.write(header)
+        for start in range(0, recording['point_count'], chunk_points):
+            data = render_chunk(recording, start, min(start + chunk_points, recording['point_count']))
+            data = np.clip(np.round(data / value_steps), -2**15, 2**15 - 1).astype('<i2')
+            abf_file.write(data.T.tobytes()) ## channels interleaved point by point
+        padding = -abf_file.tell() % BLOCKSIZE
+        abf_file.write(bytes(padding))
+    return os.path.getsize(file_path) / 1e6
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opens the .abf files for the analysis scripts, keeping each channel as the raw samples stored in the file (int16 ADC
+counts) plus the gain and offset that scale them, and keeps the channels read so that analysing a trace again (e.g.
+with another threshold or after changing a script) does not have to read the .abf file again.
+
+The analysis scripts open their trace with load_trace(file_path) instead of pyabf.ABF(file_path). Only the header of
+the .abf file is read (pyabf with loadData = False). abf.get_channel(channel) returns a TraceChannel, which the scripts
+use like the channel array of pyabf (abf.data[channel]) but which only converts to physical units (float32, exactly as
+pyabf does) the points used:
+- channel[start:stop] converts the points sliced, e.g. the epochs cut by pulseEpochs.extract_epochs
+- channel > threshold (also >=, <, <=) compares the raw samples with the threshold converted once to ADC counts and
+  returns the boolean trace, e.g. find_pulses(LED_trace > 0.1): edges are found without converting the trace
+- channel - baseline returns the channel with its baseline removed, still without converting anything
+- np.max(channel) and np.min(channel) only convert the largest and smallest raw sample
+- np.asarray(channel) (e.g. scipy.signal.find_peaks or plotting the whole trace) converts the whole channel
+The raw samples of a channel take half the memory of float32 (a quarter of float64) and a channel the script never
+uses (e.g. the LED TTL) is never read. A channel that is only sliced (e.g. the voltage in voltage clamp) is read from
+the .abf file where it is sliced. Files saved as float32 (no ADC counts) are kept as float32 and compared as such.
+abf.data still works as in pyabf: data[channel] or data[channel, points] convert only the channel asked for.
+abf.get_sweeps(channel) returns all sweeps of a channel at once, as a (sweeps x points) view on abf.data[channel].
+
+Each channel read in full is saved in the cache folder as a .npy file of raw samples named after the content hash
+(sha1) of the .abf file and the channel number, next to a .json file with the header values the scripts use (abfID,
+abfDateTime, protocol, sampling rate, channel names, scaling of each channel, gain of each input channel and levels of
+the command epochs of each output channel (see ledPower.get_LED_steps) etc). The next time, the header is read
+from the .json file and the channels are opened as memory maps: only the parts of the trace the script looks at are
+read from disk. Because the name is the content hash, a copy of the same file in another folder uses the same cache
+entry and a modified file gets a new one. Hashing a long recording takes time too, so the hash of each .abf file is
+remembered (Trace_cache/files/) together with its size and modification time, and only calculated again when one of them changes.
+These records are removed with the trace they point to.
+
+The cache never grows above cache_budget_MB: once a channel is added, the traces used the longest time ago are
+removed (least recently used first). Set use_cache = False to never save the channels read.
+The cache can be checked or emptied from a terminal:
+python traceCache.py            (size and number of cached traces)
+python traceCache.py --clear    (remove all cached traces)
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import operator
+import os
+import shutil
+
+import numpy as np
+import pyabf
+
+import traceIndex
+
+cache_folder = 'Trace_cache'
+cache_budget_MB = 4000 ## maximum size of the cache, the least recently used traces are removed above it
+use_cache = True ## False to never save the channels read
+read_block_points = 2**20 ## points of each channel read from the .abf file at once
+cache_version = 4 ## entries saved by another version of traceCache are read again
+header_attributes = ['abfID', 'protocol', 'dataRate', 'dataPointsPerMs', 'dataSecPerPoint', 'sweepCount', 'sweepPointCount',
+                     'channelCount', 'adcNames', 'adcUnits', 'dataByteStart', 'dataPointCount'] ## pyabf.ABF attributes kept in the .json file
+all_adc_counts = np.arange(-2**15, 2**15).astype(np.int16) ## every value an int16 sample can take
+
+
+class TraceChannel:
+    """
+    One channel of a trace kept as raw samples, converted to physical units (float32) only where it is used, see the
+    description at the top. Behaves like the 1D float32 array of the channel for slicing, comparisons with a number,
+    subtracting a baseline, np.max / np.min and np.asarray.
+    """
+
+    ndim = 1
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, trace, channel, baselines = ()):
+        self.trace = trace
+        self.channel = channel
+        self.baselines = baselines ## values subtracted from the channel, in order
+        self.shape = (trace.point_count,)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def to_units(self, raw_samples):
+        """
+        Converts raw samples of the channel to float32 physical units (scaled as pyabf, then baselines subtracted).
+        """
+        values = self.trace.scale(self.channel, raw_samples)
+        for baseline in self.baselines:
+            values = values - baseline
+        return values
+
+    def get_raw(self, start = 0, stop = None):
+        """
+        Returns the raw samples from start to stop: from memory or the cache when the channel was read in full, otherwise from the .abf file.
+        """
+        stop = len(self) if stop is None else stop
+        if self.trace.has_raw_channel(self.channel):
+            return self.trace.get_raw_channel(self.channel)[start:stop]
+        return self.trace.read_raw(self.channel, start, stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            return self.to_units(self.get_raw(start, max(start, stop)))
+        if isinstance(key, (int, np.integer)):
+            point = range(len(self))[key]
+            return self.to_units(self.get_raw(point, point + 1))[0]
+        return self.to_units(self.trace.get_raw_channel(self.channel)[key])
+
+    def __array__(self, dtype = None):
+        return np.asarray(self.to_units(self.trace.get_raw_channel(self.channel)), dtype = dtype)
+
+    def extract_epochs(self, starts, ends):
+        """
+        Returns the epochs from starts to ends (see pulseEpochs.extract_epochs). The raw samples of all epochs are
+        converted together and each epoch is a view on the converted points.
+        """
+        starts, ends = np.asarray(starts, dtype = np.int64), np.asarray(ends, dtype = np.int64)
+        epoch_key = ('epochs', self.trace.abfFilePath, self.channel, self.baselines, starts.tobytes(), ends.tobytes())
+        return list(traceIndex.get(epoch_key, lambda: self.convert_epochs(starts, ends))) ## same epochs cut by another analysis of the recording (see traceIndex)
+
+    def convert_epochs(self, starts, ends):
+        """
+        Cuts and converts the epochs, see extract_epochs().
+        """
+        if self.trace.has_raw_channel(self.channel):
+            raw_channel = self.trace.get_raw_channel(self.channel)
+            raw_epochs = [raw_channel[start:end] for start, end in zip(starts, ends)]
+        else:
+            raw_epochs = self.trace.read_raw_epochs(self.channel, starts, ends)
+        if len(raw_epochs) == 0:
+            return []
+        return np.split(self.to_units(np.concatenate(raw_epochs)), np.cumsum(np.asarray(ends) - np.asarray(starts))[:-1])
+
+    def __sub__(self, baseline):
+        return TraceChannel(self.trace, self.channel, self.baselines + (baseline,))
+
+    def compare(self, compare_operator, threshold):
+        """
+        Returns the boolean trace compare_operator(channel, threshold), calculated on the raw samples.
+        For int16 samples the comparison is made once for every possible ADC count (same float32 calculation as on the
+        converted trace, so the result is identical); when it switches only once the threshold is a single ADC count.
+        """
+        compare_key = ('compare', self.trace.abfFilePath, self.channel, self.baselines, compare_operator.__name__, threshold)
+        return traceIndex.get(compare_key, lambda: self.compare_raw(compare_operator, threshold)) ## same boolean trace used by another analysis of the recording (see traceIndex)
+
+    def compare_raw(self, compare_operator, threshold):
+        """
+        Calculates the boolean trace, see compare().
+        """
+        raw_channel = self.trace.get_raw_channel(self.channel)
+        if raw_channel.dtype != np.int16:
+            return compare_operator(self.to_units(raw_channel), threshold)
+        count_above = compare_operator(self.to_units(all_adc_counts), threshold) ## True / False for every ADC count
+        switches = np.flatnonzero(count_above[1:] != count_above[:-1]) + 1
+        if len(switches) == 0:
+            return np.full(len(raw_channel), count_above[0])
+        if len(switches) == 1:
+            threshold_count = all_adc_counts[switches[0]]
+            return raw_channel >= threshold_count if count_above[-1] else raw_channel < threshold_count
+        return count_above[raw_channel.view(np.uint16) ^ np.uint16(2**15)] ## ADC count -> index in all_adc_counts
+
+    def __gt__(self, threshold):
+        return self.compare(operator.gt, threshold)
+
+    def __ge__(self, threshold):
+        return self.compare(operator.ge, threshold)
+
+    def __lt__(self, threshold):
+        return self.compare(operator.lt, threshold)
+
+    def __le__(self, threshold):
+        return self.compare(operator.le, threshold)
+
+    def get_extreme_values(self):
+        raw_channel = self.trace.get_raw_channel(self.channel)
+        if raw_channel.dtype != np.int16:
+            return self.to_units(raw_channel)
+        return self.to_units(np.array([raw_channel.min(), raw_channel.max()], dtype = np.int16)) ## conversion keeps the order of the samples
+
+    def max(self, axis = None, out = None, **kwargs):
+        return self.get_extreme_values().max()
+
+    def min(self, axis = None, out = None, **kwargs):
+        return self.get_extreme_values().min()
+
+
+class TraceChannels:
+    """
+    abf.data of a CachedTrace: data[channel] and data[channel, points] convert only the channel asked for.
+    Anything else (e.g. np.asarray(data)) converts all channels, as pyabf.
+    """
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.shape = (trace.channelCount, trace.point_count)
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        channel, points = (key if isinstance(key, tuple) and len(key) == 2 else (key, slice(None)))
+        if isinstance(channel, (int, np.integer)):
+            return self.trace.get_channel_data(int(channel))[points]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype = None):
+        return np.asarray(np.stack([self.trace.get_channel_data(channel) for channel in range(self.trace.channelCount)]), dtype = dtype)
+
+
+class CachedTrace:
+    """
+    Stands in for pyabf.ABF in the analysis scripts: same attributes (data, sweepX, abfID, abfDateTime, protocol,
+    dataPointsPerMs, dataSecPerPoint etc.) plus get_channel(), which returns a channel as raw samples (see TraceChannel).
+    """
+
+    def __init__(self, header, content_hash, file_path):
+        for attribute in header_attributes:
+            setattr(self, attribute, header[attribute])
+        self.abfDateTime = header['abfDateTime']
+        if header.get('abfDateTime_is_date'):
+            self.abfDateTime = datetime.datetime.fromisoformat(self.abfDateTime)
+        self.abfFilePath = os.path.abspath(file_path)
+        self.header = header
+        self.content_hash = content_hash
+        self.point_count = self.dataPointCount // self.channelCount
+        self.raw_channels = {} ## channel number -> raw samples (in memory or memory mapped from the cache)
+        self.channels = {} ## channel number -> channel converted to float32, only for abf.data
+        self.data = TraceChannels(self)
+
+    @property
+    def sweepX(self):
+        return np.arange(self.sweepPointCount) * self.dataSecPerPoint ## time of the 1st sweep, as pyabf
+
+    @property
+    def sweepList(self):
+        return list(range(self.sweepCount))
+
+    def get_sweeps(self, channel):
+        """
+        Returns one channel converted to float32 as a 2D array (sweeps x points of a sweep), a view on abf.data[channel]:
+        row n is the sweep pyabf gives with abf.setSweep(n, channel).
+        """
+        channel_data = self.get_channel_data(self.check_channel(channel))
+        return channel_data[:self.sweepCount * self.sweepPointCount].reshape(self.sweepCount, self.sweepPointCount)
+
+    def get_channel(self, channel):
+        """
+        Returns one channel (0 = 1st, -1 = last) as a TraceChannel.
+        """
+        return TraceChannel(self, self.check_channel(channel))
+
+    def check_channel(self, channel):
+        if not -self.channelCount <= channel < self.channelCount:
+            raise IndexError ('Channel ' + str(channel) + ' does not exist, trace ' + str(self.abfID) + ' has ' + str(self.channelCount) + ' channels')
+        return channel % self.channelCount
+
+    def scale(self, channel, raw_samples):
+        """
+        Converts raw samples of a channel to float32 physical units exactly as pyabf does.
+        """
+        values = np.asarray(raw_samples).astype(np.float32)
+        if self.header['raw_dtype'] == 'int16':
+            np.multiply(values, self.header['channel_gains'][channel], out = values)
+            np.add(values, self.header['channel_offsets'][channel], out = values)
+        return values
+
+    def has_raw_channel(self, channel):
+        """
+        True when the whole channel was already read, in memory or in the cache.
+        """
+        return channel in self.raw_channels or (use_cache and os.path.isfile(get_channel_path(self.content_hash, channel)))
+
+    def get_raw_channel(self, channel):
+        """
+        Returns the raw samples of the whole channel: from memory, from the cache or read from the .abf file (and then saved in the cache).
+        """
+        channel = self.check_channel(channel)
+        if channel in self.raw_channels:
+            return self.raw_channels[channel]
+        if use_cache and os.path.isfile(get_channel_path(self.content_hash, channel)):
+            try:
+                raw_channel = np.load(get_channel_path(self.content_hash, channel), mmap_mode = 'c') ## copy on write: a script changing the data never changes the cache
+                self.raw_channels[channel] = raw_channel.view(np.ndarray) ## slices of a np.memmap are much slower to iterate (e.g. by pandas)
+                return self.raw_channels[channel]
+            except (OSError, ValueError): ## channel being written by another process
+                pass
+        self.raw_channels[channel] = self.read_raw(channel, 0, self.point_count)
+        if use_cache:
+            add_to_cache(self.content_hash, channel, self.raw_channels[channel])
+        return self.raw_channels[channel]
+
+    def get_channel_data(self, channel):
+        """
+        Returns the whole channel converted to float32 (abf.data[channel] of pyabf).
+        """
+        channel = self.check_channel(channel)
+        if channel not in self.channels:
+            self.channels[channel] = self.scale(channel, self.get_raw_channel(channel))
+        return self.channels[channel]
+
+    def read_raw(self, channel, start, stop):
+        """
+        Reads the raw samples start to stop of one channel from the .abf file.
+        """
+        return self.read_raw_epochs(channel, [start], [stop])[0]
+
+    def read_raw_epochs(self, channel, starts, ends):
+        """
+        Reads the raw samples of one channel from each start to end from the .abf file. Returns a list of arrays.
+        """
+        raw_dtype = np.dtype(self.header['raw_dtype'])
+        raw_epochs = []
+        with open(self.abfFilePath, 'rb') as abf_file: ## points of all channels are interleaved in the file: read by blocks, keep one channel
+            for start, stop in zip(starts, ends):
+                raw_samples = np.empty(stop - start, dtype = raw_dtype)
+                abf_file.seek(self.dataByteStart + start * self.channelCount * raw_dtype.itemsize)
+                for block_start in range(0, stop - start, read_block_points):
+                    block_points = min(read_block_points, stop - start - block_start)
+                    raw_block = np.fromfile(abf_file, dtype = raw_dtype, count = block_points * self.channelCount)
+                    raw_samples[block_start:block_start + block_points] = raw_block[channel::self.channelCount]
+                raw_epochs.append(raw_samples)
+        return raw_epochs
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['channels'] = {} ## channels converted to float32 are not sent to other processes (e.g. figure jobs), only the raw samples
+        return state
+
+
+def get_path_record_folder():
+    return os.path.join(cache_folder, 'files')
+
+
+def get_file_hash(file_path):
+    """
+    Returns the content hash (sha1) of a file. The hash is remembered in Trace_cache/files/ with the size and
+    modification time of the file, and only calculated again when one of them changes.
+    """
+    file_path = os.path.abspath(file_path)
+    file_stat = os.stat(file_path)
+    path_record_path = os.path.join(get_path_record_folder(), hashlib.sha1(file_path.encode()).hexdigest() + '.json')
+    try:
+        with open(path_record_path) as path_record_file:
+            path_record = json.load(path_record_file)
+        if path_record['size'] == file_stat.st_size and path_record['mtime_ns'] == file_stat.st_mtime_ns:
+            return path_record['content_hash']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    content_hash = hashlib.sha1()
+    with open(file_path, 'rb') as abf_file:
+        for block in iter(lambda: abf_file.read(16 * 2**20), b''):
+            content_hash.update(block)
+    content_hash = content_hash.hexdigest()
+    write_json(path_record_path, {'file_path': file_path, 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'content_hash': content_hash})
+    return content_hash
+
+
+def write_json(json_path, values):
+    """
+    Writes a .json file through a temporary file, so that a process reading it at the same time (batch workers) never sees half of it.
+    """
+    os.makedirs(os.path.dirname(json_path), exist_ok = True)
+    temporary_path = json_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_path, 'w') as json_file:
+        json.dump(values, json_file)
+    os.replace(temporary_path, json_path)
+
+
+def get_header_path(content_hash):
+    return os.path.join(cache_folder, content_hash + '.json')
+
+
+def get_channel_path(content_hash, channel):
+    return os.path.join(cache_folder, content_hash + '_channel_' + str(channel) + '.npy')
+
+
+def read_abf_header(file_path):
+    """
+    Reads the header of an .abf file with pyabf, without its data. Returns a dictionary with the attributes the
+    scripts use (header_attributes) and what is needed to decode the channels from the file.
+    """
+    abf = pyabf.ABF(file_path, loadData = False)
+    header = {attribute: getattr(abf, attribute) for attribute in header_attributes}
+    header['abfDateTime_is_date'] = isinstance(abf.abfDateTime, datetime.datetime)
+    header['abfDateTime'] = abf.abfDateTime.isoformat() if header['abfDateTime_is_date'] else str(abf.abfDateTime)
+    header['raw_dtype'] = np.dtype(abf._dtype).name ## int16 (scaled with the gain and offset of each channel) or float32
+    header['channel_gains'] = [float(gain) for gain in abf._dataGain]
+    header['channel_offsets'] = [float(offset) for offset in abf._dataOffset]
+    header['adc_gains'], header['dac_levels'] = read_gains_and_levels(abf)
+    header['cache_version'] = cache_version
+    return header
+
+
+def read_gains_and_levels(abf):
+    """
+    Returns the gain set in the acquisition software for each input channel (instrument scale factor x signal gain x
+    programmable gain x telegraphed gain, 1 = V recorded as V) and, for each output channel with a waveform, its name,
+    units and the levels of its epochs in every sweep (level + increment x sweep). Both are None for files without
+    these sections (ABF1).
+    """
+    try:
+        adc_section, dac_section, epoch_section = abf._adcSection, abf._dacSection, abf._epochPerDacSection
+    except AttributeError:
+        return None, None
+    adc_gains = []
+    for channel in range(abf.channelCount):
+        adc_gain = adc_section.fInstrumentScaleFactor[channel] * adc_section.fSignalGain[channel] * adc_section.fADCProgrammableGain[channel]
+        if adc_section.nTelegraphEnable[channel]:
+            adc_gain *= adc_section.fTelegraphAdditGain[channel]
+        adc_gains.append(float(adc_gain))
+    dac_levels = []
+    for dac_no, (dac_name, dac_units) in enumerate(zip(abf.dacNames, abf.dacUnits)):
+        if dac_no >= len(dac_section.nWaveformEnable) or not dac_section.nWaveformEnable[dac_no]:
+            continue
+        levels = [float(level + level_inc * sweep) for epoch_dac, level, level_inc in zip(epoch_section.nDACNum, epoch_section.fEpochInitLevel, epoch_section.fEpochLevelInc)
+                  if epoch_dac == dac_no for sweep in range(abf.sweepCount)]
+        dac_levels.append({'name': dac_name, 'units': dac_units, 'levels': sorted(set(levels))})
+    return adc_gains, dac_levels
+
+
+def add_to_cache(content_hash, channel, channel_data):
+    """
+    Saves the raw samples of a channel in the cache, then removes the least recently used traces above cache_budget_MB.
+    A channel bigger than the whole budget is not cached.
+    """
+    if channel_data.nbytes / 1e6 > cache_budget_MB:
+        return
+    channel_path = get_channel_path(content_hash, channel)
+    os.makedirs(cache_folder, exist_ok = True)
+    temporary_path = channel_path + '.' + str(os.getpid()) + '.tmp'
+    with open(temporary_path, 'wb') as channel_file:
+        np.save(channel_file, channel_data)
+    os.replace(temporary_path, channel_path)
+    evict(keep = content_hash)
+
+
+def get_cache_entries():
+    """
+    Returns a list of (last time used, size in bytes, content hash) of the cached traces, least recently used first.
+    """
+    if not os.path.isdir(cache_folder):
+        return []
+    entry_sizes = {}
+    for entry_name in os.listdir(cache_folder):
+        if entry_name.endswith('.tmp') or not os.path.isfile(os.path.join(cache_folder, entry_name)):
+            continue
+        content_hash = entry_name[:40] ## sha1 = 40 characters
+        try:
+            entry_sizes[content_hash] = entry_sizes.get(content_hash, 0) + os.path.getsize(os.path.join(cache_folder, entry_name))
+        except OSError: ## removed by another process
+            continue
+    cache_entries = []
+    for content_hash, entry_size in entry_sizes.items():
+        try:
+            cache_entries.append((os.path.getmtime(get_header_path(content_hash)), entry_size, content_hash))
+        except OSError: ## no header: entry left by a process that was stopped, used the longest time ago
+            cache_entries.append((0.0, entry_size, content_hash))
+    return sorted(cache_entries)
+
+
+def remove_entry(content_hash):
+    for entry_name in os.listdir(cache_folder):
+        if entry_name.startswith(content_hash):
+            try:
+                os.remove(os.path.join(cache_folder, entry_name))
+            except OSError:
+                pass
+
+
+def remove_path_records(content_hashes):
+    """
+    Removes the hashes remembered for the .abf files (see get_file_hash) whose content hash is one of content_hashes.
+    """
+    record_folder = get_path_record_folder()
+    if not content_hashes or not os.path.isdir(record_folder):
+        return
+    for record_name in os.listdir(record_folder):
+        record_path = os.path.join(record_folder, record_name)
+        try:
+            with open(record_path) as path_record_file:
+                if json.load(path_record_file)['content_hash'] in content_hashes:
+                    os.remove(record_path)
+        except (OSError, ValueError, KeyError): ## being written or removed by another process
+            continue
+
+
+def evict(keep = None):
+    """
+    Removes the least recently used traces, and the hashes remembered for them, until the cache is below cache_budget_MB.
+    1st term = content hash of a trace never to remove (the one being analysed)
+    """
+    cache_entries = get_cache_entries()
+    cache_size = sum(entry_size for _, entry_size, _ in cache_entries)
+    removed_hashes = set()
+    for _, entry_size, content_hash in cache_entries:
+        if cache_size / 1e6 <= cache_budget_MB:
+            break
+        if content_hash != keep:
+            remove_entry(content_hash)
+            removed_hashes.add(content_hash)
+            cache_size -= entry_size
+    remove_path_records(removed_hashes)
+
+
+def clear_cache():
+    shutil.rmtree(cache_folder, ignore_errors = True)
+
+
+def load_trace(file_path):
+    """
+    Opens an .abf file for the analysis scripts, from the cache when it was already opened before.
+    1st term = path of the .abf file
+    Returns a CachedTrace: abf.data and abf.get_channel() decode the channels when the script uses them
+    While traceIndex is used, every analysis of the recording gets the same CachedTrace (channels read once).
+    """
+    return traceIndex.get(('trace', os.path.abspath(file_path)), lambda: open_trace(file_path))
+
+
+def open_trace(file_path):
+    """
+    Opens an .abf file, see load_trace().
+    """
+    if not use_cache:
+        return CachedTrace(read_abf_header(file_path), None, file_path)
+
+    content_hash = get_file_hash(file_path)
+    header_path = get_header_path(content_hash)
+    try:
+        with open(header_path) as header_file:
+            header = json.load(header_file)
+        if header.get('cache_version') == cache_version:
+            os.utime(header_path) ## last time used, for the least recently used eviction
+            return CachedTrace(header, content_hash, file_path)
+        remove_entry(content_hash) ## saved by an older version of traceCache
+    except (OSError, ValueError):
+        pass
+
+    header = read_abf_header(file_path)
+    write_json(header_path, header)
+    return CachedTrace(header, content_hash, file_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check or empty the cache of .abf files')
+    parser.add_argument('--clear', action = 'store_true', help = 'remove all cached traces')
+    args = parser.parse_args()
+
+    if args.clear:
+        clear_cache()
+        print ('Removed ' + cache_folder)
+    else:
+        cache_entries = get_cache_entries()
+        print (str(len(cache_entries)) + ' traces in ' + cache_folder + ': ' + str(round(sum(entry[1] for entry in cache_entries) / 1e6, 1))
+               + 'MB of ' + str(cache_budget_MB) + 'MB')
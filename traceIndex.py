@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keeps what the analyses of one recording have in common while several analysis scripts are run on it one after the
+other (e.g. Excitatory_Opsin_Current_Clamp, Excitatory_Opsin_Current_Clamp_Frequency and the inhibitory current clamp
+scripts on the same cell), see Batch_Analysis.analyse_recording.
+
+Each script opens the .abf file, finds the LED and current pulses and the spikes and cuts the epochs around the pulses.
+Between start() and stop() the first script to calculate one of these keeps it here and the next scripts get it back:
+- traceCache.load_trace() returns the trace already opened, with the channels already read and converted
+- channel > threshold (traceCache.TraceChannel.compare) returns the boolean trace of the same channel, baseline and threshold
+- pulseEpochs.find_pulses() returns the pulses already found in the same boolean trace
+- spikeEpochs.find_spikes() runs find_peaks once per voltage channel and keeps the spikes over the height asked for
+- TraceChannel.extract_epochs() returns the epochs already cut from the same channel with the same bounds
+- ledPower reads each LED power table once, not once per script
+Scripts run on their own (index is None) calculate everything as before. The results are the same as running the
+scripts one by one: the scripts never change these arrays, they only make new ones from them.
+"""
+
+index = None ## dictionary key -> value shared by the analyses of the recording being analysed, None when not shared
+
+
+def start():
+    """
+    Starts a new index, for the analyses of one recording.
+    """
+    global index
+    index = {}
+
+
+def stop():
+    """
+    Removes the index (and frees the arrays kept in it), the next scripts calculate everything themselves.
+    """
+    global index
+    index = None
+
+
+def get(key, calculate):
+    """
+    Returns the value kept for key, or calculates it with calculate() and keeps it while the index is used.
+    1st term = tuple naming the value (e.g. ('pulses', ...)), values with an unhashable key (e.g. an array) are not kept
+    2nd term = function without argument returning the value
+    """
+    if index is None:
+        return calculate()
+    try:
+        if key in index:
+            return index[key]
+    except TypeError: ## e.g. a baseline subtracted as an array
+        return calculate()
+    index[key] = calculate()
+    return index[key]
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Figures drawn by the analysis scripts for a visual check up of each trace.
+
+Each figure is drawn by one function that only takes the data points to plot (arrays and lists) and returns the figure.
+This way the scripts can either draw the figure straight away (when run by hand) or hand it over to plotRendering,
+which draws and saves it in a background process while the analysis goes on (when run with Batch_Analysis).
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+
+def plot_pulse_responses(data_plot, time_points_plot, subplot_titles, markers_on, title, xlabel, figsize, wspace):
+    """
+    Figure with one subplot per pulse showing the response to the pulse (used by all LED stim analyses).
+    1st term = list of data points to plot, one array per pulse
+    2nd term = list of time points (ms), one array per pulse
+    3rd term = list of subplot titles, one per pulse (e.g. LED power)
+    4th term = index of the points marked with a magenta dot (e.g. LED ON / OFF)
+    5th term = figure title
+    6th term = x axis label
+    7th and 8th term = figure size and space between subplots
+    """
+    fig = plt.figure(figsize = figsize)
+    fig.subplots_adjust(wspace = wspace)
+
+    for counter, (data, time, subplot_title) in enumerate (zip (data_plot, time_points_plot, subplot_titles), start = 1):
+        sub = plt.subplot(2,len(data_plot),counter)
+        sub.plot (time, data, '-om', markevery = markers_on, markerfacecolor="m", markeredgecolor = 'w', linewidth=0.3, color = '0.2')
+        sub.tick_params (axis = 'x', colors='black')
+        sub.spines['bottom'].set_color('black')
+        sub.set_title(subplot_title, color = '0.2')
+        plt.setp(sub.get_xticklabels(), visible = True)
+        plt.xlabel(xlabel)
+        plt.ylabel('Photocurrent (pA)')
+        plt.suptitle(title, fontsize=16)
+
+        sns.despine()
+    return fig
+
+
+def plot_full_trace(time, top_trace, bottom_trace, top_ylim, bottom_ylim, xlim, top_ylabel, bottom_ylabel):
+    """
+    Figure with the full recorded trace (top) above the stimulus trace (bottom).
+    1st term = time points (s) of one sweep (abf.sweepX)
+    2nd and 3rd term = data points of the top and bottom traces, the sweeps of an episodic protocol are drawn on top of each other
+    4th and 5th term = (min, max) of the y axis of the top and bottom traces
+    6th term = (min, max) of the x axis, (min,) to go until the end of the trace
+    7th and 8th term = y axis labels of the top and bottom traces
+    """
+    top_trace, bottom_trace = np.asarray(top_trace), np.asarray(bottom_trace) ## channels kept as raw samples (see traceCache) are converted here, in the render process
+    top_trace, bottom_trace = top_trace.reshape(-1, len(time)).T, bottom_trace.reshape(-1, len(time)).T ## one column per sweep
+    fig = plt.figure(figsize =(15,5))
+
+    sub1 = plt.subplot(211, )
+    sub1.plot(time, top_trace, linewidth=0.5, color = '0.2')
+    plt.ylim(*top_ylim) #for y axis
+    plt.xlim(*xlim) #for x axiss
+    plt.ylabel(top_ylabel)
+    sub1.spines['left'].set_color('0.2')
+    sub1.spines['bottom'].set_color('white')
+    sub1.tick_params(axis='y', colors='0.2')
+    sub1.tick_params(axis='x', colors='white')
+    plt.setp(sub1.get_xticklabels(), visible = False)
+    sns.despine()
+
+    sub2 = plt.subplot(212, sharex=sub1)
+    plt.plot(time, bottom_trace, linewidth=0.5, color = '0.2')
+    plt.ylim(*bottom_ylim) #for y axis
+    plt.xlim(*xlim) #for x axis
+    plt.xlabel('time (s)')
+    plt.ylabel(bottom_ylabel)
+    sub2.spines['left'].set_color('0.2')
+    sub2.spines['bottom'].set_color('white')
+    sub2.tick_params(axis='y', colors='0.2')
+    sub2.tick_params(axis='x', colors='0.2')
+    sns.despine()
+    return fig
+
+
+def plot_current_injection(time_plot_I_injection, voltage_data, current_data):
+    """
+    Figure with the voltage response (top) to a current injection (bottom).
+    """
+    fig = plt.figure(figsize =(2,4))
+    sub1 = plt.subplot(2,1,1)
+    sub1.plot(time_plot_I_injection, voltage_data, linewidth=1, color = '0.2')
+    sub1.set_title('Current Injection Response', color = '0.2')
+    sub1.tick_params(axis='x', colors='white')
+    sub1.spines['bottom'].set_color('white')
+    plt.setp(sub1.get_xticklabels(), visible = False)
+    sns.despine()
+
+    sub2 = plt.subplot(2,1,2)
+    sub2.plot(time_plot_I_injection, current_data, linewidth=0.5, color = '0.2')
+    plt.xlabel('Time (ms)')
+    sns.despine()
+    return fig
+
+
+def plot_pulse_spikes(pulse_times, voltage_points, current_points, pulse_names):
+    """
+    Figure with the spike (top) triggered by the chosen current pulse (bottom) of each pulse duration, one column per duration.
+    1st term = list of time points (ms), one array per pulse duration
+    2nd and 3rd term = list of voltage and current data points, one array per pulse duration
+    4th term = list of pulse names (e.g. '1ms Pulse')
+    """
+    colors = [str(round(level, 2)) for level in np.linspace(0.8, 0.4, len(pulse_names))] ## light to dark grey
+    fig = plt.figure(figsize =(10,5))
+    for counter, (time, voltage, pulse_name, color) in enumerate(zip(pulse_times, voltage_points, pulse_names, colors), start = 1):
+        sub = plt.subplot(2, len(pulse_names), counter)
+        sub.plot(time, voltage, color = color)
+        sub.set_title(pulse_name, color = '0.8' if counter == 1 else '0.4')
+        sub.tick_params(axis='x', colors='white')
+        sub.spines['bottom'].set_color('white')
+        plt.setp(sub.get_xticklabels(), visible = False)
+        sns.despine()
+
+    for counter, (time, current, color) in enumerate(zip(pulse_times, current_points, colors), start = len(pulse_names) + 1):
+        sub = plt.subplot(2, len(pulse_names), counter)
+        sub.plot(time, current, color = color)
+        plt.xlabel('Time (ms)')
+        sns.despine()
+    return fig
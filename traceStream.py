@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Functions used to analyse long gap-free recordings (e.g. 30-60 min at 20kHz) chunk by chunk, so that the memory used
+depends on chunk_points and not on the length of the recording.
+
+stream_pulse_epochs() reads chunk_points points of each channel at a time (channel[start:stop] of a
+traceCache.TraceChannel only reads and converts these points), finds the pulses of the stimulus (e.g. current
+injected over 10pA) and yields each pulse with its epoch (points before the pulse + pulse + points after the pulse)
+as soon as all its points have been read. A pulse or an epoch cut by the end of a chunk is completed with the next
+chunk: the points not yet used (the open pulse and the points before it) are kept from one chunk to the next. The pulses
+found are the same as with pulseEpochs.find_pulses() on the whole trace.
+
+TraceEnvelope keeps the min and max of every envelope_bin_points points of each channel, enough to plot the full
+trace without keeping all its points.
+"""
+
+from collections import deque
+
+import numpy as np
+
+chunk_points = 2**20 ## points of each channel read at once (about 52s at 20kHz)
+max_epoch_points = 2**22 ## longest epoch kept while waiting for the end of its pulse, a longer pulse stops the analysis
+envelope_bin_points = 2**9 ## points of each channel summarised by their min and max in TraceEnvelope
+
+
+class TraceEnvelope:
+    """
+    Min and max of every envelope_bin_points points of each channel, added chunk by chunk (see stream_pulse_epochs).
+    """
+
+    def __init__(self, channel_count, sec_per_point):
+        self.sec_per_point = sec_per_point
+        self.bin_starts = []
+        self.channel_bins = [[] for _ in range(channel_count)]
+
+    def add(self, start, chunks):
+        """
+        Adds the chunks (one array per channel) starting at point start. Chunks are split in bins from their start,
+        so chunk_points should be a multiple of envelope_bin_points.
+        """
+        bin_edges = np.arange(0, len(chunks[0]), envelope_bin_points)
+        self.bin_starts.append(start + bin_edges)
+        for bins, chunk in zip(self.channel_bins, chunks):
+            bins.append(np.stack([np.minimum.reduceat(chunk, bin_edges), np.maximum.reduceat(chunk, bin_edges)], axis = 1).ravel())
+
+    def get_time(self):
+        """
+        Returns the time (s) of each point of the envelope: start of the bin, twice (min and max).
+        """
+        return np.repeat(np.concatenate(self.bin_starts), 2) * self.sec_per_point
+
+    def get_channel(self, channel):
+        """
+        Returns the min and max of each bin of a channel, one after the other.
+        """
+        return np.concatenate(self.channel_bins[channel])
+
+
+def stream_pulse_epochs(channels, pulse_on, pre_points = 0, post_points = 0, envelope = None):
+    """
+    Finds the pulses of a trace chunk by chunk and yields them with their epochs, in order.
+    1st term = list of channels read together (e.g. [voltage_trace, current_trace]), all of the same length
+    2nd term = function returning the boolean trace (True where the stimulus is ON) from the chunks of the channels,
+               e.g. lambda chunks: chunks[1] > 10
+    3rd term = number of points added before the 1st point of each pulse
+    4th term = number of points added after the last point of each pulse
+    5th term = TraceEnvelope the chunks are added to (None for no envelope)
+    Yields (onset, offset, epochs) for each pulse: index of the 1st point of the pulse, index after its last point
+    (as find_pulses) and a list with the points of each channel from onset - pre_points to offset + post_points.
+    """
+    trace_points = len(channels[0])
+    buffers = [np.zeros(0, dtype = np.float32) for _ in channels] ## points of each channel not used yet
+    buffer_start = 0
+    last_on = False ## stimulus ON at the last point of the previous chunk
+    open_onset = None ## onset of a pulse still ON at the end of the previous chunk
+    pending_pulses = deque() ## pulses found whose epoch goes beyond the points read, in the order of their onset
+
+    for start in range(0, trace_points, chunk_points):
+        stop = min(start + chunk_points, trace_points)
+        chunks = [np.asarray(channel[start:stop]) for channel in channels]
+        if envelope is not None:
+            envelope.add(start, chunks)
+
+        stimulus_on = np.asarray(pulse_on(chunks), dtype = bool)
+        edges = np.flatnonzero(stimulus_on != np.concatenate([[last_on], stimulus_on[:-1]])) + start ## rising and falling edges, also on the chunk boundary
+        if open_onset is not None:
+            edges = np.concatenate([[open_onset], edges])
+        open_onset = edges[-1] if len(edges) % 2 else None
+        pending_pulses.extend(zip(edges[0:len(edges) - 1:2], edges[1::2]))
+        last_on = bool(stimulus_on[-1])
+        if stop == trace_points and open_onset is not None: ## trace ends during a pulse
+            pending_pulses.append((open_onset, trace_points))
+            open_onset = None
+
+        buffers = [np.concatenate([buffer, chunk]) for buffer, chunk in zip(buffers, chunks)]
+        while pending_pulses and (pending_pulses[0][1] + post_points <= stop or stop == trace_points):
+            onset, offset = pending_pulses.popleft()
+            epoch_start, epoch_end = onset - pre_points, offset + post_points
+            if epoch_start < 0 or epoch_end > trace_points:
+                raise IndexError ('Data points requested around the pulses go beyond the start or end of the trace (' + str(trace_points) + ' points)')
+            yield int(onset), int(offset), [buffer[epoch_start - buffer_start:epoch_end - buffer_start].copy() for buffer in buffers]
+
+        ## keep the points the next pulses may need: from the 1st pulse not used yet (or the next one) minus pre_points
+        keep_start = min([stop] + ([pending_pulses[0][0]] if pending_pulses else []) + ([open_onset] if open_onset is not None else [])) - pre_points ## 1st pending pulse = smallest onset
+        keep_start = max(keep_start, buffer_start)
+        if stop - keep_start > max_epoch_points:
+            raise ValueError ('Pulse starting at point ' + str(keep_start + pre_points) + ' is longer than ' + str(max_epoch_points) + ' points, increase traceStream.max_epoch_points')
+        buffers = [buffer[keep_start - buffer_start:] for buffer in buffers]
+        buffer_start = keep_start